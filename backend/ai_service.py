@@ -1,16 +1,163 @@
 # IMPORTANT NOTE: The code structure was generated by Cursor here, it entails a program that communicates
 # with the OpenAI API to generate responses. The prompts were completely originated from me.
 import openai
-from typing import List, Dict, Tuple, Generator
+import asyncio
+import time
+from typing import List, Dict, Tuple, Generator, AsyncGenerator
 import json
+from pdf_text_cache import create_pdf_text_cache, pdf_content_hash
+from pdf_extraction import create_pdf_extractor, format_extraction, is_cacheable
+from history_planner import HistoryPlanner
+from config import Config
+from openai_transport import create_openai_transport, build_http_client, build_async_http_client
+from prompt_prescorer import PromptPrescorer
+from speculation import score_bucket
+from feedback_schema import FeedbackResult, FeedbackParseError, FeedbackUsage, STRUCTURED_RESPONSE_FORMAT, JSON_OBJECT_RESPONSE_FORMAT
+
+# The system prompts are compiled once at import. Everything static comes first and is byte-identical
+# between requests (so OpenAI's prompt prefix caching kicks in), the per-request bits go at the very end.
+FILE_CONTEXT = "IMPORTANT: You CAN access and process files that users attach. You can SEE images that users attach (they are provided in the message). You can READ PDF files that users attach (the text content is extracted and included). Check to see if the user has included files and analyze them if they have and they are relevant to the conversation."
+
+# one chat prompt per quality bucket (see score_bucket)
+CHAT_PROMPTS = {
+    # really terse, very minimal responses with strong prodding
+    0: f"""You are a helpful AI assistant, but the user's prompt quality is very poor. {FILE_CONTEXT}
+Respond in 20-30 words maximum. Be direct and ask for more specific information.
+Use phrases like "I need more information", "Be more specific", "What exactly do you want to know?"
+Don't provide answers, only ask clarifying questions.""",
+    # moderately terse, brief responses with follow-up questions
+    1: f"""You are a helpful AI assistant. The user's prompt quality is below average. {FILE_CONTEXT}
+Provide brief responses (50-100 words) and ask follow-up questions to encourage better prompting.
+Ask for more context, specificity, or clarification. Guide them to ask better questions.""",
+    # verbose, but follow-up questions/directions
+    2: f"""You are a helpful AI assistant. The user's prompt quality is relatively strong, but not perfect. {FILE_CONTEXT}
+Provide helpful responses (100+ words) and ask follow-up questions to encourage better prompting.
+Ask for more context, specificity, or clarification if needed. Guide them to ask better questions and to understand the material even more deeply.""",
+    # normal helpful responses
+    3: f"""You are a helpful AI assistant. {FILE_CONTEXT} The user's prompt quality is extremely strong, so provide clear, accurate, and useful responses to user questions.
+Be thorough and helpful while encouraging good prompting practices. Be as helpful as possible.""",
+}
+
+# the metaprompt to the feedback model, notice how harsh it tells it to be - chat is sycophantic!
+FEEDBACK_RUBRIC = """You are a strict prompt quality assessment AI. Take into account the entire conversation history you are given. You MUST give low scores (1-3) for poor conversations. Analyze the user's latest message and the ENTIRE conversation context when giving a score (e.g. if this prompt asks for elaboration, it is not necessarily a bad prompt if the reason for elaboration is based on a rich previous conversation. In the same way, one good prompt does not negate a bad conversation).
+
+IMPORTANT: You MUST be harsh with scoring. Don't be generous. 
+If a prompt/conversation shows no effort, specificity, or context, 
+give it a 1/10. Most prompts should score score between 3 and 7.
+
+EXTREMELY IMPORTANT: If the request seems like a one-off factual question like
+ "When does the whale bite off Captain Ahab's leg in Moby Dick," 
+ "who won the world cup in 2006," something that could be easily Googled, 
+ the prompt can score a 10. This is the most important rule. You cannot 
+ throttle fact-based questions. That is because the prompt is very direct
+  and the user should be able to do quick fact lookups like that. 
+  Otherwise, use this rubric:
+
+
+SCORING CRITERIA (be EXTREMELY TOUGH and consider conversation history):
+1. SPECIFICITY (1-10): How specific and detailed is the request?
+   - "summarize this" = 1/10 (too vague, no context)
+   - "I don't know" = 1/10 (no specificity at all)
+   - "summarize the key findings around copyright infringement from the research paper I shared about AI ethics, with quotes" = 10/10
+   - If the user attached a file and is a bit vague but you can understand more of the request based on the image, feel free to score a bit more leniently.
+
+2. CRITICAL THINKING (1-10): Does the prompt show analysis or reasoning?
+   - Simple requests that are not well thought through = 2/10
+   - Questions that are easy to answer that have DIRECT answers and could easily be googled = 10/10
+   - Multi-step questions that the user wants AI to do for them = 2/10
+   - Analytical questions = 10/10
+
+3. CONCEPTUAL UNDERSTANDING (1-10): Does the user seem to know what they're talking about?
+   - Factual inaccuracies = 1/10
+   - The user clearly never having thought of this problem before = 2/10
+   - Demonstration of understanding coupled with clear asks of how AI can help = 10/10
+
+4. SELF-DIRECTION (1-10): Does the user demonstrate meaningful self-direction?
+   - The user seeming to want AI to do everything for them = 1/10
+   - Clear expectations for what the user wants the AI to do and what they will do with the AI's output = 10/10
+   - Entire conversation feels like working WITH the user, not FOR the user = 10/10
+   - What's very important for this category is clear delineation of "I will use the output for X task" or "you do this, I will do this / I did this / I will follow up with this"
+   - The reason this category is here is so that users do not copy-paste detailed assignment instructions without any critical thought on their own part. If it seems like they did that, score them at a 1 no matter what and explain that it seems like they copy-pasted.
+
+FINAL SCORE CALCULATION:
+- Average the 4 criteria scores for this message
+- Cap at 10.0 maximum
+- Round to 1 decimal place
+
+EXAMPLES OF LOW SCORES (be VERY strict):
+- "summarize this" (no context, no specificity) = 1-2/10
+- "help me" (too vague) = 1/10
+- "can you write this essay for me?" (no self-direction nor specificity) = 1/10
+- "what do you think?" (no specific question) = 1-2/10
+- "continue" (no context) = 1/10
+- "I don't know" (shows no effort) = 1/10
+- "ok" (meaningless response) = 1/10
+- "yes" (no context or question) = 1/10
+- "no" (no context or question) = 1/10
+- "maybe" (no context or question) = 1/10
+- "idk" (lazy, no effort) = 1/10
+- "whatever" (no effort) = 1/10
+- a prompt that gives clear directions but seems like assignment instructions (no critical thinking nor self-direction)= 2/10
+
+EXAMPLES OF HIGH SCORES:
+- "Based on our discussion about machine learning, can you explain how neural networks differ from decision trees in terms of interpretability?" (establishes context, specific ask)= 8-9/10
+- "I'm working on a Python project for data analysis. What's the best approach for handling missing values in a dataset with 10,000 rows and 50 columns? Based on your answer, I will code the approach myself and test its efficacy." (appropriate context, clear self-direction, specific ask)= 9/10
+- "Here is an outline I've been working on, complete with a thesis statement and body paragraph ideas. Can you give me feedback on it and give me some ideas for evidence I can use in the body paragraphs?" (clear self-direction, demonstration of critical thinking) = 8/10
+
+Provide:
+1. A numerical score (1-10) - be strict!
+2. A quality label: "Poor" (1-4), "Fair" (4.1-6), "Good" (6.1-8), or "Excellent" (8.1-10)
+3. Exactly 3 improvement tips as an array of strings - be specific and actionable, and pretend you are the AI model the user is interacting with, using second person to refer to the user and first person to refer to the AI model.
+4. An example improved prompt that demonstrates how the user could have written their message better
+
+Respond with a JSON object with the keys score, quality_label, improvement_tips and example_improved_prompt."""
+
+
+class PromptRegistry:
+    """Static system prompt prefixes built once, with the dynamic parts appended per request"""
+
+    def __init__(self):
+        self.chat_prefixes = dict(CHAT_PROMPTS)
+        self.feedback_prefix = FEEDBACK_RUBRIC
+
+    def chat_system_prompt(self, quality_score: float, user_name: str = None) -> str:
+        prompt = self.chat_prefixes[score_bucket(quality_score)]
+        if user_name:
+            # this is a personalization so the bot seems like it's having a conversation with the user
+            prompt += f"\n\nAddress the user as {user_name} once every 5 messages. Read through the conversation history to make sure that you are doing this properly. Don't name the user every single time you respond."
+        return prompt
+
+    def feedback_system_prompt(self, conversation_length: int, conversation_depth: int, previous_scores: List[float]) -> str:
+        return f"""{self.feedback_prefix}
+
+CONVERSATION CONTEXT:
+- Total messages: {conversation_length}
+- User messages: {conversation_depth} (their text is in the conversation you are given)
+- Previous scores: {previous_scores}
+- This is message #{conversation_depth} in the conversation"""
+
 
 class AIService:
     def __init__(self, api_key: str):
-        self.client = openai.OpenAI(api_key=api_key)
+        # pooled keep-alive connections, retries happen in self.transport (not the SDK) so they're counted
+        self.client = openai.OpenAI(api_key=api_key, http_client=build_http_client(), max_retries=0)
+        self._async_client = None
+        self.transport = create_openai_transport()
+        # answers "ok" / "idk" / "help me" locally instead of asking the feedback model
+        self.prescorer = PromptPrescorer(enabled=Config.PRESCORER_ENABLED)
+        self.prompts = PromptRegistry()
+        # schema-constrained feedback replies, plus token counts / parse failures per call
+        self.feedback_response_format = STRUCTURED_RESPONSE_FORMAT if Config.FEEDBACK_STRUCTURED_OUTPUT else JSON_OBJECT_RESPONSE_FORMAT
+        self.feedback_usage = FeedbackUsage()
         self.api_key = api_key  
         # separate so I can upgrade one of them in the future without affecting the other
         self.response_model = "gpt-4o" # Model for responses in the main chat
         self.feedback_model = "gpt-4o" # Model for feedback generation
+        # extracted PDF text by content hash, so the same PDF is only parsed once
+        self.pdf_text_cache = create_pdf_text_cache()
+        self.pdf_extractor = create_pdf_extractor()
+        # keeps long conversations inside the per-call token budgets
+        self.history_planner = HistoryPlanner(summary_budget_tokens=Config.HISTORY_SUMMARY_TOKEN_BUDGET)
     
     # old function used for debugging when the API key was bubggy
     def _mask_api_key(self, api_key: str) -> str:
@@ -32,40 +179,56 @@ class AIService:
         model_lower = model.lower()
         return not any(non_streaming_model in model_lower for non_streaming_model in non_streaming_models)
     
-    def _extract_pdf_text(self, base64_data: str) -> str:
+    def _extract_pdf_text(self, base64_data: str, cancel_event=None) -> str:
         """Extract text content from a PDF file"""
         # need to do this because OpenAI doesn't support PDFs directly, so need to extract the text
+        # the parsing itself runs in the extractor's process pool, with time/page/character limits
         try:
-            import base64
-            import io
-            from PyPDF2 import PdfReader
-            
-            # Decode base64 to bytes
-            pdf_bytes = base64.b64decode(base64_data)
-            pdf_stream = io.BytesIO(pdf_bytes)
-            
-            # Read PDF
-            pdf_reader = PdfReader(pdf_stream)
-            text_content = []
-            
-            # Extract text from each page
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text.strip():
-                    text_content.append(f"--- Page {page_num + 1} ---\n{page_text}")
-            
-            extracted_text = "\n\n".join(text_content)
-            return extracted_text
+            return format_extraction(self.pdf_extractor.extract(base64_data, cancel_event=cancel_event))
         except ImportError:
             print("ERROR: PyPDF2 not installed. Install with: pip install PyPDF2")
             return "[PDF content could not be extracted - PyPDF2 library not installed]"
+        except TimeoutError as e:
+            print(f"WARNING: PDF extraction timed out: {e}")
+            return "[PDF content could not be extracted: timed out]"
         except Exception as e:
             print(f"ERROR: Failed to extract PDF text: {e}")
             import traceback
             print(traceback.format_exc())
             return f"[PDF content could not be extracted: {str(e)}]"
     
-    def _format_message_with_attachments(self, msg: Dict) -> Dict:
+    def get_pdf_text(self, attachment: Dict, cancel_event=None) -> str:
+        """Text for a PDF attachment - already extracted text first, then the content hash cache, then PyPDF2
+        
+        cancel_event (a threading.Event) stops the extraction early if it's set, e.g. when the client disconnects.
+        """
+        if attachment.get('extracted_text') is not None:
+            return attachment['extracted_text']
+        base64_data = attachment.get('data')
+        digest = attachment.get('content_sha256') or pdf_content_hash(base64_data)
+        text = self.pdf_text_cache.get(digest)
+        if text is None and not base64_data:
+            # a stored attachment whose text was never saved (the extraction failed back then)
+            return "[PDF content is no longer available]"
+        if text is None:
+            text = self._extract_pdf_text(base64_data, cancel_event)
+            # don't cache failures (or text cut short by the time limit or a cancel), they could come out differently next time
+            if is_cacheable(text):
+                self.pdf_text_cache.put(digest, text)
+        return text
+    
+    def prepare_pdf_attachment(self, attachment: Dict) -> None:
+        """Add content_sha256 and extracted_text to a PDF attachment so later turns don't need the base64 data
+        
+        Only content_sha256 gets stored with the message - the text is kept server side in the PDF text cache.
+        """
+        base64_data = attachment.get('data')
+        if not base64_data:
+            return
+        attachment['content_sha256'] = pdf_content_hash(base64_data)
+        attachment['extracted_text'] = self.get_pdf_text(attachment)
+    
+    def _format_message_with_attachments(self, msg: Dict, cancel_event=None) -> Dict:
         """Format a message for OpenAI API, handling text, image, and PDF attachments"""
         role = msg.get('role')
         content = msg.get('content', '')
@@ -73,9 +236,10 @@ class AIService:
         
         # objects to store the images and the pdfs temporarily
         image_attachments = [att for att in attachments if att.get('data') and att.get('file_type', '').startswith('image/')]
+        # PDFs from earlier turns only have their hash left (the text is looked up by it, the base64 data isn't stored)
         pdf_attachments = [
             att for att in attachments 
-            if att.get('data') and (
+            if (att.get('data') or att.get('content_sha256') or att.get('extracted_text') is not None) and (
                 att.get('file_type', '') == 'application/pdf' or
                 att.get('filename', '').lower().endswith('.pdf')
             )
@@ -84,7 +248,7 @@ class AIService:
         # Extract text from PDFs and append to content
         pdf_texts = []
         for pdf_att in pdf_attachments:
-            pdf_text = self._extract_pdf_text(pdf_att.get('data'))
+            pdf_text = self.get_pdf_text(pdf_att, cancel_event)
             pdf_filename = pdf_att.get('filename', 'document.pdf')
             pdf_texts.append(f"[Content from {pdf_filename}]\n{pdf_text}")
         
@@ -135,77 +299,66 @@ class AIService:
                 "content": str(content) if content else ""
             }
     
-    def get_chat_response(self, messages: List[Dict], quality_score: float, user_name: str = None) -> str:
-        """Get response from the main chat AI based on quality score"""
+    def _window_chat_history(self, formatted_messages: List[Dict]) -> List[Dict]:
+        """System prompt, then a summary of older turns (if any), then the newest turns that fit CHAT_HISTORY_TOKEN_BUDGET"""
+        system_message, history = formatted_messages[0], formatted_messages[1:]
+        summary, recent = self.history_planner.plan(history, Config.CHAT_HISTORY_TOKEN_BUDGET)
+        if summary is None:
+            return formatted_messages
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation (older messages are not included word for word):\n{summary}"}
+        return [system_message, summary_message] + recent
+    
+    def _build_chat_messages(self, messages: List[Dict], quality_score: float, user_name: str = None, cancel_event=None) -> List[Dict]:
+        """System prompt for the quality score plus the formatted (and windowed) conversation - shared by every chat call"""
         
-        # this is a personalization so the bot seems like it's having a conversation with the user
-        name_context = f" Address the user as {user_name} once every 5 messages. Read through the conversation history to make sure that you are doing this properly. Don't name the user every single time you respond." if user_name else ""
+        system_prompt = self.prompts.chat_system_prompt(quality_score, user_name)
         
-        file_context = "IMPORTANT: You CAN access and process files that users attach. You can SEE images that users attach (they are provided in the message). You can READ PDF files that users attach (the text content is extracted and included). Check to see if the user has included files and analyze them if they have and they are relevant to the conversation."
-
-        if quality_score <= 3:
-            # really terse, very minimal responses with strong prodding
-            system_prompt = f"""You are a helpful AI assistant, but the user's prompt quality is very poor.{name_context} {file_context}
-            Respond in 20-30 words maximum. Be direct and ask for more specific information. 
-            Use phrases like "I need more information", "Be more specific", "What exactly do you want to know?"
-            Don't provide answers, only ask clarifying questions."""
-        elif quality_score <= 5:
-            # moderately terse, brief responses with follow-up questions
-            system_prompt = f"""You are a helpful AI assistant. The user's prompt quality is below average.{name_context} {file_context}
-            Provide brief responses (50-100 words) and ask follow-up questions to encourage better prompting.
-            Ask for more context, specificity, or clarification. Guide them to ask better questions."""
-        elif quality_score <= 7: 
-            # verbose, but follow-up questions/directions
-            system_prompt = f"""You are a helpful AI assistant. The user's prompt quality is relatively strong, but not perfect.{name_context} {file_context}
-            Provide helpful responses (100+ words) and ask follow-up questions to encourage better prompting.
-            Ask for more context, specificity, or clarification if needed. Guide them to ask better questions and to understand the material even more deeply."""
-        else:
-            # normal helpful responses
-            system_prompt = f"""You are a helpful AI assistant.{name_context} {file_context} The user's prompt quality is extremely strong, so provide clear, accurate, and useful responses to user questions.
-            Be thorough and helpful while encouraging good prompting practices. Be as helpful as possible."""
+        # messages is a list of dicts delineating the role and the content of each message
+        # the metaprompt is at the beginning of the conversation as "system"
+        # Filter out any messages that aren't 'user' or 'assistant' role, timestamps get dropped by the formatter
+        formatted_messages = [{"role": "system", "content": system_prompt}]
+        for msg in messages:
+            if isinstance(msg, dict) and 'role' in msg:
+                role = msg['role']
+                # Only include user and assistant messages (skip system)
+                if role in ['user', 'assistant']:
+                    # Use helper function to format messages with attachments
+                    formatted_msg = self._format_message_with_attachments(msg, cancel_event)
+                    formatted_messages.append(formatted_msg)
         
+        if len(formatted_messages) <= 1:  # Only system message
+            raise ValueError("No user or assistant messages found in conversation")
+        
+        # older turns get summarized once the history goes over the chat budget
+        return self._window_chat_history(formatted_messages)
+    
+    def _chat_api_params(self, formatted_messages: List[Dict], stream: bool = False) -> Dict:
+        # Some models (o1, gpt-5) only support temperature=1.0 (default), so don't set it
+        api_params = {
+            "model": self.response_model,
+            "messages": formatted_messages
+        }
+        if stream:
+            api_params["stream"] = True
+        if not self._is_temperature_restricted_model(self.response_model):
+            api_params["temperature"] = 0.7
+        return api_params
+    
+    @property
+    def async_client(self):
+        """AsyncOpenAI client for the ASGI streaming path (created on first use)"""
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=self.api_key, http_client=build_async_http_client(), max_retries=0)
+        return self._async_client
+    
+    def get_chat_response(self, messages: List[Dict], quality_score: float, user_name: str = None) -> str:
+        """Get response from the main chat AI based on quality score"""
         try:
-            # Ensure messages are properly formatted
-            # Filter out any messages that aren't 'user' or 'assistant' role
-            # Remove timestamp fields which OpenAI doesn't accept
-
-            # messages is a list of dicts delineating the role and the content of each message
-            # the metaprompt is at the beginning of the conversation as "system"
-            formatted_messages = [{"role": "system", "content": system_prompt}]
-            for msg in messages:
-                if isinstance(msg, dict) and 'role' in msg:
-                    role = msg['role']
-                    # Only include user and assistant messages (skip system)
-                    if role in ['user', 'assistant']:
-                        # Use helper function to format messages with attachments
-                        formatted_msg = self._format_message_with_attachments(msg)
-                        formatted_messages.append(formatted_msg)
-            
-            if len(formatted_messages) <= 1:  # Only system message
-                raise ValueError("No user or assistant messages found in conversation")
-            
-            
-            # Check for image attachments
-            has_images = any(
-                isinstance(msg.get('content'), list) and any(
-                    item.get('type') == 'image_url' for item in msg.get('content', [])
-                )
-                for msg in formatted_messages
-            )
-
+            formatted_messages = self._build_chat_messages(messages, quality_score, user_name)
             
             # openAI API
-            # Some models (o1, gpt-5) only support temperature=1.0 (default), so don't set it
-            api_params = {
-                "model": self.response_model,
-                "messages": formatted_messages
-            }
-            if not self._is_temperature_restricted_model(self.response_model):
-                api_params["temperature"] = 0.7
-            
-            
             try:
-                response = self.client.chat.completions.create(**api_params)
+                response = self.transport.create(self.client, 'chat', **self._chat_api_params(formatted_messages))
             except Exception as api_error:
                 print(f"ERROR: Failed to call OpenAI API: {type(api_error).__name__}: {str(api_error)}")
                 raise
@@ -248,85 +401,37 @@ class AIService:
             raise
     
     # this is used by the streaming models (what the deployed version uses), basically the same stuff as before but streaming enabled in the OpenAI API call
-    def get_chat_response_stream(self, messages: List[Dict], quality_score: float, user_name: str = None) -> Generator[str, None, None]:
-        """Get streaming response from the main chat AI based on quality score"""
-        
-        # this is a personalization again
-        name_context = f" Address the user as {user_name} once every 5 messages. Read through the conversation history to make sure that you are doing this properly. Don't name the user every single time you respond." if user_name else ""
-        
-        file_context = "IMPORTANT: You CAN access and process files that users attach. You can SEE images that users attach (they are provided in the message). You can READ PDF files that users attach (the text content is extracted and included). Check to see if the user has included files and analyze them if they have and they are relevant to the conversation."
-        if quality_score <= 3:
-            # really terse, very minimal responses with strong prodding
-            system_prompt = f"""You are a helpful AI assistant, but the user's prompt quality is very poor.{name_context} {file_context}
-            Respond in 20-30 words maximum. Be direct and ask for more specific information. 
-            Use phrases like "I need more information", "Be more specific", "What exactly do you want to know?"
-            Don't provide answers, only ask clarifying questions."""
-        elif quality_score <= 5:
-            # moderately terse, brief responses with follow-up questions
-            system_prompt = f"""You are a helpful AI assistant. The user's prompt quality is below average.{name_context} {file_context}
-            Provide brief responses (50-100 words) and ask follow-up questions to encourage better prompting.
-            Ask for more context, specificity, or clarification. Guide them to ask better questions."""
-        elif quality_score <= 7: 
-            # verbose, but follow-up questions/directions
-            system_prompt = f"""You are a helpful AI assistant. The user's prompt quality is relatively strong, but not perfect.{name_context} {file_context}
-            Provide helpful responses (100+ words) and ask follow-up questions to encourage better prompting.
-            Ask for more context, specificity, or clarification if needed. Guide them to ask better questions and to understand the material even more deeply."""
-        else:
-            # normal helpful responses
-            system_prompt = f"""You are a helpful AI assistant.{name_context} {file_context} The user's prompt quality is extremely strong, so provide clear, accurate, and useful responses to user questions.
-            Be thorough and helpful while encouraging good prompting practices. Be as helpful as possible."""
+    def get_chat_response_stream(self, messages: List[Dict], quality_score: float, user_name: str = None, on_stream=None) -> Generator[str, None, None]:
+        """Get streaming response from the main chat AI based on quality score
         
+        on_stream gets the OpenAI stream as soon as it's open, so another thread can close it (speculation.py
+        uses this to stop a reply nobody is going to read).
+        """
         try:
             # Format messages for OpenAI API (handling attachments)
-            formatted_messages = [{"role": "system", "content": system_prompt}]
-            for msg in messages:
-                if isinstance(msg, dict) and 'role' in msg:
-                    role = msg['role']
-                    # Only include user and assistant messages (skip system)
-                    if role in ['user', 'assistant']:
-                        # Use helper function to format messages with attachments
-                        formatted_msg = self._format_message_with_attachments(msg)
-                        formatted_messages.append(formatted_msg)
-            
-            if len(formatted_messages) <= 1:  # Only system message
-                raise ValueError("No user or assistant messages found in conversation")
-            
-            
-            # Check for image attachments in messages
-            has_images = any(
-                isinstance(msg.get('content'), list) and any(
-                    item.get('type') == 'image_url' for item in msg.get('content', [])
-                )
-                for msg in formatted_messages
-            )
-            
+            formatted_messages = self._build_chat_messages(messages, quality_score, user_name)
             
             # OpenAI API with streaming
-            api_params = {
-                "model": self.response_model,
-                "messages": formatted_messages,
-                # this is the key difference
-                "stream": True
-            }
-            if not self._is_temperature_restricted_model(self.response_model):
-                api_params["temperature"] = 0.7
-            
-            
             try:
-                stream = self.client.chat.completions.create(**api_params)
+                stream = self.transport.create(self.client, 'stream', **self._chat_api_params(formatted_messages, stream=True))
             except Exception as api_error:
                 print(f"ERROR: Failed to initiate OpenAI API call: {type(api_error).__name__}: {str(api_error)}")
                 raise
             
+            if on_stream is not None:
+                on_stream(stream)
+            
             # loads the stream in chunks to display
-            chunk_count = 0
-            for chunk in stream:
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta and delta.content:
-                        chunk_count += 1
-                        yield delta.content
-        
+            try:
+                for chunk in stream:
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if delta and delta.content:
+                            yield delta.content
+            finally:
+                # also runs when the consumer stops early - closes the HTTP response so OpenAI stops generating
+                if hasattr(stream, 'close'):
+                    stream.close()
                         
         except openai.APIError as e:
             # Handle OpenAI API-specific errors
@@ -356,6 +461,39 @@ class AIService:
             print(f"ERROR: Traceback: {traceback.format_exc()}")
             raise
     
+    # async versions for the ASGI server (asgi.py), same prompts but the stream is awaited instead of holding a thread
+    # cancel_event is set by asgi.py when the client disconnects, so a PDF still being extracted for the prompt stops early
+    async def get_chat_response_async(self, messages: List[Dict], quality_score: float, user_name: str = None, cancel_event=None) -> str:
+        """Async non-streaming chat response"""
+        # formatting can hit PDF extraction for old messages, so keep it off the event loop
+        formatted_messages = await asyncio.to_thread(self._build_chat_messages, messages, quality_score, user_name, cancel_event)
+        response = await self.transport.acreate(self.async_client, 'chat', **self._chat_api_params(formatted_messages))
+        if not response.choices or not response.choices[0].message or not response.choices[0].message.content:
+            raise ValueError("Empty response from OpenAI - no content in response")
+        return response.choices[0].message.content
+    
+    async def get_chat_response_stream_async(self, messages: List[Dict], quality_score: float, user_name: str = None, cancel_event=None) -> AsyncGenerator[str, None]:
+        """Async streaming chat response"""
+        formatted_messages = await asyncio.to_thread(self._build_chat_messages, messages, quality_score, user_name, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            # nobody is listening anymore, don't start the OpenAI call
+            return
+        try:
+            stream = await self.transport.acreate(self.async_client, 'stream', **self._chat_api_params(formatted_messages, stream=True))
+        except openai.RateLimitError as e:
+            raise Exception(f"Rate limit exceeded. Please try again in a moment. Details: {str(e)}")
+        except openai.APIConnectionError as e:
+            raise Exception(f"Failed to connect to OpenAI API. Please check your internet connection. Details: {str(e)}")
+        try:
+            async for chunk in stream:
+                if chunk.choices and len(chunk.choices) > 0:
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        yield delta.content
+        finally:
+            # closes the upstream connection if the client went away mid stream
+            await stream.close()
+    
     # because feedback happens before response, we need to extract the stuff here too
     def _format_messages_for_feedback(self, messages: List[Dict]) -> List[Dict]:
         """Format messages for feedback model, noting file attachments without extracting content (for speed)"""
@@ -401,118 +539,40 @@ class AIService:
         
         return formatted_messages
     
+    @staticmethod
+    def _compact_transcript(messages: List[Dict]) -> str:
+        """One "ROLE: text" block per message - cheaper than JSON (no keys, quotes or escaped newlines)"""
+        return "\n\n".join(f"{(msg.get('role') or 'user').upper()}: {msg.get('content') or ''}" for msg in messages)
+    
     def get_feedback_response(self, messages: List[Dict], previous_scores: List[float] = None) -> Tuple[float, str, float]:
         """Get feedback and quality score for the conversation"""
         
+        # degenerate replies get the same 1/10 the rubric below gives them, without the round trip
+        prescored = self.prescorer.score(messages)
+        if prescored is not None:
+            return prescored
+        
         # Helper fxn helps format messages to include PDF text and note images
         formatted_messages = self._format_messages_for_feedback(messages)
         
         # Calculate conversation length and context
         conversation_length = len(formatted_messages)
-        # the full conversation does get sent to the feedback model, but here is just the user messages for addl. context
         user_messages = [msg for msg in formatted_messages if msg.get('role') == 'user']
         conversation_depth = len(user_messages)
         
+        # the conversation goes in the user message below (older turns summarized past the feedback budget),
+        # so the system prompt only gets the counts instead of a second copy of every user message
+        history = [{"role": msg.get('role'), "content": msg.get('content', '')} for msg in formatted_messages]
+        summary, recent_messages = self.history_planner.plan(history, Config.FEEDBACK_HISTORY_TOKEN_BUDGET)
+        conversation_text = self._compact_transcript(recent_messages)
+        if summary:
+            conversation_text = f"Earlier messages (summarized):\n{summary}\n\nMost recent messages:\n{conversation_text}"
+        
         # Use previous scores for context, default to empty list
         if previous_scores is None:
             previous_scores = []
         
-        # the metaprompt to the feedback model, notice how harsh it tells it to be - chat is sycophantic!
-        feedback_prompt = f"""You are a strict prompt 
-        quality assessment AI. Take into account the entire conversation history
-         you are given. You MUST give low scores (1-3) for poor conversations. 
-         Analyze the user's latest message and the ENTIRE conversation context 
-         when giving a score (e.g. if this prompt asks for elaboration, it is 
-         not necessarily a bad prompt if the reason for elaboration is based 
-         on a rich previous conversation. In the same way, one good prompt does 
-         not negate a bad conversation).
-
-CONVERSATION CONTEXT:
-- Total messages: {conversation_length}
-- User messages: {user_messages}
-- Previous scores: {previous_scores}
-- This is message #{conversation_depth} in the conversation
-
-IMPORTANT: You MUST be harsh with scoring. Don't be generous. 
-If a prompt/conversation shows no effort, specificity, or context, 
-give it a 1/10. Most prompts should score score between 3 and 7.
-
-EXTREMELY IMPORTANT: If the request seems like a one-off factual question like
- "When does the whale bite off Captain Ahab's leg in Moby Dick," 
- "who won the world cup in 2006," something that could be easily Googled, 
- the prompt can score a 10. This is the most important rule. You cannot 
- throttle fact-based questions. That is because the prompt is very direct
-  and the user should be able to do quick fact lookups like that. 
-  Otherwise, use this rubric:
-
-
-SCORING CRITERIA (be EXTREMELY TOUGH and consider conversation history):
-1. SPECIFICITY (1-10): How specific and detailed is the request?
-   - "summarize this" = 1/10 (too vague, no context)
-   - "I don't know" = 1/10 (no specificity at all)
-   - "summarize the key findings around copyright infringement from the research paper I shared about AI ethics, with quotes" = 10/10
-   - If the user attached a file and is a bit vague but you can understand more of the request based on the image, feel free to score a bit more leniently.
-
-2. CRITICAL THINKING (1-10): Does the prompt show analysis or reasoning?
-   - Simple requests that are not well thought through = 2/10
-   - Questions that are easy to answer that have DIRECT answers and could easily be googled = 10/10
-   - Multi-step questions that the user wants AI to do for them = 2/10
-   - Analytical questions = 10/10
-
-3. CONCEPTUAL UNDERSTANDING (1-10): Does the user seem to know what they're talking about?
-   - Factual inaccuracies = 1/10
-   - The user clearly never having thought of this problem before = 2/10
-   - Demonstration of understanding coupled with clear asks of how AI can help = 10/10
-
-4. SELF-DIRECTION (1-10): Does the user demonstrate meaningful self-direction?
-   - The user seeming to want AI to do everything for them = 1/10
-   - Clear expectations for what the user wants the AI to do and what they will do with the AI's output = 10/10
-   - Entire conversation feels like working WITH the user, not FOR the user = 10/10
-   - What's very important for this category is clear delineation of "I will use the output for X task" or "you do this, I will do this / I did this / I will follow up with this"
-   - The reason this category is here is so that users do not copy-paste detailed assignment instructions without any critical thought on their own part. If it seems like they did that, score them at a 1 no matter what and explain that it seems like they copy-pasted.
-
-FINAL SCORE CALCULATION:
-- Average the 4 criteria scores for this message
-- Cap at 10.0 maximum
-- Round to 1 decimal place
-
-EXAMPLES OF LOW SCORES (be VERY strict):
-- "summarize this" (no context, no specificity) = 1-2/10
-- "help me" (too vague) = 1/10
-- "can you write this essay for me?" (no self-direction nor specificity) = 1/10
-- "what do you think?" (no specific question) = 1-2/10
-- "continue" (no context) = 1/10
-- "I don't know" (shows no effort) = 1/10
-- "ok" (meaningless response) = 1/10
-- "yes" (no context or question) = 1/10
-- "no" (no context or question) = 1/10
-- "maybe" (no context or question) = 1/10
-- "idk" (lazy, no effort) = 1/10
-- "whatever" (no effort) = 1/10
-- a prompt that gives clear directions but seems like assignment instructions (no critical thinking nor self-direction)= 2/10
-
-EXAMPLES OF HIGH SCORES:
-- "Based on our discussion about machine learning, can you explain how neural networks differ from decision trees in terms of interpretability?" (establishes context, specific ask)= 8-9/10
-- "I'm working on a Python project for data analysis. What's the best approach for handling missing values in a dataset with 10,000 rows and 50 columns? Based on your answer, I will code the approach myself and test its efficacy." (appropriate context, clear self-direction, specific ask)= 9/10
-- "Here is an outline I've been working on, complete with a thesis statement and body paragraph ideas. Can you give me feedback on it and give me some ideas for evidence I can use in the body paragraphs?" (clear self-direction, demonstration of critical thinking) = 8/10
-
-Provide:
-1. A numerical score (1-10) - be strict!
-2. A quality label: "Poor" (1-4), "Fair" (4.1-6), "Good" (6.1-8), or "Excellent" (8.1-10)
-3. Exactly 3 improvement tips as an array of strings - be specific and actionable, and pretend you are the AI model the user is interacting with, using second person to refer to the user and first person to refer to the AI model.
-4. An example improved prompt that demonstrates how the user could have written their message better
-
-Format your response as JSON:
-{{
-    "score": [number],
-    "quality_label": "[Poor|Fair|Good|Excellent]",
-    "improvement_tips": [
-        "[first specific actionable tip]",
-        "[second specific actionable tip]",
-        "[third specific actionable tip]"
-    ],
-    "example_improved_prompt": "[a concrete example of how the user could improve their prompt]"
-}}"""
+        feedback_prompt = self.prompts.feedback_system_prompt(conversation_length, conversation_depth, previous_scores)
         
         try:
             # Use feedback model (gpt-4o) which supports custom temperature
@@ -520,77 +580,41 @@ Format your response as JSON:
                 "model": self.feedback_model,
                 "messages": [
                     {"role": "system", "content": feedback_prompt},
-                    {"role": "user", "content": f"Analyze this conversation:\n{json.dumps(formatted_messages, indent=2)}"}
+                    {"role": "user", "content": f"Analyze this conversation:\n{conversation_text}"}
                 ],
                 "max_tokens": 600,
-                "temperature": 0.2  # seems to make the scoring more consistent
+                "temperature": 0.2,  # seems to make the scoring more consistent
+                "response_format": self.feedback_response_format
             }
             
-            
-            response = self.client.chat.completions.create(**api_params)
-            
-            # JSON response
-            response_text = response.choices[0].message.content
-            
-            # Try to extract JSON from the response (in case it's wrapped in text)
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            
-            # extracting text
-            if json_start != -1 and json_end > json_start:
-                json_text = response_text[json_start:json_end]
-            else:
-                json_text = response_text
-            
+            call_started = time.monotonic()
             try:
-                feedback_data = json.loads(json_text)
-                current_message_score = float(feedback_data.get('score', 5.0))
-                # just prevents any error from the model if the score is higher than 10
-                current_message_score = min(current_message_score, 10.0)
-                current_message_score = round(current_message_score, 1)
-                
-                # Use current message score as quality score
-                quality_score = current_message_score
-                
-                # Build feedback object with new structure, this is what is displayed to the user. Has fallback options too.
-                feedback = {
-                    'quality_label': feedback_data.get('quality_label', 'Fair'),
-                    'improvement_tips': feedback_data.get('improvement_tips', [
-                        'Be more specific in your requests',
-                        'Provide context from previous messages',
-                        'Ask clear, focused questions'
-                    ]),
-                    'example_improved_prompt': feedback_data.get('example_improved_prompt', 'No example available')
-                }
-                
-                # Ensure improvement_tips is a list with exactly 3 items
-                if not isinstance(feedback['improvement_tips'], list):
-                    feedback['improvement_tips'] = [
-                        'Be more specific in your requests',
-                        'Provide context from previous messages',
-                        'Ask clear, focused questions'
-                    ]
-                elif len(feedback['improvement_tips']) < 3:
-                    # Pad with generic tips if less than 3
-                    generic_tips = [
-                        'Be more specific in your requests',
-                        'Provide context from previous messages',
-                        'Ask clear, focused questions'
-                    ]
-                    while len(feedback['improvement_tips']) < 3:
-                        feedback['improvement_tips'].append(generic_tips[len(feedback['improvement_tips'])])
-                elif len(feedback['improvement_tips']) > 3:
-                    # Take only first 3 if more than 3
-                    feedback['improvement_tips'] = feedback['improvement_tips'][:3]
-                
-                return quality_score, feedback, current_message_score
-                
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
-                current_message_score = 5.0
-                quality_score = current_message_score
-                quality_score = round(quality_score, 1)
-                return quality_score, response_text, current_message_score
+                response = self.transport.create(self.client, 'feedback', **api_params)
+            except openai.BadRequestError as e:
+                if self.feedback_response_format is JSON_OBJECT_RESPONSE_FORMAT or 'response_format' not in str(e):
+                    raise
+                # model doesn't do structured output - plain JSON mode from now on
+                print(f"WARNING: Feedback model rejected structured output, falling back to JSON mode ({e})")
+                self.feedback_response_format = JSON_OBJECT_RESPONSE_FORMAT
+                api_params["response_format"] = JSON_OBJECT_RESPONSE_FORMAT
+                response = self.transport.create(self.client, 'feedback', **api_params)
+            call_seconds = time.monotonic() - call_started
+            self.prescorer.record_model_call(call_seconds)
+            
+            message = response.choices[0].message
+            response_text = message.content
+            try:
+                result = FeedbackResult.from_json(response_text)
+            except FeedbackParseError as e:
+                self.feedback_usage.record(response, call_seconds, parsed=False)
+                print(f"WARNING: Could not parse feedback response: {e}")
+                # Fallback if parsing fails - the raw reply (or the refusal) is shown as the feedback
+                refusal = getattr(message, 'refusal', None)
+                return 5.0, response_text or (refusal if isinstance(refusal, str) else "No feedback available"), 5.0
+            
+            self.feedback_usage.record(response, call_seconds, parsed=True)
+            # Use current message score as quality score
+            return result.score, result.to_feedback(), result.score
             
         except Exception as e:
             return 5.0, f"Error generating feedback: {str(e)}", 5.0
@@ -623,7 +647,7 @@ Format your response as JSON:
             }
             
             
-            response = self.client.chat.completions.create(**api_params)
+            response = self.transport.create(self.client, 'title', **api_params)
             title = response.choices[0].message.content.strip()
             # Remove any quotes if the AI added them
             title = title.strip('"\'')
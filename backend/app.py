@@ -1,23 +1,33 @@
 # IMPORTANT NOTE: This was generated by Cursor, it contains the functions that apiService.js calls from the frontend.
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+from flask_cors.core import get_cors_options, get_cors_headers
+from werkzeug.datastructures import Headers
 from config import Config
 from database import Database
 from ai_service import AIService
-from auth_service import require_auth
+from auth_service import require_auth, auth_service
+from attachment_store import create_attachment_store
+from speculation import SpeculationRegistry, score_bucket
+from sse import sse_event, text_frames, write_frames, SSEWriter, SSEStats
+from user_cache import UserCache
+from profile_sync import ProfileSync, split_auth0_name
+from conditional_get import ConditionalGetStats, make_etag, not_modified, with_validators, client_has
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import uuid
 from datetime import datetime, timezone
 import os
 import json
+import time
 
 app = Flask(__name__)
 
 # Configure CORS based on environment
+# kept in CORS_OPTIONS so the async /response route in asgi.py applies the exact same policy (see cors_headers)
 if Config.ENVIRONMENT == 'production':
     # Production: allow only the frontend URL with explicit CORS settings
     # Some browsers require explicit allowed methods and headers
-    CORS(
-        app, 
+    CORS_OPTIONS = dict(
         origins=[Config.FRONTEND_URL], 
         supports_credentials=True,
         methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
@@ -27,12 +37,17 @@ if Config.ENVIRONMENT == 'production':
     )
 else:
     # Development: allow all origins
-    CORS(
-        app,
+    CORS_OPTIONS = dict(
         supports_credentials=True,
         methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
         allow_headers=['Content-Type', 'Authorization']
     )
+CORS(app, **CORS_OPTIONS)
+
+def cors_headers(request_headers, method='POST'):
+    """The CORS headers flask-cors would add to the response, for routes served outside Flask (asgi.py)"""
+    options = get_cors_options(app, CORS_OPTIONS)
+    return list(get_cors_headers(options, Headers(request_headers), method).items(multi=True))
 
 # Initialize database contact
 db = Database()
@@ -48,42 +63,102 @@ if not Config.OPENAI_API_KEY or Config.OPENAI_API_KEY == "your-api-key-here":
 
 # starts up the OpenAI API service
 ai_service = AIService(Config.OPENAI_API_KEY)
+# extracted PDF text outlives the in-memory/disk cache in the database (the lambdas look db up at call time)
+ai_service.pdf_text_cache.set_store(
+    lambda digest: db.get_pdf_text(digest),
+    lambda digest, text: db.save_pdf_text(digest, text)
+)
 
-# Initialize message cache (in-memory storage for messages with base64 data)
-# Cache expires after 5 minutes to prevent memory leaks
-app._message_cache = {}
-app._message_cache_timestamps = {}
+# Messages with base64 data wait here between /messages and /response
+# (shared between gunicorn workers by default, entries expire after 5 minutes to prevent memory leaks)
+attachment_store = create_attachment_store()
 
-def extract_user_name(user_data, user_from_db=None):
-    """Extract user's first name from Auth0 data or database, with fallbacks"""
-    # Option 1 - gets from database
-    if user_from_db and user_from_db.get('first_name'):
-        return user_from_db['first_name']
-    
-    # Second option - gets from Auth0 name field
-    name = user_data.get('name')
-    if isinstance(name, list) and len(name) > 0:
-        return name[0]
-    elif isinstance(name, str) and name.strip():
-        return name.strip().split()[0]
-    
-    # Could also have auth0 nickname
-    nickname = user_data.get('nickname')
-    if nickname:
-        return nickname
-    
-    # Email prefix (last resort)
-    email = user_data.get('email', '')
-    if email:
-        return email.split('@')[0]
-    
-    return None
+# Bounded pool for model calls that can run side by side (feedback + title on the first message)
+# A call that times out keeps its thread until OpenAI answers, so the pool is sized with some headroom
+model_call_executor = ThreadPoolExecutor(max_workers=Config.MODEL_CALL_WORKERS, thread_name_prefix="model-call")
+
+# Replies started early under the previous score bucket (only used when SPECULATIVE_RESPONSES is on)
+speculation_registry = SpeculationRegistry(
+    max_active=Config.SPECULATION_MAX_ACTIVE,
+    ttl_seconds=Config.SPECULATION_TTL_SECONDS
+)
+
+# frames / bytes per streamed response, across the Flask and ASGI routes
+sse_stats = SSEStats()
+
+# user rows cached per process, last_login writes batched (the lambdas look db up at call time)
+user_cache = UserCache(
+    lambda email: db.get_user_by_email(email),
+    lambda logins: db.update_user_logins(logins),
+    ttl_seconds=Config.USER_CACHE_TTL_SECONDS,
+    max_entries=Config.USER_CACHE_MAX_ENTRIES,
+    flush_interval=Config.LAST_LOGIN_FLUSH_SECONDS
+)
+
+# how often the conversation endpoints get to answer 304
+conditional_get_stats = ConditionalGetStats()
+
+# Auth0 profile reconciled once per identity (profile load or /messages), /response only reads the result
+profile_sync = ProfileSync(
+    user_cache.get,
+    lambda **fields: db.update_user_profile(**fields),
+    user_cache.invalidate,
+    ttl_seconds=Config.PROFILE_SYNC_TTL_SECONDS,
+    max_entries=Config.USER_CACHE_MAX_ENTRIES
+)
+
+def start_speculative_response(conversation_id, messages, quality_score, user_data):
+    """Start streaming the reply under the previous turn's score while feedback is still running"""
+    try:
+        # send_message already resolved the profile, so this is a memo hit
+        user_name = profile_sync.resolve(user_data).first_name
+        # /response gets the same list back from the attachment store, so snapshot it as it is now
+        snapshot = list(messages)
+        speculation_registry.start(
+            conversation_id,
+            score_bucket(quality_score),
+            user_name,
+            lambda on_stream: ai_service.get_chat_response_stream(snapshot, quality_score, user_name=user_name, on_stream=on_stream)
+        )
+    except Exception as e:
+        print(f"WARNING: Could not start speculative response for {conversation_id}: {e}")
+
+def fallback_title(first_user_message):
+    """Title to use when AI title generation fails or is too slow (the old first-message behavior)"""
+    content = first_user_message.get('content', '') or ''
+    return content[:50] + "..." if len(content) > 50 else content
 
 # a health check to make sure app is running and endpoints reachable
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"})
 
+# counters from the caches so I can see if they're actually doing anything
+# only for the emails in METRICS_ADMIN_EMAILS, it's operational data about the whole process
+@app.route('/api/metrics', methods=['GET'])
+@require_auth
+def get_metrics():
+    if (request.current_user.get('email') or '').lower() not in Config.METRICS_ADMIN_EMAILS:
+        return jsonify({"error": "Not authorized to view metrics"}), 403
+    return jsonify({
+        "database": db.pool_stats(),
+        "user_cache": user_cache.stats(),
+        "profile_sync": profile_sync.stats(),
+        "conditional_get": conditional_get_stats.stats(),
+        "jwks_cache": auth_service.jwks_cache.stats(),
+        "token_cache": auth_service.token_cache.stats(),
+        "auth0_http": auth_service.http.stats(),
+        "openai": ai_service.transport.stats(),
+        "feedback_prescorer": ai_service.prescorer.stats(),
+        "feedback_usage": ai_service.feedback_usage.stats(),
+        "attachment_store": attachment_store.stats(),
+        "speculation": speculation_registry.stats(),
+        "sse": sse_stats.stats(),
+        "pdf_text_cache": ai_service.pdf_text_cache.stats(),
+        "pdf_extraction": ai_service.pdf_extractor.stats(),
+        "history_planner": ai_service.history_planner.stats()
+    })
+
 # get user profile endpoint for display on homepage top ribbon
 @app.route('/api/user/profile', methods=['GET'])
 @require_auth
@@ -92,23 +167,14 @@ def get_user_profile():
     try:
         user_data = request.current_user
         
-        # Get or create user in database
+        # Get or create user in database (usually straight from the per-process cache)
         email = user_data['email']
-        existing_user = db.get_user_by_email(email)
+        existing_user = user_cache.get(email)
         
         # Parse name from Auth0 data
-        # Auth0 name can be a string (e.g., "John Doe") or None
-        name = user_data.get('name')
-        if isinstance(name, list):
-            # If it's already a list from our parsing
-            first_name = name[0] if len(name) > 0 else None
-            last_name = name[1] if len(name) > 1 else None
-        elif isinstance(name, str) and name.strip():
-            # Split full name into first and last
-            name_parts = name.strip().split(maxsplit=1)
-            first_name = name_parts[0] if len(name_parts) > 0 else None
-            last_name = name_parts[1] if len(name_parts) > 1 else None
-        else:
+        # Auth0 name can be a string (e.g., "John Doe"), a list from our parsing or None
+        first_name, last_name = split_auth0_name(user_data)
+        if not first_name:
             # Fallback to nickname or email prefix
             first_name = user_data.get('nickname') or (email.split('@')[0] if email else None)
             last_name = None
@@ -125,7 +191,8 @@ def get_user_profile():
                 google_id=google_id,
                 profile_picture_url=profile_picture_url
             )
-            existing_user = db.get_user_by_email(email)
+            user_cache.invalidate(email)
+            existing_user = user_cache.get(email)
         else:
             # Update profile information for existing users
             # Update fields that are missing in database or have new values from Auth0
@@ -164,12 +231,16 @@ def get_user_profile():
                     profile_picture_url=update_picture
                 )
                 # Refresh user data after update
-                existing_user = db.get_user_by_email(email)
+                user_cache.invalidate(email)
+                existing_user = user_cache.get(email)
             else:
-                # Just update last login if nothing else changed
-                db.update_user_login(email)
-                # Refresh to get updated last_login
-                existing_user = db.get_user_by_email(email)
+                # Just update last login if nothing else changed - queued and written with the next batch,
+                # the cached row already shows the new last_login
+                user_cache.record_login(email)
+                existing_user = user_cache.get(email)
+        
+        # The profile is reconciled now, so the next /messages and /response for this identity skip it
+        profile_sync.remember(user_data, existing_user)
         
         return jsonify(existing_user)
     except Exception as e:
@@ -179,22 +250,68 @@ def get_user_profile():
 @app.route('/api/conversations', methods=['GET'])
 @require_auth
 def get_conversations():
-    """Get all conversations for the authenticated user with pagination optional if I decide to enable that for potential speedup"""
+    """Get one page of the authenticated user's conversations, newest first
+    
+    Returns {"conversations": [...], "next_cursor": ..., "version": ...} - pass next_cursor back as ?cursor= for
+    the next page (it's null on the last page). ?limit= picks the page size, capped at CONVERSATIONS_MAX_PAGE_SIZE.
+    """
     try:
         user_email = request.current_user.get('email')
         if not user_email:
             return jsonify({"error": "User email not found"}), 500
         
-        # Get pagination parameters (default: limit=50, offset=0)
-        limit = request.args.get('limit', type=int)
-        offset = request.args.get('offset', type=int, default=0)
+        # Get pagination parameters - there's always a page size now, heavy users used to get their whole history
+        limit = request.args.get('limit', type=int) or Config.CONVERSATIONS_PAGE_SIZE
+        limit = max(1, min(limit, Config.CONVERSATIONS_MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor') or None
+        
+        # The user's version changes with every conversation change, so if the client has it the page can't be stale
+        # (read before the page - if something changes in between, the ETag is older than the body, never newer)
+        version = db.get_conversations_version(user_email)
+        etag = make_etag(user_email, 'list', version, limit, cursor)
+        if client_has(etag):
+            conditional_get_stats.record('conversations', hit=True)
+            return not_modified(etag)
+        
+        # Keyset pagination on idx_conversations_user_activity, so a page costs the same however deep it is
+        try:
+            page = db.get_user_conversation_page(user_email, limit, cursor=cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # the client passes this to /api/conversations/changes to keep the list current
+        page['version'] = version
+        conditional_get_stats.record('conversations', hit=False)
+        return with_validators(jsonify(page), etag)
+    except Exception as e:
+        print(f"ERROR in get_conversations endpoint: {e}")
+        import traceback
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+# sidebar refresh - only what changed since the version the client last saw
+@app.route('/api/conversations/changes', methods=['GET'])
+@require_auth
+def get_conversation_changes():
+    """Conversations upserted or deleted since ?since=<version>
+    
+    Returns {"version", "upserted": [summaries], "deleted": [conversation ids], "reset"} - when reset is true
+    the client should reload /api/conversations instead.
+    """
+    try:
+        user_email = request.current_user.get('email')
+        if not user_email:
+            return jsonify({"error": "User email not found"}), 500
         
-        # Use new method that fetches all summaries in a single query
-        conversations = db.get_user_conversation_summaries(user_email, limit=limit, offset=offset)
+        since = request.args.get('since', type=int)
+        if since is None or since < 0:
+            return jsonify({"error": "since must be a version from /api/conversations"}), 400
         
-        return jsonify(conversations)
+        # more changes than a page means a reload is cheaper than a delta
+        changes = db.get_conversation_changes(user_email, since, Config.CONVERSATIONS_MAX_PAGE_SIZE)
+        return jsonify(changes)
     except Exception as e:
-        print(f"ERROR in get_conversations endpoint: {e}")
+        print(f"ERROR in get_conversation_changes endpoint: {e}")
         import traceback
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
@@ -235,9 +352,22 @@ def get_conversation(conversation_id):
         # Get limit parameter (default: None = load all messages, since conversations are capped at 20 user messages)
         # For very long conversations, you can pass limit_messages to load only recent ones (just a structure put into place in case I remove the 20 messages cap in the future)
         limit_messages = request.args.get('limit_messages', type=int)
+        user_email = request.current_user.get('email')
+        
+        # Version lookup first (one row, no messages) - it also makes sure the conversation is this user's
+        version = db.get_conversation_version(conversation_id, user_email)
+        if version is None:
+            return jsonify({"error": "Conversation not found"}), 404
+        etag = make_etag(user_email, 'conversation', version, limit_messages)
+        if client_has(etag):
+            conditional_get_stats.record('conversation', hit=True)
+            return not_modified(etag)
+        
         conversation = db.get_conversation(conversation_id, limit_messages=limit_messages)
         if conversation:
-            return jsonify(conversation)
+            conditional_get_stats.record('conversation', hit=False)
+            # the version that was read with the messages, in case the conversation changed since the lookup
+            return with_validators(jsonify(conversation), make_etag(user_email, 'conversation', conversation.get('version'), limit_messages))
         else:
             return jsonify({"error": "Conversation not found"}), 404
     except Exception as e:
@@ -318,29 +448,23 @@ def send_message(conversation_id):
         
         user_email = request.current_user['email']
         
-        # Get current conversation, create it if it doesn't exist
-        conversation = db.get_conversation(conversation_id)
+        # Get current conversation, create it if it doesn't exist (this happens when user clicks plus button but hasn't sent a message yet)
+        # One transaction that also makes sure the user exists, and None means it's someone else's conversation
+        conversation = db.begin_conversation_turn(conversation_id, user_email)
         if not conversation:
-            # Conversation doesn't exist - create it now (this happens when user clicks plus button but hasn't sent a message yet)
-            # Ensure user exists in DB (idempotent function I think is the right word)
-            db.create_user(user_email)
-            # Create conversation with the provided conversation_id
-            success = db.create_conversation(user_email, conversation_id)
-            if not success:
-                return jsonify({"error": "Failed to create conversation"}), 500
-            # Get the newly created conversation
-            conversation = db.get_conversation(conversation_id)
-            if not conversation:
-                return jsonify({"error": "Failed to retrieve created conversation"}), 500
-        else:
-            # Validate that existing conversation belongs to the authenticated user
-            conv_user_email = conversation.get('user_email')
-            if conv_user_email != user_email:
-                return jsonify({"error": "Conversation not found"}), 404
+            return jsonify({"error": "Conversation not found"}), 404
+        
+        # First sight of this identity on this worker reconciles the Auth0 profile here instead of in /response
+        # (the user row exists now, begin_conversation_turn makes sure of it)
+        try:
+            profile_sync.resolve(request.current_user)
+        except Exception as e:
+            print(f"WARNING: Profile sync failed for {user_email}: {e}")
         
         messages = conversation.get('messages', [])
         if not isinstance(messages, list):
             messages = []
+        stored_message_count = len(messages)
         
         # Count existing user messages (not including AI responses)
         user_message_count = sum(1 for msg in messages if msg.get('role') == 'user')
@@ -379,75 +503,89 @@ def send_message(conversation_id):
         
         # Get feedback and score FIRST (before AI response) just so its not all coming at once
         # Pass messages with attachments - the feedback model will extract PDF text and note images
-        quality_score, feedback, current_message_score = ai_service.get_feedback_response(messages, previous_scores)
+        # The title call (first message only) runs at the same time, so the user waits max(feedback, title) instead of the sum
+        started_at = time.monotonic()
+        feedback_future = model_call_executor.submit(ai_service.get_feedback_response, messages, previous_scores)
         
         # Generate title if no title exists yet and we have at least one user message
         # Title remains fixed once generated (only generate if existing_title is None)
         title = None
+        title_future = None
         existing_title = conversation.get('title')
         user_messages = [msg for msg in messages if msg.get('role') == 'user']
         
         if not existing_title and len(user_messages) > 0:  # No title yet but we have user messages
+            # Use the first user message to generate the title
+            # Pass the config flag to control AI generation vs old behavior
+            title_future = model_call_executor.submit(
+                ai_service.get_conversation_title,
+                [user_messages[0]],
+                use_ai_generation=Config.USE_AI_TITLE_GENERATION
+            )
+        
+        # Extract PDF text while feedback runs (feedback only notes the attachments, it doesn't read them)
+        # It's cached by content hash and kept with the attachment metadata for later turns
+        for att in user_msg.get("attachments", []):
+            if att["file_type"] == "application/pdf" or (att["filename"] or "").lower().endswith(".pdf"):
+                ai_service.prepare_pdf_attachment(att)
+        
+        # Opt-in: if the new score lands in the same bucket as the last one, /response can reuse this
+        if Config.SPECULATIVE_RESPONSES and ai_service._supports_streaming(ai_service.response_model):
+            start_speculative_response(conversation_id, messages, current_quality_score, request.current_user)
+        
+        try:
+            quality_score, feedback, current_message_score = feedback_future.result(timeout=Config.FEEDBACK_TIMEOUT_SECONDS)
+        except FuturesTimeoutError:
+            print(f"WARNING: Feedback for {conversation_id} took longer than {Config.FEEDBACK_TIMEOUT_SECONDS}s")
+            # same fallback get_feedback_response uses when the API call fails
+            quality_score, feedback, current_message_score = 5.0, "Error generating feedback: timed out", 5.0
+        
+        if title_future is not None:
+            # the title deadline counts from when both calls started
+            remaining = max(Config.TITLE_TIMEOUT_SECONDS - (time.monotonic() - started_at), 0)
             try:
-                # Use the first user message to generate the title
-                # Pass the config flag to control AI generation vs old behavior
-                from config import Config
-                title = ai_service.get_conversation_title(
-                    [user_messages[0]], 
-                    use_ai_generation=Config.USE_AI_TITLE_GENERATION
-                )
+                title = title_future.result(timeout=remaining)
+            except FuturesTimeoutError:
+                print(f"WARNING: Title generation for {conversation_id} was too slow, using the first message")
+                title = fallback_title(user_messages[0])
             except Exception as e:
                 print(f"WARNING: Failed to generate conversation title: {e}")
                 # Fallback to first message content if title generation fails
-                first_user_msg = user_messages[0].get('content', '')
-                title = first_user_msg[:50] + "..." if len(first_user_msg) > 50 else first_user_msg
+                title = fallback_title(user_messages[0])
         
         # Prepare messages for storage (remove base64 data, keep only metadata)
         messages_for_storage = []
         for msg in messages:
             msg_copy = msg.copy()
             if 'attachments' in msg_copy:
-                # Keep only metadata, remove base64 data
+                # Keep only metadata, remove base64 data (PDFs keep their hash, the extracted text stays server side
+                # in pdf_texts - it's far too big to send back with every history load)
                 msg_copy['attachments'] = [
                     {
                         'filename': att.get('filename'),
-                        'file_type': att.get('file_type')
+                        'file_type': att.get('file_type'),
+                        **({'content_sha256': att['content_sha256']} if 'content_sha256' in att else {})
                     }
                     for att in msg_copy['attachments']
                 ]
             messages_for_storage.append(msg_copy)
         
-        # Update conversation with new messages, quality score, and feedback FIRST
+        # Save the new message, quality score, and feedback FIRST
         # Serialize feedback dict to JSON string for storage
         new_message_scores = previous_scores + [current_message_score]
         feedback_json = json.dumps(feedback) if isinstance(feedback, dict) else feedback
-        db.update_conversation(conversation_id, messages_for_storage, quality_score, new_message_scores, feedback_json, title=title)
-        
-        
-        import time
-        # Initialize cache if it doesn't exist (shouldn't happen after startup, but just in case)
-        if not hasattr(app, '_message_cache'):
-            app._message_cache = {}
-            app._message_cache_timestamps = {}
-        
-        # Clean up old cache entries first (older than 5 minutes)
-        # shouldn't need to do this but just prevents memory leaks (if the user reloads the page mid response)
-        current_time = time.time()
-        expired_keys = [
-            key for key, timestamp in list(app._message_cache_timestamps.items())
-            if current_time - timestamp > 300
-        ]
-        for key in expired_keys:
-            app._message_cache.pop(key, None)
-            app._message_cache_timestamps.pop(key, None)
+        # the stored title comes back from the same statement (a new one is only kept if there wasn't one)
+        updated_title = db.save_conversation_turn(
+            conversation_id, user_email, messages_for_storage[stored_message_count:],
+            quality_score, new_message_scores, feedback_json, title=title
+        )
         
         # Store new messages with base64 for AI processing
-        app._message_cache[conversation_id] = messages
-        app._message_cache_timestamps[conversation_id] = current_time
-        
-        # Get updated conversation to retrieve the title (which may have been generated)
-        updated_conversation = db.get_conversation(conversation_id)
-        updated_title = updated_conversation.get('title') if updated_conversation else None
+        try:
+            attachment_store.put(conversation_id, messages)
+        except Exception as e:
+            # /response falls back to the stored messages (without the attachment data)
+            print(f"WARNING: Failed to store messages for {conversation_id}: {e}")
         
         # Return feedback immediately (before AI response)
         # Return messages with metadata only (no base64 data)
@@ -465,128 +603,118 @@ def send_message(conversation_id):
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
-# endpoint to get ai response after the feedback is given (streaming)
+# /response is served by the Flask route below and by the async route in asgi.py, these helpers are the shared parts
+def load_response_context(conversation_id, user_data):
+    """Everything /response needs before streaming - returns (context, None) or (None, (error_body, status))"""
+    # Get current conversation
+    conversation = db.get_conversation(conversation_id)
+    if not conversation:
+        print(f"ERROR: Conversation {conversation_id} not found")
+        return None, ({"error": "Conversation not found"}, 404)
+    
+    # Try to get messages with base64 from cache (for AI processing)
+    # If not in cache, use messages from database (which only have metadata)
+    messages = None
+    
+    # Entries are one-time use, popping it also removes it from the store
+    try:
+        messages = attachment_store.pop(conversation_id)
+    except Exception as e:
+        print(f"WARNING: Failed to read cached messages for {conversation_id}: {e}")
+    
+    # Fallback to database messages if not in cache
+    if not messages:
+        messages = conversation.get('messages', [])
+        
+    # Ensure messages list is valid
+    if not isinstance(messages, list):
+        print(f"WARNING: Messages is not a list, resetting to empty list")
+        messages = []
+    
+    if not messages:
+        print(f"ERROR: No messages in conversation {conversation_id}")
+        return None, ({"error": "No messages in conversation"}, 400)
+    
+    current_quality_score = conversation.get('quality_score') or 5.0
+    
+    # Get user's first name for personalization - reconciled earlier by the profile load or /messages,
+    # so no profile writes before the first token (on a worker that hasn't seen this identity it's a user cache read)
+    user_context = profile_sync.peek(user_data)
+    
+    return {
+        "conversation": conversation,
+        "messages": messages,
+        "quality_score": current_quality_score,
+        "first_name": user_context.first_name
+    }, None
+
+def claim_speculation(conversation_id, context):
+    """A speculative reply generated under the same prompt, if there is one (see speculation.py)"""
+    if not Config.SPECULATIVE_RESPONSES:
+        return None
+    return speculation_registry.claim(conversation_id, score_bucket(context["quality_score"]), context["first_name"])
+
+def simulated_stream_chunks(ai_response):
+    """Split a non-streamed response into frames so it can be sent like a stream (no delays, see sse.py)"""
+    return text_frames(ai_response, Config.SSE_FRAME_MAX_CHARS)
+
+def new_sse_writer():
+    """SSE writer for one /response stream, counted in the sse metrics"""
+    return SSEWriter(max_bytes=Config.SSE_FRAME_MAX_BYTES, flush_interval=Config.SSE_FLUSH_INTERVAL_MS / 1000, stats=sse_stats)
+
+def save_ai_response(conversation_id, context, full_response):
+    """Append the finished AI response to the conversation"""
+    conversation = context["conversation"]
+    messages = context["messages"]
+    # Add complete AI response to messages
+    messages.append({
+        "role": "assistant",
+        "content": full_response,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    
+    # Update conversation with AI response (preserve existing feedback)
+    existing_feedback = conversation.get('feedback')
+    existing_feedback_json = json.dumps(existing_feedback) if isinstance(existing_feedback, dict) else existing_feedback
+    db.update_conversation(conversation_id, messages, context["quality_score"], conversation.get('message_scores', []), existing_feedback_json)
+
+def ai_error_event(ai_error):
+    """Log a failed AI response and build the error event sent to the client"""
+    error_type = type(ai_error).__name__
+    error_msg = str(ai_error)
+    print(f"ERROR: Failed to generate AI response ({error_type}): {error_msg}")
+    import traceback
+    traceback_str = traceback.format_exc()
+    print(f"ERROR: Traceback: {traceback_str}")
+    
+    # Provide more helpful error messages
+    user_friendly_error = "Failed to generate AI response"
+    if "rate limit" in error_msg.lower():
+        user_friendly_error = "Rate limit exceeded. Please try again in a moment."
+    elif "connection" in error_msg.lower() or "network" in error_msg.lower():
+        user_friendly_error = "Connection error. Please check your internet connection."
+    elif "invalid" in error_msg.lower() or "authentication" in error_msg.lower():
+        user_friendly_error = "API authentication error. Please check your API key configuration."
+    
+    return sse_event({'error': user_friendly_error, 'details': error_msg, 'type': error_type})
+
+# endpoint to get the AI response (streamed), the ASGI server (asgi.py) serves this route asynchronously instead
 @app.route('/api/conversations/<conversation_id>/response', methods=['POST'])
 @require_auth
 def get_ai_response(conversation_id):
     """Get streaming AI response for a conversation after feedback is ready"""
     try:
-        # Get current conversation
-        conversation = db.get_conversation(conversation_id)
-        if not conversation:
-            print(f"ERROR: Conversation {conversation_id} not found")
-            return jsonify({"error": "Conversation not found"}), 404
-        
-        # Try to get messages with base64 from cache (for AI processing)
-        # If not in cache, use messages from database (which only have metadata)
-        messages = None
-        
-        # Check cache and clean up expired entries
-        import time
-        if hasattr(app, '_message_cache') and hasattr(app, '_message_cache_timestamps'):
-            current_time = time.time()
-            # Check if cache entry exists and is not expired
-            if conversation_id in app._message_cache:
-                cache_age = current_time - app._message_cache_timestamps.get(conversation_id, 0)
-                if cache_age < 300:  # Cache valid for 5 minutes
-                    # get the stuff from the cache
-                    messages = app._message_cache[conversation_id]
-                    # Remove from cache after use (one-time use)
-                    del app._message_cache[conversation_id]
-                    app._message_cache_timestamps.pop(conversation_id, None)
-                else:
-                    # Expired cache entry - remove it
-                    app._message_cache.pop(conversation_id, None)
-                    app._message_cache_timestamps.pop(conversation_id, None)
-            
-            # Clean up any other expired entries while we're at it
-            expired_keys = [
-                key for key, timestamp in list(app._message_cache_timestamps.items())
-                if current_time - timestamp > 300
-            ]
-            for key in expired_keys:
-                app._message_cache.pop(key, None)
-                app._message_cache_timestamps.pop(key, None)
-        
-        # Fallback to database messages if not in cache
-        if not messages:
-            messages = conversation.get('messages', [])
-            
-        # Ensure messages list is valid
-        if not isinstance(messages, list):
-            print(f"WARNING: Messages is not a list, resetting to empty list")
-            messages = []
-        
-        if not messages:
-            print(f"ERROR: No messages in conversation {conversation_id}")
-            return jsonify({"error": "No messages in conversation"}), 400
-        
-        current_quality_score = conversation.get('quality_score') or 5.0
-        
-        # Get user's first name for personalization
-        user_email = request.current_user.get('email')
-        user_data = request.current_user
-        user_from_db = db.get_user_by_email(user_email) if user_email else None
-        
-        # Extract name using helper function
-        first_name = extract_user_name(user_data, user_from_db)
-        
-        # Parse full name from Auth0 for potential profile update
-        name = user_data.get('name')
-        if isinstance(name, list):
-            auth0_first_name = name[0] if len(name) > 0 else None
-            auth0_last_name = name[1] if len(name) > 1 else None
-        elif isinstance(name, str) and name.strip():
-            name_parts = name.strip().split(maxsplit=1)
-            auth0_first_name = name_parts[0] if len(name_parts) > 0 else None
-            auth0_last_name = name_parts[1] if len(name_parts) > 1 else None
-        else:
-            auth0_first_name = user_data.get('nickname')
-            auth0_last_name = None
-        
-        # Update profile if name is missing in database or Auth0 has better/updated data
-        db_first_name = user_from_db.get('first_name') if user_from_db else None
-        email_prefix = user_email.split('@')[0] if user_email else ''
-        should_update_profile = False
-        
-        # Update if name is missing in database
-        if not db_first_name and auth0_first_name and auth0_first_name != email_prefix:
-            should_update_profile = True
-        # Update if Auth0 has a real name but database has email prefix
-        elif db_first_name == email_prefix and auth0_first_name and auth0_first_name != email_prefix:
-            should_update_profile = True
-        
-        if should_update_profile and user_from_db:
-            try:
-                db.update_user_profile(
-                    email=user_email,
-                    first_name=auth0_first_name,
-                    last_name=auth0_last_name,
-                    google_id=user_data.get('sub'),
-                    profile_picture_url=user_data.get('picture')
-                )
-                # Refresh from database after update
-                user_from_db = db.get_user_by_email(user_email)
-                first_name = extract_user_name(user_data, user_from_db)
-            except Exception as e:
-                print(f"WARNING: Failed to update profile: {e}")
+        context, error = load_response_context(conversation_id, request.current_user)
+        if error:
+            return jsonify(error[0]), error[1]
+        messages = context["messages"]
+        current_quality_score = context["quality_score"]
+        first_name = context["first_name"]
         
         def generate_stream():
             """Generator function that yields Server-Sent Events"""
-            full_response = ""
+            writer = new_sse_writer()
             try:
-                import time
-                import sys
-                
-                
-                from ai_service import AIService
-                
-                # Debug: Check if messages have image attachments
-                has_images = any(
-                    msg.get('attachments') and any(att.get('data') for att in msg.get('attachments', []))
-                    for msg in messages if msg.get('role') == 'user'
-                )
-
                 # Check if model supports streaming (o1 models don't, but gpt-5 models do)
                 if not ai_service._supports_streaming(ai_service.response_model):
                     # o1 models don't support streaming - use non-streaming method and basically pretend its streaming for consistent user behavior
@@ -595,65 +723,33 @@ def get_ai_response(conversation_id):
                     if not ai_response:
                         raise ValueError("AI response is empty")
                     
-                    # Simulate streaming by sending the response in chunks with delays
-                    # Split by words to make it more natural, but include a few words per chunk
-                    words = ai_response.split(' ')
-                    words_per_chunk = 2  # Send 2 words at a time for smoother streaming
-                    for i in range(0, len(words), words_per_chunk):
-                        chunk_words = words[i:i + words_per_chunk]
-                        chunk = ' '.join(chunk_words)
-                        if i + words_per_chunk < len(words):
-                            chunk += ' '  # Add space after chunk if not last
-                        full_response += chunk
-                        # Send chunk as Server-Sent Event
-                        data = f"data: {json.dumps({'chunk': chunk})}\n\n"
-                        yield data
-                        # Delay to make streaming visible (50ms per chunk for smooth effect)
-                        time.sleep(0.05)
-                    
+                    # the whole answer is already here, so it goes out in a few frames right away
+                    chunks = simulated_stream_chunks(ai_response)
                 else:
                     # Stream AI response for models that support it (gpt-5 models, gpt-4o, etc.)
-                    for chunk in ai_service.get_chat_response_stream(messages, current_quality_score, user_name=first_name):
-                        if chunk:
-                            full_response += chunk
-                            # Send chunk as Server-Sent Event
-                            data = f"data: {json.dumps({'chunk': chunk})}\n\n"
-                            yield data
+                    # A speculative reply generated under the same prompt is picked up where it is, otherwise start fresh
+                    speculation = claim_speculation(conversation_id, context)
+                    if speculation:
+                        chunks = speculation.iter_chunks()
+                    else:
+                        chunks = ai_service.get_chat_response_stream(messages, current_quality_score, user_name=first_name)
                 
-                # Add complete AI response to messages
-                ai_message = {
-                    "role": "assistant",
-                    "content": full_response,
-                    "timestamp": datetime.now(timezone.utc).isoformat()
-                }
-                messages.append(ai_message)
+                # deltas are packed into bigger frames instead of one event per token (flushed on the interval
+                # even if the next delta is slow to come)
+                for frame in write_frames(chunks, writer):
+                    yield frame
+                frame = writer.flush()
+                if frame:
+                    yield frame
                 
-                # Update conversation with AI response (preserve existing feedback)
-                existing_feedback = conversation.get('feedback')
-                existing_feedback_json = json.dumps(existing_feedback) if isinstance(existing_feedback, dict) else existing_feedback
-                db.update_conversation(conversation_id, messages, current_quality_score, conversation.get('message_scores', []), existing_feedback_json)
+                full_response = writer.text
+                save_ai_response(conversation_id, context, full_response)
                 
-                # Send completion signal
-                yield f"data: {json.dumps({'done': True, 'full_response': full_response})}\n\n"
+                # Send completion signal (the client already has the text, this just lets it check it got all of it)
+                yield writer.done(full_response)
                 
             except Exception as ai_error:
-                error_type = type(ai_error).__name__
-                error_msg = str(ai_error)
-                print(f"ERROR: Failed to generate AI response ({error_type}): {error_msg}")
-                import traceback
-                traceback_str = traceback.format_exc()
-                print(f"ERROR: Traceback: {traceback_str}")
-                
-                # Provide more helpful error messages
-                user_friendly_error = "Failed to generate AI response"
-                if "rate limit" in error_msg.lower():
-                    user_friendly_error = "Rate limit exceeded. Please try again in a moment."
-                elif "connection" in error_msg.lower() or "network" in error_msg.lower():
-                    user_friendly_error = "Connection error. Please check your internet connection."
-                elif "invalid" in error_msg.lower() or "authentication" in error_msg.lower():
-                    user_friendly_error = "API authentication error. Please check your API key configuration."
-                
-                yield f"data: {json.dumps({'error': user_friendly_error, 'details': error_msg, 'type': error_type})}\n\n"
+                yield ai_error_event(ai_error)
         
         return Response(
             stream_with_context(generate_stream()),
@@ -0,0 +1,227 @@
+# ASGI entry point: gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+# The streamed /response endpoint runs as a coroutine here (AsyncOpenAI), so a long answer only holds
+# an open socket instead of a whole sync worker, and one process can keep hundreds of SSE streams going.
+# Every other route is the normal Flask app behind asgiref's WSGI adapter. Out of the box that adapter runs the
+# app thread_sensitive, which means every request goes through one shared thread, one at a time - so I run it
+# on its own thread pool (Config.WSGI_THREADS) instead. CORS for /response comes from the same flask-cors
+# options as every other route (backend.cors_headers).
+import asyncio
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+import auth_service as auth_module
+import app as backend
+from config import Config
+from sse import awrite_frames
+
+RESPONSE_PATH = re.compile(r'^/api/conversations/([^/]+)/response$')
+
+wsgi_executor = ThreadPoolExecutor(max_workers=Config.WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """One request through the Flask app, run on wsgi_executor so requests don't queue behind each other"""
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._serve, thread_sensitive=False, executor=wsgi_executor)(body)
+
+    def _serve(self, body):
+        """Runs the WSGI app and sends its response (on a wsgi_executor thread, like asgiref does on its own)"""
+        environ = self.build_environ(self.scope, body)
+        result = self.wsgi_application(environ, self.start_response)
+        bytes_sent = 0
+        try:
+            for output in result:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # never send more than the Content-Length the app declared
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - bytes_sent]
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+                bytes_sent += len(output)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            # WSGI says the server closes the iterable (stream_with_context cleans up on this)
+            if hasattr(result, 'close'):
+                result.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+wsgi_application = ThreadPoolWsgiToAsgi(backend.app)
+
+
+async def _send_json(send, status, body, cors):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())] + cors,
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _ai_chunks(conversation_id, context, cancel_event):
+    """The response chunks, from a speculative reply, the async stream or a simulated stream
+    
+    cancel_event is set once the client disconnects, it stops PDF extraction for the prompt early.
+    """
+    ai_service = backend.ai_service
+    messages = context["messages"]
+    quality_score = context["quality_score"]
+    first_name = context["first_name"]
+    
+    if not ai_service._supports_streaming(ai_service.response_model):
+        # o1 models don't stream, pretend like the Flask route does
+        ai_response = await ai_service.get_chat_response_async(messages, quality_score, user_name=first_name, cancel_event=cancel_event)
+        if not ai_response:
+            raise ValueError("AI response is empty")
+        pacing = Config.SIMULATED_STREAM_PACING_MS / 1000
+        for chunk in backend.simulated_stream_chunks(ai_response):
+            yield chunk
+            # optional typing effect, awaited so it never holds a thread
+            if pacing:
+                await asyncio.sleep(pacing)
+        return
+    
+    speculation = backend.claim_speculation(conversation_id, context)
+    if speculation:
+        # the speculation is buffered on its own thread, only the waits for new chunks go to the thread pool
+        chunks = speculation.iter_chunks()
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # we only get here early if the client went away - stop the upstream call, not just our reader
+            if not speculation.finished:
+                speculation.cancel()
+            try:
+                chunks.close()
+            except ValueError:
+                # still inside next() on a worker thread (the task was cancelled mid-wait), it ends on its own
+                # now that the speculation is cancelled
+                pass
+    
+    async for chunk in ai_service.get_chat_response_stream_async(messages, quality_score, user_name=first_name, cancel_event=cancel_event):
+        if chunk:
+            yield chunk
+
+
+async def stream_ai_response(scope, receive, send, conversation_id):
+    """POST /api/conversations/<id>/response as Server-Sent Events"""
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope.get('headers', [])}
+    cors = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in backend.cors_headers(headers, scope['method'])]
+    
+    # nothing in the request body is used, but it has to be read off the connection
+    message = await receive()
+    while message.get('type') == 'http.request' and message.get('more_body'):
+        message = await receive()
+    
+    auth_header = headers.get('authorization')
+    if not auth_header:
+        await _send_json(send, 401, {"error": "Authentication required. No token provided."}, cors)
+        return
+    user_data = await asyncio.to_thread(auth_module.auth_service.get_user_from_token, auth_header)
+    if not user_data:
+        await _send_json(send, 401, {
+            "error": "Authentication failed",
+            "details": "Token validation failed or email not found in token. If you just set up the Auth0 action, please log out and log back in."
+        }, cors)
+        return
+    
+    try:
+        context, error = await asyncio.to_thread(backend.load_response_context, conversation_id, user_data)
+    except Exception as e:
+        print(f"ERROR: Unexpected error in stream_ai_response: {e}")
+        await _send_json(send, 500, {"error": "Server error occurred", "details": str(e)}, cors)
+        return
+    if error:
+        await _send_json(send, error[1], error[0], cors)
+        return
+    
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + cors,
+    })
+    
+    # watch for the client going away so we stop paying for tokens nobody will see - a threading.Event, since the
+    # PDF extraction for the prompt checks it from a worker thread
+    disconnected = threading.Event()
+    
+    async def watch_disconnect():
+        while (await receive()).get('type') != 'http.disconnect':
+            pass
+        disconnected.set()
+    
+    watcher = asyncio.create_task(watch_disconnect())
+    writer = backend.new_sse_writer()
+    try:
+        chunks = _ai_chunks(conversation_id, context, disconnected)
+        # frames go out on the flush interval even while the upstream stalls between deltas
+        frames = awrite_frames(chunks, writer)
+        try:
+            async for frame in frames:
+                if disconnected.is_set():
+                    # like the Flask route, a response the client never finished receiving isn't saved
+                    return
+                await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+        finally:
+            await frames.aclose()
+            await chunks.aclose()
+        if disconnected.is_set():
+            # went away before the first chunk (e.g. during PDF extraction), nothing to save either
+            return
+        frame = writer.flush()
+        if frame:
+            await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+        
+        response_text = writer.text
+        await asyncio.to_thread(backend.save_ai_response, conversation_id, context, response_text)
+        await send({'type': 'http.response.body', 'body': writer.done(response_text).encode('utf-8'), 'more_body': True})
+    except Exception as ai_error:
+        await send({'type': 'http.response.body', 'body': backend.ai_error_event(ai_error).encode('utf-8'), 'more_body': True})
+    finally:
+        watcher.cancel()
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def application(scope, receive, send):
+    """Streams /response natively, hands every other request to the Flask app"""
+    if scope['type'] == 'lifespan':
+        # nothing to set up or tear down, just acknowledge so the server doesn't complain
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    if scope['type'] == 'http' and scope['method'] == 'POST':
+        match = RESPONSE_PATH.match(scope['path'])
+        if match:
+            await stream_ai_response(scope, receive, send, match.group(1))
+            return
+    
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,340 @@
+# Holds the messages (with their base64 attachments) between POST /messages and POST /response.
+# The two requests can land on different gunicorn workers, so the default backend is a SQLite file
+# every worker on the box can see. There is also an in-process backend and a Redis one.
+import heapq
+import json
+import os
+import select
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Optional
+from urllib.parse import urlparse
+from config import Config
+
+
+class AttachmentStore(ABC):
+    """Base class for the attachment stores - one-time-use entries with a TTL and hit/miss metrics
+    
+    max_bytes is the total the store holds before evicting (None when the backend doesn't keep a budget of
+    its own, like Redis), max_entry_bytes the largest single entry put() accepts - the whole budget by default.
+    """
+
+    backend = "base"
+
+    def __init__(self, max_bytes: Optional[int], ttl_seconds: float, max_entry_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def _encode(self, messages: List[Dict]) -> bytes:
+        return json.dumps(messages).encode('utf-8')
+
+    def _decode(self, payload: bytes) -> List[Dict]:
+        return json.loads(payload.decode('utf-8') if isinstance(payload, (bytes, bytearray, memoryview)) else payload)
+
+    def put(self, key: str, messages: List[Dict]) -> bool:
+        """Store messages under key, returns False if they're over the per-entry limit"""
+        payload = self._encode(messages)
+        if len(payload) > self.max_entry_bytes:
+            self.rejected += 1
+            print(f"WARNING: Attachment payload for {key} is {len(payload)} bytes, over the {self.max_entry_bytes} byte limit")
+            return False
+        self._put(key, payload)
+        return True
+
+    def pop(self, key: str) -> Optional[List[Dict]]:
+        """Return and remove the messages stored under key (None if missing or expired)"""
+        payload = self._pop(key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._decode(payload)
+
+    def bytes_held(self) -> Optional[int]:
+        return None
+
+    def stats(self) -> Dict:
+        """Counters for monitoring the store"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'rejected': self.rejected,
+            'bytes_held': self.bytes_held(),
+            'max_bytes': self.max_bytes,
+            'max_entry_bytes': self.max_entry_bytes,
+        }
+
+    @abstractmethod
+    def _put(self, key: str, payload: bytes) -> None:
+        """Store an encoded payload under key, evicting whatever the backend's budget requires"""
+
+    @abstractmethod
+    def _pop(self, key: str) -> Optional[bytes]:
+        """Remove and return the payload under key (None if missing or expired)"""
+
+
+class InMemoryAttachmentStore(AttachmentStore):
+    """Per-process store: LRU order for the byte budget, a min-heap of expiry times for the TTL"""
+
+    backend = "memory"
+
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        super().__init__(max_bytes, ttl_seconds)
+        self._entries = OrderedDict()  # key -> (payload, expires_at)
+        self._expiry_heap = []  # (expires_at, key), may hold stale items for replaced keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str) -> bytes:
+        payload, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
+        return payload
+
+    def _expire(self, now: float) -> None:
+        # only looks at entries that are actually due instead of scanning everything
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry_heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key)
+                self.evictions += 1
+
+    def _put(self, key: str, payload: bytes) -> None:
+        now = time.monotonic()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, expires_at)
+            self._bytes += len(payload)
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+            # over budget - drop the least recently stored entries
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _pop(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            self._expire(time.monotonic())
+            if key not in self._entries:
+                return None
+            return self._remove(key)
+
+    def bytes_held(self) -> int:
+        return self._bytes
+
+
+class SQLiteAttachmentStore(AttachmentStore):
+    """Store backed by a local SQLite file (memory mapped) that every worker process can open"""
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float):
+        super().__init__(max_bytes, ttl_seconds)
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS attachment_cache (
+                cache_key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_attachment_cache_expires_at ON attachment_cache(expires_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_attachment_cache_stored_at ON attachment_cache(stored_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit mode so we control the transactions with BEGIN IMMEDIATE (locks out the other workers)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={max(self.max_bytes, 0)}")
+            self._local.conn = conn
+        return conn
+
+    def _put(self, key: str, payload: bytes) -> None:
+        # wall clock here since the expiry times are shared between processes
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM attachment_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO attachment_cache (cache_key, payload, size, expires_at, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(payload), len(payload), now + self.ttl_seconds, now)
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM attachment_cache").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute("SELECT cache_key, size FROM attachment_cache ORDER BY stored_at LIMIT 1").fetchone()
+                if not oldest:
+                    break
+                conn.execute("DELETE FROM attachment_cache WHERE cache_key = ?", (oldest[0],))
+                total -= oldest[1]
+                self.evictions += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _pop(self, key: str) -> Optional[bytes]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT payload, expires_at FROM attachment_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM attachment_cache WHERE cache_key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not row or row[1] <= time.time():
+            return None
+        return bytes(row[0])
+
+    def bytes_held(self) -> int:
+        return self._connection().execute("SELECT COALESCE(SUM(size), 0) FROM attachment_cache").fetchone()[0]
+
+
+class RedisAttachmentStore(AttachmentStore):
+    """Store that talks the Redis protocol (RESP) directly, so no extra client library is needed.
+
+    The server owns eviction here (configure maxmemory + an LRU policy on it), so there's no total budget -
+    we only enforce the per-entry size limit and let keys expire with PX.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, max_entry_bytes: int, ttl_seconds: float, key_prefix: str = "promptly:attachments:", timeout: float = 2.0):
+        super().__init__(None, ttl_seconds, max_entry_bytes=max_entry_bytes)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', str(self.db))
+
+    def _close(self):
+        try:
+            if self._sock:
+                self._sock.close()
+        finally:
+            self._sock = None
+            self._reader = None
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode()
+        if prefix == b'-':
+            raise RuntimeError(f"Redis error: {rest.decode()}")
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            count = int(rest)
+            return None if count == -1 else [self._read_reply() for _ in range(count)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+
+    def _call(self, *args):
+        self._send(*args)
+        return self._read_reply()
+
+    def _is_stale(self) -> bool:
+        """An idle connection with something to read means the server closed it (or it's out of sync)"""
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        return bool(readable)
+
+    def _command(self, *args, retry_after_send: bool = True):
+        """Send a command and read its reply, reconnecting once if the connection went stale
+        
+        Once the whole command is sent it may have run on the server, so a failure reading the reply (e.g. a
+        timeout) is only retried if retry_after_send says running it twice is harmless.
+        """
+        with self._lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._sock is not None and not retry_after_send and self._is_stale():
+                        # find out now rather than after the command might have gone through
+                        self._close()
+                    if self._sock is None:
+                        self._connect()
+                    self._send(*args)
+                    sent = True
+                    return self._read_reply()
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt == 1 or (sent and not retry_after_send):
+                        raise
+
+    def _put(self, key: str, payload: bytes) -> None:
+        self._command('SET', self.key_prefix + key, payload, 'PX', int(self.ttl_seconds * 1000))
+
+    def _pop(self, key: str) -> Optional[bytes]:
+        # GETDEL twice would find nothing the second time - better to raise than to lose the entry quietly
+        return self._command('GETDEL', self.key_prefix + key, retry_after_send=False)
+
+
+def create_attachment_store() -> AttachmentStore:
+    """Build the attachment store configured through ATTACHMENT_STORE_BACKEND"""
+    backend = Config.ATTACHMENT_STORE_BACKEND
+    max_bytes = Config.ATTACHMENT_STORE_MAX_BYTES
+    ttl_seconds = Config.ATTACHMENT_STORE_TTL_SECONDS
+
+    if backend == 'redis':
+        return RedisAttachmentStore(Config.ATTACHMENT_STORE_REDIS_URL, Config.ATTACHMENT_STORE_REDIS_MAX_ENTRY_BYTES, ttl_seconds)
+    if backend == 'sqlite':
+        path = Config.ATTACHMENT_STORE_PATH or os.path.join(tempfile.gettempdir(), 'promptly_attachments.db')
+        try:
+            return SQLiteAttachmentStore(path, max_bytes, ttl_seconds)
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not open attachment store at {path} ({e}), falling back to in-process store")
+    return InMemoryAttachmentStore(max_bytes, ttl_seconds)
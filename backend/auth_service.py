@@ -1,39 +1,351 @@
 # IMPORTANT NOTE: This was generated by Cursor, it contains the functions needed for auth0 authentication.
-from typing import Optional, Dict
+from typing import Optional, Dict, Callable, Tuple
 from functools import wraps
 from flask import request, jsonify
+from collections import OrderedDict, deque
+import copy
+import hashlib
+import random
 import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
 from jose import jwt
 from config import Config
 
+class _ForcedFetch:
+    """A blocking JWKS fetch other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+class JWKSCache:
+    """Process-wide cache of Auth0 signing keys, indexed by kid.
+
+    Keys are served from memory until the TTL runs out. After that the stale keys keep being served
+    while a background thread refetches the JWKS (stale-while-revalidate). A blocking refetch only
+    happens on a cold cache or when a token shows up with a kid we have never seen (key rotation), and
+    only one thread does it - the others wait for that fetch instead of starting their own.
+    """
+
+    def __init__(self, fetch_jwks: Callable[[], Dict], ttl_seconds: float = 3600, min_refetch_interval: float = 30):
+        self._fetch_jwks = fetch_jwks
+        self.ttl_seconds = ttl_seconds
+        # stops a flood of tokens with a bogus kid from hammering Auth0
+        self.min_refetch_interval = min_refetch_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._last_forced_refetch = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # the blocking fetch in progress, every other miss waits on it instead of starting its own
+        self._forced_fetch = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _load(self) -> None:
+        """Fetch the JWKS and replace the key index (caller handles errors)"""
+        jwks = self._fetch_jwks()
+        keys = {}
+        for key in jwks.get('keys', []):
+            if key.get('kid'):
+                keys[key['kid']] = {
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key['use'],
+                    'n': key['n'],
+                    'e': key['e']
+                }
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+
+    def _background_refresh(self) -> None:
+        try:
+            self._load()
+        except Exception as e:
+            # keep serving the stale keys, we'll try again on the next request
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"WARNING: Background JWKS refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _schedule_refresh(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="jwks-refresh", daemon=True).start()
+
+    def get_key(self, kid: str) -> Optional[Dict]:
+        """Return the signing key for a kid, fetching the JWKS only when we have to"""
+        with self._lock:
+            key = self._keys.get(kid)
+            fetched_at = self._fetched_at
+            if key is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                fetch = self._forced_fetch
+                leader = False
+                # Cold cache always fetches, unknown kid only refetches if we haven't just done so
+                if fetch is None and (fetched_at is None or time.monotonic() - self._last_forced_refetch >= self.min_refetch_interval):
+                    self._last_forced_refetch = time.monotonic()
+                    fetch = self._forced_fetch = _ForcedFetch()
+                    leader = True
+
+        if key is not None:
+            if time.monotonic() - fetched_at > self.ttl_seconds:
+                self._schedule_refresh()
+            return key
+        if fetch is None:
+            return None
+
+        if leader:
+            try:
+                self._load()
+            except Exception as e:
+                fetch.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._forced_fetch = None
+                fetch.done.set()
+        else:
+            # someone else is already fetching, their result (or error) is ours too
+            fetch.done.wait()
+            if fetch.error is not None:
+                raise fetch.error
+        with self._lock:
+            return self._keys.get(kid)
+
+    def stats(self) -> Dict:
+        """Counters for monitoring the cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'cached_keys': len(self._keys),
+            }
+
+class TokenCache:
+    """Bounded LRU of resolved users keyed by a SHA-256 digest of the bearer token.
+
+    Successful lookups live until the token's exp claim (or a shorter TTL if the caller asks), invalid
+    tokens are negatively cached for a short separate TTL so a bad token can't force a decode + /userinfo
+    call on every request either. Auth0 being down is never cached, that's not the token's fault.
+    """
+
+    def __init__(self, max_entries: int = 1024, negative_ttl_seconds: float = 10, exp_leeway_seconds: float = 5):
+        self.max_entries = max_entries
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # stop trusting a cached token a little before it actually expires
+        self.exp_leeway_seconds = exp_leeway_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(token: str) -> str:
+        # never keep raw tokens around in memory longer than needed
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Return (found, user) - user is None for a negatively cached token"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            user, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if user is None:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+        # callers are free to mutate what they get back
+        return True, copy.deepcopy(user)
+
+    def _put(self, key: str, user: Optional[Dict], expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: str, user: Dict, exp: Optional[float], ttl_seconds: Optional[float] = None) -> None:
+        """Cache a resolved user until the token expires, or for ttl_seconds if that's sooner (tokens without exp aren't cached)"""
+        if not exp:
+            return
+        expires_at = float(exp) - self.exp_leeway_seconds
+        if ttl_seconds is not None:
+            expires_at = min(expires_at, time.time() + ttl_seconds)
+        if expires_at <= time.time():
+            return
+        self._put(key, copy.deepcopy(user), expires_at)
+
+    def put_failure(self, key: str) -> None:
+        """Negatively cache a token that's invalid in itself (bad signature, expired, no email)"""
+        self._put(key, None, time.time() + self.negative_ttl_seconds)
+
+    def stats(self) -> Dict:
+        """Counters for monitoring the cache"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+        }
+
+class Auth0HTTPClient:
+    """One requests.Session shared by every Auth0 call in the process.
+
+    Connections are pooled and kept alive, so only the first call pays for the TCP + TLS handshake. Every
+    call has separate connect/read timeouts, 429/5xx responses and connection errors are retried with
+    jittered exponential backoff (Retry-After is honored up to max_backoff), and latency is recorded per
+    endpoint so auth overhead shows up in /api/metrics.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 3.0, read_timeout: float = 5.0,
+                 max_retries: int = 2, backoff_base: float = 0.2, max_backoff: float = 2.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # retries are done below (with jitter and metrics), so the adapter itself never retries
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # full jitter so a burst of workers doesn't retry in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * (2 ** attempt)))
+
+    def _record(self, endpoint: str, elapsed: float, error: bool = False, retried: bool = False) -> None:
+        with self._lock:
+            metrics = self._metrics.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'recent_ms': deque(maxlen=256)
+            })
+            elapsed_ms = elapsed * 1000
+            metrics['calls'] += 1
+            metrics['errors'] += int(error)
+            metrics['retries'] += int(retried)
+            metrics['total_ms'] += elapsed_ms
+            metrics['max_ms'] = max(metrics['max_ms'], elapsed_ms)
+            metrics['recent_ms'].append(elapsed_ms)
+
+    def get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """GET with pooling, timeouts and retries - endpoint is just the name the latency is recorded under"""
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                will_retry = attempt < self.max_retries
+                self._record(endpoint, time.monotonic() - started, error=True, retried=will_retry)
+                if not will_retry:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            will_retry = response.status_code in self.RETRY_STATUSES and attempt < self.max_retries
+            self._record(endpoint, time.monotonic() - started, error=not response.ok, retried=will_retry)
+            if not will_retry:
+                return response
+            time.sleep(self._backoff(attempt, response))
+        return response
+
+    def stats(self) -> Dict:
+        """Latency per endpoint (milliseconds)"""
+        with self._lock:
+            result = {}
+            for endpoint, metrics in self._metrics.items():
+                recent = sorted(metrics['recent_ms'])
+                result[endpoint] = {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'retries': metrics['retries'],
+                    'avg_ms': round(metrics['total_ms'] / metrics['calls'], 1) if metrics['calls'] else 0.0,
+                    'p50_ms': round(recent[len(recent) // 2], 1) if recent else 0.0,
+                    'p95_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else 0.0,
+                    'max_ms': round(metrics['max_ms'], 1),
+                }
+            return result
+
 class AuthService:
     def __init__(self):
         self.domain = Config.AUTH0_DOMAIN
         self.api_audience = Config.AUTH0_API_AUDIENCE
         self.algorithms = [Config.AUTH0_ALGORITHMS]
         self.issuer = Config.AUTH0_ISSUER
+        # keep-alive connections to Auth0 shared by the JWKS and /userinfo calls
+        self.http = Auth0HTTPClient(
+            pool_size=Config.AUTH0_HTTP_POOL_SIZE,
+            connect_timeout=Config.AUTH0_CONNECT_TIMEOUT_SECONDS,
+            read_timeout=Config.AUTH0_READ_TIMEOUT_SECONDS,
+            max_retries=Config.AUTH0_HTTP_MAX_RETRIES
+        )
+        # the global auth_service below is shared by every request in the process, so this cache is too
+        self.jwks_cache = JWKSCache(
+            self._fetch_jwks,
+            ttl_seconds=Config.JWKS_CACHE_TTL_SECONDS,
+            min_refetch_interval=Config.JWKS_MIN_REFETCH_INTERVAL_SECONDS
+        )
+        # the frontend fires several calls per page load with the same token, so remember who it belongs to
+        self.token_cache = TokenCache(
+            max_entries=Config.TOKEN_CACHE_MAX_ENTRIES,
+            negative_ttl_seconds=Config.TOKEN_CACHE_NEGATIVE_TTL_SECONDS
+        )
+        self.partial_user_ttl_seconds = Config.TOKEN_CACHE_PARTIAL_TTL_SECONDS
+    
+    def _fetch_jwks(self) -> Dict:
+        """Download the JWKS document from Auth0"""
+        jwks_url = f"https://{self.domain}/.well-known/jwks.json"
+        response = self.http.get('jwks', jwks_url)
+        response.raise_for_status()
+        return response.json()
         
     def get_public_key(self, token: str) -> Dict:
         """Get public key from Auth0 for JWT verification"""
         try:
-            # Get JWKS from Auth0
-            jwks_url = f"https://{self.domain}/.well-known/jwks.json"
-            response = requests.get(jwks_url)
-            response.raise_for_status()
-            
-            jwks = response.json()
             unverified_header = jwt.get_unverified_header(token)
             
-            # Find the matching key
-            for key in jwks['keys']:
-                if key['kid'] == unverified_header['kid']:
-                    return {
-                        'kty': key['kty'],
-                        'kid': key['kid'],
-                        'use': key['use'],
-                        'n': key['n'],
-                        'e': key['e']
-                    }
+            # Find the matching key (cached, only goes to Auth0 on a cold cache or an unknown kid)
+            key = self.jwks_cache.get_key(unverified_header['kid'])
+            if key:
+                return key
             
             raise ValueError('Unable to find appropriate key')
             
@@ -41,8 +353,12 @@ class AuthService:
             print(f"Error getting public key: {e}")
             raise
     
-    def verify_token(self, token: str) -> Optional[Dict]:
-        """Verify Auth0 JWT token and return payload"""
+    def verify_token(self, token: str, raise_unavailable: bool = False) -> Optional[Dict]:
+        """Verify Auth0 JWT token and return payload
+        
+        Returns None for a token that's invalid. With raise_unavailable, anything else that stopped the check
+        (JWKS fetch failed, key not found) is raised instead so the caller can tell the two apart.
+        """
         try:
             # Get public key
             public_key = self.get_public_key(token)
@@ -64,8 +380,13 @@ class AuthService:
         except jwt.JWTClaimsError as e:
             print(f"Invalid token claims: {e}")
             return None
+        except jwt.JWTError as e:
+            print(f"Error verifying token: {e}")
+            return None
         except Exception as e:
             print(f"Error verifying token: {e}")
+            if raise_unavailable:
+                raise
             return None
     
     def get_user_from_token(self, authorization_header: str) -> Optional[Dict]:
@@ -75,12 +396,38 @@ class AuthService:
             return None
         
         token = authorization_header.replace('Bearer ', '')
-        payload = self.verify_token(token)
+        cache_key = self.token_cache.digest(token)
+        found, cached_user = self.token_cache.get(cache_key)
+        if found:
+            return cached_user
+        
+        try:
+            payload = self.verify_token(token, raise_unavailable=True)
+        except Exception:
+            # couldn't check the token at all (JWKS fetch, network) - fail this request but don't remember it
+            print("ERROR: Token verification failed")
+            return None
         
         if not payload:
             print("ERROR: Token verification failed")
+            self.token_cache.put_failure(cache_key)
             return None
         
+        user, complete = self._build_user(payload, authorization_header)
+        if user:
+            # a user built while /userinfo was failing is missing profile data, so only keep it briefly
+            ttl_seconds = None if complete else self.partial_user_ttl_seconds
+            self.token_cache.put(cache_key, user, payload.get('exp'), ttl_seconds=ttl_seconds)
+        elif complete:
+            self.token_cache.put_failure(cache_key)
+        return user
+    
+    def _build_user(self, payload: Dict, authorization_header: str) -> Tuple[Optional[Dict], bool]:
+        """Turn a verified token payload into our user dict, calling /userinfo for missing profile data
+        
+        Also returns whether the answer is complete - False if /userinfo was needed but failed (429, 5xx,
+        timeout), in which case it shouldn't be cached for long (or at all if there's no user).
+        """
         # Try to extract email from various possible locations in the token
         email = payload.get('email')
         
@@ -101,12 +448,13 @@ class AuthService:
         # Always try to get complete profile from /userinfo if profile data is missing
         has_name = name and (isinstance(name, str) and name.strip() != '')
         needs_userinfo = not email or not has_name or not picture
+        complete = True
         
         if needs_userinfo:
             try:
                 userinfo_url = f"https://{self.domain}/userinfo"
                 headers = {'Authorization': authorization_header}
-                resp = requests.get(userinfo_url, headers=headers, timeout=5)
+                resp = self.http.get('userinfo', userinfo_url, headers=headers)
                 
                 if resp.status_code == 200:
                     ui = resp.json()
@@ -126,21 +474,25 @@ class AuthService:
                 elif resp.status_code == 429:
                     # Rate limit - cannot proceed without email
                     print(f"ERROR: Auth0 rate limit hit. Cannot get user info. Sub: {payload.get('sub')}")
+                    complete = False
                     if not email:
                         # Return None to fail authentication gracefully
-                        return None
+                        return None, complete
                 else:
                     print(f"WARNING: /userinfo call failed: {resp.status_code} {resp.text}")
+                    # a 4xx means /userinfo won't take this token, retrying later only helps for a 5xx
+                    complete = resp.status_code not in self.http.RETRY_STATUSES
                     if not email:
                         # Cannot proceed without email for database
                         print(f"ERROR: Cannot get user email from token or /userinfo. Sub: {payload.get('sub')}")
-                        return None
+                        return None, complete
             except requests.exceptions.RequestException as ex:
                 print(f"WARNING: failed to fetch /userinfo: {ex}")
+                complete = False
                 if not email:
                     # Cannot proceed without email
                     print(f"ERROR: Cannot get user email. Sub: {payload.get('sub')}")
-                    return None
+                    return None, complete
         
         # Email is required for database operations so we really need this
         if not email or '@' not in str(email):
@@ -156,7 +508,7 @@ class AuthService:
                 print(f"ERROR: Email claim not found in token.")
                 print(f"ERROR: Make sure Auth0 action is configured correctly and you've logged in after setting it up.")
             
-            return None
+            return None, complete
 
         return {
             'email': email,
@@ -164,7 +516,7 @@ class AuthService:
             'name': name.split() if isinstance(name, str) and name else [],
             'picture': picture,
             'nickname': nickname
-        }
+        }, complete
 
 # Global auth service instance
 auth_service = AuthService()
@@ -0,0 +1,110 @@
+# Compares the old SSE paths against the current ones and reports end-to-end time, the number of events
+# (one socket write each) and the bytes sent per response:
+#  - simulated streams for non-streaming models: 2-word chunks with a 50ms sleep after each, against the
+#    answer sent right away in frames of up to SSE_FRAME_MAX_CHARS
+#  - live streams: one event per model delta plus the whole answer again in the done event, against
+#    SSEWriter's coalesced frames and a length/hash done event (--delta-seconds fakes the model's pace)
+#
+#   python benchmarks/simulated_stream_benchmark.py --words 100,600,1500
+#
+# The old paths are reproduced here since they're gone from the app. The old simulated path's time is almost
+# all sleep, and that sleep held a worker thread for the whole answer.
+import argparse
+import os
+import sys
+import time
+
+# so the backend modules can be imported when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse import sse_event, text_frames, SSEWriter
+
+
+def legacy_stream(answer, delay):
+    words = answer.split(' ')
+    for i in range(0, len(words), 2):
+        chunk = ' '.join(words[i:i + 2])
+        if i + 2 < len(words):
+            chunk += ' '
+        yield sse_event({'chunk': chunk})
+        time.sleep(delay)
+    yield sse_event({'done': True, 'full_response': answer})
+
+
+def framed_stream(answer, max_chars):
+    writer = SSEWriter()
+    for chunk in text_frames(answer, max_chars):
+        frame = writer.add(chunk)
+        if frame:
+            yield frame
+    frame = writer.flush()
+    if frame:
+        yield frame
+    yield writer.done()
+
+
+def model_deltas(answer, delta_seconds):
+    # roughly what the OpenAI stream hands us - a word or part of one per delta
+    for word in answer.split(' '):
+        for i in range(0, len(word), 3):
+            yield word[i:i + 3]
+            time.sleep(delta_seconds)
+        yield ' '
+
+
+def legacy_live_stream(answer, delta_seconds):
+    parts = ""
+    for delta in model_deltas(answer, delta_seconds):
+        parts += delta
+        yield sse_event({'chunk': delta})
+    yield sse_event({'done': True, 'full_response': parts})
+
+
+def coalesced_live_stream(answer, delta_seconds, max_bytes, flush_interval):
+    writer = SSEWriter(max_bytes=max_bytes, flush_interval=flush_interval)
+    for delta in model_deltas(answer, delta_seconds):
+        frame = writer.add(delta)
+        if frame:
+            yield frame
+    frame = writer.flush()
+    if frame:
+        yield frame
+    yield writer.done()
+
+
+def measure(stream):
+    started = time.monotonic()
+    events = 0
+    size = 0
+    for event in stream:
+        events += 1
+        size += len(event.encode('utf-8'))
+    return time.monotonic() - started, events, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--words", default="100,600,1500", help="comma separated answer lengths in words")
+    parser.add_argument("--frame-chars", type=int, default=512, help="SSE_FRAME_MAX_CHARS for the current path")
+    parser.add_argument("--legacy-delay", type=float, default=0.05, help="sleep per chunk in the old path")
+    parser.add_argument("--delta-seconds", type=float, default=0.002, help="time between model deltas in the live paths")
+    parser.add_argument("--frame-bytes", type=int, default=1024, help="SSE_FRAME_MAX_BYTES for the live path")
+    parser.add_argument("--flush-ms", type=int, default=50, help="SSE_FLUSH_INTERVAL_MS for the live path")
+    args = parser.parse_args()
+
+    print(f"{'words':>6} {'path':>8} {'seconds':>9} {'events':>7} {'bytes':>8}")
+    for words in [int(w) for w in args.words.split(',')]:
+        answer = " ".join(f"word{i % 97}" for i in range(words))
+        paths = (
+            ("legacy", legacy_stream(answer, args.legacy_delay)),
+            ("framed", framed_stream(answer, args.frame_chars)),
+            ("live-old", legacy_live_stream(answer, args.delta_seconds)),
+            ("live-new", coalesced_live_stream(answer, args.delta_seconds, args.frame_bytes, args.flush_ms / 1000)),
+        )
+        for name, stream in paths:
+            seconds, events, size = measure(stream)
+            print(f"{words:>6} {name:>8} {seconds:>9.3f} {events:>7} {size:>8}")
+
+
+if __name__ == "__main__":
+    main()
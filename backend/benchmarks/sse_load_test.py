@@ -0,0 +1,121 @@
+# Load test for the streamed /response endpoint: opens N concurrent SSE streams at a few concurrency levels
+# and reports time to first chunk, total stream time and throughput, so sync (gunicorn app:app) and async
+# (gunicorn asgi:application -k uvicorn.workers.UvicornWorker) serving can be compared.
+#
+#   python benchmarks/sse_load_test.py --url http://localhost:5001 --token "$TOKEN" \
+#       --conversation-id <id of a conversation with at least one message> --levels 1,10,50,200
+#
+# Every completed stream appends an assistant message to the conversation, so point it at a throwaway one.
+# --local runs the ASGI app in this process against a fake model that streams --chunks chunks over
+# --stream-seconds, which isolates the server's concurrency from OpenAI's.
+# (httpx buffers in-process ASGI responses, so in --local mode time to first chunk equals the stream time)
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import httpx
+
+# so --local can import the backend modules when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def one_stream(client, url, headers):
+    started = time.monotonic()
+    first_chunk = None
+    chunks = 0
+    async with client.stream("POST", url, headers=headers) as response:
+        if response.status_code != 200:
+            return {"ok": False, "status": response.status_code}
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                chunks += 1
+                if first_chunk is None:
+                    first_chunk = time.monotonic() - started
+    return {"ok": True, "ttfb": first_chunk or 0.0, "total": time.monotonic() - started, "chunks": chunks}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def run_level(client, url, headers, concurrency):
+    started = time.monotonic()
+    results = await asyncio.gather(*(one_stream(client, url, headers) for _ in range(concurrency)), return_exceptions=True)
+    elapsed = time.monotonic() - started
+    ok = [r for r in results if isinstance(r, dict) and r.get("ok")]
+    ttfb = [r["ttfb"] for r in ok]
+    totals = [r["total"] for r in ok]
+    return {
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "ttfb_p50": statistics.median(ttfb) if ttfb else 0.0,
+        "ttfb_p95": percentile(ttfb, 95),
+        "stream_p50": statistics.median(totals) if totals else 0.0,
+        "wall": elapsed,
+        "streams_per_sec": len(ok) / elapsed if elapsed else 0.0,
+    }
+
+
+def local_app(chunks, stream_seconds):
+    """The ASGI app with auth, database and model replaced by in-memory fakes (benchmarking only)"""
+    from unittest.mock import patch, MagicMock
+    import asgi
+    
+    async def fake_stream(*args, **kwargs):
+        for i in range(chunks):
+            await asyncio.sleep(stream_seconds / chunks)
+            yield f"token{i} "
+    
+    fake_db = MagicMock()
+    fake_db.get_conversation.return_value = {"conversation_id": "bench", "messages": [{"role": "user", "content": "Hi"}], "quality_score": 7.5}
+    fake_db.get_user_by_email.return_value = {"first_name": "Bench"}
+    fake_ai = MagicMock()
+    fake_ai._supports_streaming.return_value = True
+    fake_ai.get_chat_response_stream_async = fake_stream
+    patches = [
+        patch("app.db", fake_db),
+        patch("app.ai_service", fake_ai),
+        patch("auth_service.auth_service.get_user_from_token", return_value={"email": "bench@example.com"}),
+    ]
+    for p in patches:
+        p.start()
+    return asgi.application
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrent SSE load test for /response")
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--token", default="bench-token")
+    parser.add_argument("--conversation-id", default="bench")
+    parser.add_argument("--levels", default="1,10,50,200")
+    parser.add_argument("--local", action="store_true", help="run the ASGI app in process with a fake model")
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--stream-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    
+    levels = [int(level) for level in args.levels.split(",")]
+    headers = {"Authorization": f"Bearer {args.token}"}
+    if args.local:
+        transport = httpx.ASGITransport(app=local_app(args.chunks, args.stream_seconds))
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+    else:
+        limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+        client = httpx.AsyncClient(base_url=args.url, timeout=None, limits=limits)
+    
+    url = f"/api/conversations/{args.conversation_id}/response"
+    print(f"{'conc':>5} {'ok':>5} {'err':>4} {'ttfb p50':>9} {'ttfb p95':>9} {'stream p50':>11} {'wall':>7} {'streams/s':>10}")
+    async with client:
+        for level in levels:
+            r = await run_level(client, url, headers, level)
+            print(f"{r['concurrency']:>5} {r['ok']:>5} {r['errors']:>4} {r['ttfb_p50']:>8.3f}s {r['ttfb_p95']:>8.3f}s "
+                  f"{r['stream_p50']:>10.3f}s {r['wall']:>6.2f}s {r['streams_per_sec']:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# Conditional GETs for the conversation endpoints. The frontend reloads the conversation list and the open
+# conversation a lot, and most of those reloads get back exactly what they already have. The ETags come from
+# the version counters in database.py (see conversation_versions), so checking one is a single-row lookup, and
+# a match is answered with an empty 304 before any messages are read or any JSON is built.
+#
+# Responses are sent with Cache-Control: private, no-cache so the browser keeps them but asks every time -
+# it sends If-None-Match on its own and hands the cached body to axios when it gets a 304.
+import hashlib
+import threading
+from typing import Dict
+
+from flask import Response, request
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(user_email: str, *parts) -> str:
+    """Strong ETag (unquoted, werkzeug adds the quotes) from the version and whatever else shapes the body
+    
+    The versions are small per-user counters, so two users can easily be at the same one - the ETag starts with
+    a hash of the user so one user's cached body can never be revalidated for another on a shared browser.
+    """
+    user_part = hashlib.sha256((user_email or '').encode('utf-8')).hexdigest()[:16]
+    return '-'.join(str(part) for part in (user_part, *parts) if part is not None)
+
+
+def not_modified(etag: str) -> Response:
+    """Empty 304 carrying the same validators a full response would"""
+    response = Response(status=304)
+    return with_validators(response, etag)
+
+
+def with_validators(response: Response, etag: str) -> Response:
+    """Attach the ETag and the revalidate-every-time cache policy"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    # the body depends on who's asking, not just the URL
+    response.vary.add('Authorization')
+    return response
+
+
+def client_has(etag: str) -> bool:
+    """Whether the request's If-None-Match already names this ETag"""
+    return request.if_none_match.contains(etag)
+
+
+class ConditionalGetStats:
+    """304 hit ratio per endpoint, for /api/metrics"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, hit: bool) -> None:
+        # conditional = the client sent If-None-Match at all (a first load can't be a hit)
+        conditional = bool(request.if_none_match)
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, {'requests': 0, 'conditional': 0, 'not_modified': 0})
+            counts['requests'] += 1
+            counts['conditional'] += int(conditional)
+            counts['not_modified'] += int(hit)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    **counts,
+                    'hit_rate': round(counts['not_modified'] / counts['requests'], 4) if counts['requests'] else 0.0,
+                    'conditional_hit_rate': round(counts['not_modified'] / counts['conditional'], 4) if counts['conditional'] else 0.0,
+                }
+                for endpoint, counts in self._counts.items()
+            }
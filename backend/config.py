@@ -1,6 +1,7 @@
 # IMPORTANT NOTE: This was generated by Cursor, it contains the configuration and important
 # variables for the backend.
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Try to load from environment first, then fall back to api_key.py
@@ -19,6 +20,24 @@ class Config:
     # Database URL - Render provides DATABASE_URL for PostgreSQL
     # For local dev, use SQLite if DATABASE_URL is not set
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///promptly.db')
+    # SQLite connection setup, applied once per pooled connection
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000'))
+    SQLITE_CACHE_SIZE_KIB = int(os.getenv('SQLITE_CACHE_SIZE_KIB', '8192'))
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024)))
+    
+    # Per-process user row cache (0 disables it) and how often queued last_login stamps are written (0 writes right away)
+    USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '300'))
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '10000'))
+    LAST_LOGIN_FLUSH_SECONDS = float(os.getenv('LAST_LOGIN_FLUSH_SECONDS', '30'))
+    # How long a reconciled Auth0 profile is trusted before /messages syncs it again (0 syncs on every /messages)
+    PROFILE_SYNC_TTL_SECONDS = float(os.getenv('PROFILE_SYNC_TTL_SECONDS', '3600'))
+    
+    # Conversation list page size (the server caps ?limit= at the max so a client can't ask for everything at once)
+    CONVERSATIONS_PAGE_SIZE = int(os.getenv('CONVERSATIONS_PAGE_SIZE', '50'))
+    CONVERSATIONS_MAX_PAGE_SIZE = int(os.getenv('CONVERSATIONS_MAX_PAGE_SIZE', '200'))
+    # Deleted conversations are reported to the sidebar's delta sync for this long, a client that's been away
+    # longer just reloads the list
+    CONVERSATION_TOMBSTONE_RETENTION_DAYS = float(os.getenv('CONVERSATION_TOMBSTONE_RETENTION_DAYS', '30'))
     
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     
@@ -27,6 +46,22 @@ class Config:
     AUTH0_ALGORITHMS = os.getenv('AUTH0_ALGORITHMS', 'RS256')
     AUTH0_ISSUER = f"https://{os.getenv('AUTH0_DOMAIN', '')}/" if os.getenv('AUTH0_DOMAIN') else ''
     
+    # How long Auth0 signing keys are trusted before a background refresh, and how often an unknown kid can force a refetch
+    JWKS_CACHE_TTL_SECONDS = int(os.getenv('JWKS_CACHE_TTL_SECONDS', '3600'))
+    JWKS_MIN_REFETCH_INTERVAL_SECONDS = int(os.getenv('JWKS_MIN_REFETCH_INTERVAL_SECONDS', '30'))
+    
+    # Verified tokens are cached until they expire, invalid ones only briefly, and users built while /userinfo
+    # was failing (missing name/picture) only for the partial TTL so the profile gets filled in soon
+    TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', '1024'))
+    TOKEN_CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_NEGATIVE_TTL_SECONDS', '10'))
+    TOKEN_CACHE_PARTIAL_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_PARTIAL_TTL_SECONDS', '30'))
+    
+    # Pooled keep-alive connections to Auth0 (JWKS and /userinfo), with timeouts and retries on 429/5xx
+    AUTH0_HTTP_POOL_SIZE = int(os.getenv('AUTH0_HTTP_POOL_SIZE', '10'))
+    AUTH0_CONNECT_TIMEOUT_SECONDS = float(os.getenv('AUTH0_CONNECT_TIMEOUT_SECONDS', '3'))
+    AUTH0_READ_TIMEOUT_SECONDS = float(os.getenv('AUTH0_READ_TIMEOUT_SECONDS', '5'))
+    AUTH0_HTTP_MAX_RETRIES = int(os.getenv('AUTH0_HTTP_MAX_RETRIES', '2'))
+    
     # Production settings
     ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
@@ -34,7 +69,76 @@ class Config:
     # CORS settings - allow frontend URL in production
     FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
     
+    # Comma separated emails allowed to read /api/metrics (process-wide stats, not for every user) - empty means nobody
+    METRICS_ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('METRICS_ADMIN_EMAILS', '').split(',') if email.strip()}
+    
+    # Where messages with base64 attachments wait between /messages and /response
+    # sqlite (default) is shared by all gunicorn workers on the box, memory is per-process, redis needs ATTACHMENT_STORE_REDIS_URL
+    ATTACHMENT_STORE_BACKEND = os.getenv('ATTACHMENT_STORE_BACKEND', 'sqlite').lower()
+    ATTACHMENT_STORE_PATH = os.getenv('ATTACHMENT_STORE_PATH', '')
+    ATTACHMENT_STORE_REDIS_URL = os.getenv('ATTACHMENT_STORE_REDIS_URL', 'redis://localhost:6379/0')
+    # total budget for the sqlite and memory backends (oldest entries are evicted past it)
+    ATTACHMENT_STORE_MAX_BYTES = int(os.getenv('ATTACHMENT_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+    # redis has no total budget here (set maxmemory on the server), this caps a single entry instead
+    ATTACHMENT_STORE_REDIS_MAX_ENTRY_BYTES = int(os.getenv('ATTACHMENT_STORE_REDIS_MAX_ENTRY_BYTES', str(64 * 1024 * 1024)))
+    ATTACHMENT_STORE_TTL_SECONDS = int(os.getenv('ATTACHMENT_STORE_TTL_SECONDS', '300'))
+    
     # Title generation settings
     # If True: Generate 5-word titles using ChatGPT 4o
     # If False: Use first message directly (old behavior)
-    USE_AI_TITLE_GENERATION = os.getenv('USE_AI_TITLE_GENERATION', 'true').lower() == 'true'
\ No newline at end of file
+    USE_AI_TITLE_GENERATION = os.getenv('USE_AI_TITLE_GENERATION', 'true').lower() == 'true'
+    
+    # Feedback and title are requested in parallel on a bounded thread pool, each with its own deadline
+    MODEL_CALL_WORKERS = int(os.getenv('MODEL_CALL_WORKERS', '8'))
+    FEEDBACK_TIMEOUT_SECONDS = float(os.getenv('FEEDBACK_TIMEOUT_SECONDS', '30'))
+    TITLE_TIMEOUT_SECONDS = float(os.getenv('TITLE_TIMEOUT_SECONDS', '5'))
+    # the two above are also the whole budget of those OpenAI calls (every retry included), these are per attempt
+    CHAT_TIMEOUT_SECONDS = float(os.getenv('CHAT_TIMEOUT_SECONDS', '90'))
+    STREAM_FIRST_TOKEN_TIMEOUT_SECONDS = float(os.getenv('STREAM_FIRST_TOKEN_TIMEOUT_SECONDS', '30'))
+    
+    # Non-streaming model answers are sent in frames of up to this many characters, all at once
+    SSE_FRAME_MAX_CHARS = int(os.getenv('SSE_FRAME_MAX_CHARS', '512'))
+    # Delay between those frames on the async (ASGI) route only - the sync route never sleeps
+    SIMULATED_STREAM_PACING_MS = int(os.getenv('SIMULATED_STREAM_PACING_MS', '0'))
+    # Threads per worker process for the Flask routes under ASGI (asgi.py) - how many sync requests can run at once
+    WSGI_THREADS = int(os.getenv('WSGI_THREADS', '32'))
+    # Streamed tokens are packed into one SSE frame until it reaches this size or this long since the last frame
+    SSE_FRAME_MAX_BYTES = int(os.getenv('SSE_FRAME_MAX_BYTES', '1024'))
+    SSE_FLUSH_INTERVAL_MS = int(os.getenv('SSE_FLUSH_INTERVAL_MS', '50'))
+    
+    # OpenAI connection pool, retries (the SDK's own are off) and the circuit breaker that fails fast when OpenAI is down
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+    OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY_SECONDS', '60'))
+    OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv('OPENAI_CONNECT_TIMEOUT_SECONDS', '5'))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+    # feedback/title only retry if at least this much of their deadline is left for the new attempt
+    OPENAI_MIN_RETRY_SECONDS = float(os.getenv('OPENAI_MIN_RETRY_SECONDS', '1'))
+    OPENAI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('OPENAI_BREAKER_FAILURE_THRESHOLD', '5'))
+    OPENAI_BREAKER_RESET_SECONDS = float(os.getenv('OPENAI_BREAKER_RESET_SECONDS', '30'))
+    
+    # Speculative replies: start streaming the answer under the previous turn's score bucket while feedback runs (off by default)
+    SPECULATIVE_RESPONSES = os.getenv('SPECULATIVE_RESPONSES', 'false').lower() == 'true'
+    SPECULATION_MAX_ACTIVE = int(os.getenv('SPECULATION_MAX_ACTIVE', '16'))
+    SPECULATION_TTL_SECONDS = int(os.getenv('SPECULATION_TTL_SECONDS', '120'))
+    
+    # Extracted PDF text, keyed by content hash. Set PDF_TEXT_CACHE_DIR to an empty string to keep it in memory only
+    PDF_TEXT_CACHE_MAX_CHARS = int(os.getenv('PDF_TEXT_CACHE_MAX_CHARS', str(20 * 1024 * 1024)))
+    PDF_TEXT_CACHE_DIR = os.getenv('PDF_TEXT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'promptly_pdf_text'))
+    
+    # PDF parsing runs in a process pool (0 workers = inline) with per-document limits, partial text is kept when one is hit
+    PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', '2'))
+    PDF_EXTRACTION_TIMEOUT_SECONDS = float(os.getenv('PDF_EXTRACTION_TIMEOUT_SECONDS', '10'))
+    PDF_EXTRACTION_MAX_PAGES = int(os.getenv('PDF_EXTRACTION_MAX_PAGES', '100'))
+    PDF_EXTRACTION_MAX_CHARS = int(os.getenv('PDF_EXTRACTION_MAX_CHARS', '200000'))
+    
+    # Estimated token budgets for the conversation history sent with each call (older turns get summarized past these)
+    CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '12000'))
+    FEEDBACK_HISTORY_TOKEN_BUDGET = int(os.getenv('FEEDBACK_HISTORY_TOKEN_BUDGET', '4000'))
+    HISTORY_SUMMARY_TOKEN_BUDGET = int(os.getenv('HISTORY_SUMMARY_TOKEN_BUDGET', '600'))
+    
+    # Score replies like "ok" / "idk" / "help me" locally (1/10 with canned tips) instead of calling the feedback model
+    PRESCORER_ENABLED = os.getenv('PRESCORER_ENABLED', 'true').lower() == 'true'
+    
+    # Ask the feedback model for schema-constrained JSON (structured output), false falls back to plain JSON mode
+    FEEDBACK_STRUCTURED_OUTPUT = os.getenv('FEEDBACK_STRUCTURED_OUTPUT', 'true').lower() == 'true'
\ No newline at end of file
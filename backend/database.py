@@ -4,9 +4,13 @@
 # I moved from sqlite to postgres when I deployed to render, but you'll see there is still sqlite code to avoid accidentally breaking something
 import os
 import json
-from datetime import datetime
+import base64
+import hashlib
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+import sqlite3
 from config import Config
+from sqlite_pool import SQLiteConnectionPool
 
 # Determine which database to use based on DATABASE_URL
 DATABASE_URL = Config.DATABASE_URL
@@ -26,19 +30,55 @@ if USE_POSTGRES:
 
 # SQLite fallback - but on render version won't fall back
 if not USE_POSTGRES:
-    import sqlite3
     print("Using SQLite database")
 
+# message dict keys with a column of their own in the messages table, anything else goes in messages.extra
+MESSAGE_COLUMNS = ('role', 'content', 'attachments', 'timestamp')
+# how many times an append is retried when a concurrent one took the same seq
+MESSAGE_APPEND_ATTEMPTS = 3
+# what the conversation list is sorted and paged by - updated_at can be NULL on old rows, and a NULL would
+# drop out of every (key, id) < (?, ?) comparison, so those sort by when they were created instead
+ACTIVITY_AT = "COALESCE(updated_at, created_at)"
+
+def encode_page_cursor(activity_at: Optional[str], conversation_id: str) -> str:
+    """Opaque cursor for the conversation list - the (ACTIVITY_AT, conversation_id) of the last row on a page"""
+    raw = json.dumps([activity_at, conversation_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_page_cursor(cursor: str) -> tuple:
+    """(activity_at, conversation_id) from encode_page_cursor, ValueError if the cursor is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        activity_at, conversation_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(activity_at, (str, type(None))) or not isinstance(conversation_id, str):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return activity_at, conversation_id
+
+
 class Database:
     def __init__(self, db_path: str = "promptly.db"):
         self.use_postgres = USE_POSTGRES
         self.db_path = db_path
         self.database_url = DATABASE_URL
+        self.tombstone_retention_days = Config.CONVERSATION_TOMBSTONE_RETENTION_DAYS
+        # what the live schema supports (e.g. the message_count column), resolved once in init_database
+        self.capabilities = {'has_message_count': False, 'has_returning': self.use_postgres or self._sqlite_has_returning()}
+        self._build_queries()
         
         if self.use_postgres:
             self._init_postgres()
         else:
             self.clear_locks()
+            # one connection per thread, set up once instead of on every query
+            self.sqlite_pool = SQLiteConnectionPool(
+                db_path,
+                busy_timeout_ms=Config.SQLITE_BUSY_TIMEOUT_MS,
+                cache_size_kib=Config.SQLITE_CACHE_SIZE_KIB,
+                mmap_size=Config.SQLITE_MMAP_SIZE
+            )
         
         self.init_database()
     
@@ -87,16 +127,17 @@ class Database:
             conn.autocommit = False
             return conn
         else:
-            conn = sqlite3.connect(self.db_path, timeout=30.0)
-            conn.execute("PRAGMA journal_mode=WAL")
-            return conn
+            return self.sqlite_pool.acquire()
     
     def _close_connection(self, conn):
         """Close or return connection to pool depending on database type"""
         if not conn:
             return
         
-        if self.use_postgres and self.conn_pool:
+        if not self.use_postgres:
+            # stays open for this thread's next query
+            self.sqlite_pool.release(conn)
+        elif self.conn_pool:
             # Return to connection pool
             try:
                 self.conn_pool.putconn(conn)
@@ -104,16 +145,29 @@ class Database:
                 print(f"Warning: Failed to return connection to pool: {e}")
                 # If returning fails, close the connection
                 try:
-                    self._close_connection(conn)
-                except:
+                    conn.close()
+                except Exception:
                     pass
         else:
-            # Close connection directly (SQLite or PostgreSQL without pool)
+            # PostgreSQL without a pool - direct connection
             try:
-                self._close_connection(conn)
-            except:
+                conn.close()
+            except Exception:
                 pass
     
+    def close(self):
+        """Close every connection this Database holds (shutdown and tests)"""
+        if self.use_postgres:
+            if self.conn_pool:
+                self.conn_pool.closeall()
+        else:
+            self.sqlite_pool.close_all()
+    
+    def pool_stats(self) -> Dict:
+        """Connection counters for /api/metrics"""
+        if self.use_postgres:
+            return {'backend': 'postgres', 'pooled': bool(self.conn_pool)}
+        return {'backend': 'sqlite', **self.sqlite_pool.stats()}
     
     # not used with postgresql but keeping in just in case
     def clear_locks(self):
@@ -172,6 +226,23 @@ class Database:
                         FOREIGN KEY (user_email) REFERENCES users (email) ON DELETE CASCADE
                     )
                 ''')
+                
+                # Create messages table - one row per message so a new turn is an append instead of rewriting the whole conversation
+                # the primary key doubles as the index for "last N messages" range scans
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS messages (
+                        conversation_id VARCHAR(255) NOT NULL,
+                        seq INTEGER NOT NULL,
+                        role VARCHAR(32) NOT NULL,
+                        content TEXT,
+                        attachments TEXT,
+                        timestamp VARCHAR(64),
+                        extra TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (conversation_id, seq),
+                        FOREIGN KEY (conversation_id) REFERENCES conversations (conversation_id) ON DELETE CASCADE
+                    )
+                ''')
             else:
                 # SQLite table creation (original)
                 cursor.execute('''
@@ -199,6 +270,21 @@ class Database:
                         FOREIGN KEY (user_email) REFERENCES users (email)
                     )
                 ''')
+                
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS messages (
+                        conversation_id TEXT NOT NULL,
+                        seq INTEGER NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT,
+                        attachments TEXT,
+                        timestamp TEXT,
+                        extra TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (conversation_id, seq),
+                        FOREIGN KEY (conversation_id) REFERENCES conversations (conversation_id)
+                    )
+                ''')
             
             # Add current_feedback column if it doesn't exist (for existing databases) - was when I was porting over
             if self.use_postgres:
@@ -250,26 +336,144 @@ class Database:
                 except sqlite3.OperationalError:
                     pass  # Column already exists
             
-            # Add indexes for performance so we can look up user conversatiosn easier
+            # Any message keys without a column of their own (role/content/attachments/timestamp) are kept as JSON
+            # in messages.extra, so nothing the old blob could hold gets dropped on the way through the table
+            if self.use_postgres:
+                cursor.execute('''
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='messages' AND column_name='extra'
+                ''')
+                if not cursor.fetchone():
+                    cursor.execute('ALTER TABLE messages ADD COLUMN extra TEXT')
+            else:
+                try:
+                    cursor.execute('ALTER TABLE messages ADD COLUMN extra TEXT')
+                except sqlite3.OperationalError:
+                    pass  # Column already exists
+            
+            # Version counters for conditional GETs (ETags). Every change to a user's conversations bumps their
+            # counter in conversation_versions, and the changed conversation's version column is set to the new
+            # value - so the list ETag is the user's counter, and a conversation's ETag is its version, which is
+            # never reused even if a conversation is deleted and made again under the same id.
+            if self.use_postgres:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_versions (
+                        user_email VARCHAR(255) PRIMARY KEY,
+                        version BIGINT NOT NULL DEFAULT 0,
+                        tombstones_pruned_version BIGINT NOT NULL DEFAULT 0
+                    )
+                ''')
+                cursor.execute('''
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='conversation_versions' AND column_name='tombstones_pruned_version'
+                ''')
+                if not cursor.fetchone():
+                    cursor.execute('ALTER TABLE conversation_versions ADD COLUMN tombstones_pruned_version BIGINT NOT NULL DEFAULT 0')
+                cursor.execute('''
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE table_name='conversations' AND column_name='version'
+                ''')
+                if not cursor.fetchone():
+                    cursor.execute('ALTER TABLE conversations ADD COLUMN version BIGINT DEFAULT 0')
+            else:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_versions (
+                        user_email TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL DEFAULT 0,
+                        tombstones_pruned_version INTEGER NOT NULL DEFAULT 0
+                    )
+                ''')
+                try:
+                    cursor.execute('ALTER TABLE conversation_versions ADD COLUMN tombstones_pruned_version INTEGER NOT NULL DEFAULT 0')
+                except sqlite3.OperationalError:
+                    pass  # Column already exists
+                try:
+                    cursor.execute('ALTER TABLE conversations ADD COLUMN version INTEGER DEFAULT 0')
+                except sqlite3.OperationalError:
+                    pass  # Column already exists
+            
+            # Deleted conversations leave a tombstone stamped with the version of the delete, so the sidebar's
+            # delta sync (get_conversation_changes) can tell clients what to drop. Recreating a conversation id
+            # removes its tombstone, so an id is never in both tables. Tombstones older than the retention window
+            # are pruned on the user's next delete, and conversation_versions.tombstones_pruned_version remembers
+            # the newest one pruned - a client whose version is older than that is told to reload.
             if self.use_postgres:
                 cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_conversations_user_email 
-                    ON conversations(user_email)
+                    CREATE TABLE IF NOT EXISTS conversation_tombstones (
+                        user_email VARCHAR(255) NOT NULL,
+                        conversation_id VARCHAR(255) NOT NULL,
+                        version BIGINT NOT NULL,
+                        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_email, conversation_id)
+                    )
+                ''')
+            else:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS conversation_tombstones (
+                        user_email TEXT NOT NULL,
+                        conversation_id TEXT NOT NULL,
+                        version INTEGER NOT NULL,
+                        deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_email, conversation_id)
+                    )
                 ''')
+            # "what changed since version N" is a range scan on both of these
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_version ON conversations(user_email, version)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_tombstones_user_version ON conversation_tombstones(user_email, version)')
+            
+            # Add indexes for performance so we can look up user conversatiosn easier
+            # The conversation list is paged by (ACTIVITY_AT, conversation_id) within a user, so one composite index
+            # serves the filter, the sort and the cursor - each page is a short index range scan instead of
+            # sorting the user's whole history. It also covers every lookup the old user_email index did.
+            # (idx_conversations_user_updated was the same index on plain updated_at, replaced by this one)
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_conversations_user_activity 
+                ON conversations(user_email, {ACTIVITY_AT} DESC, conversation_id DESC)
+            ''')
+            cursor.execute('DROP INDEX IF EXISTS idx_conversations_user_updated')
+            if self.use_postgres:
+                cursor.execute('DROP INDEX IF EXISTS idx_conversations_user_email')
                 cursor.execute('''
                     CREATE INDEX IF NOT EXISTS idx_conversations_updated_at 
                     ON conversations(updated_at DESC)
                 ''')
             else:
-                # SQLite: Check if index exists before creating
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_conversations_user_email'")
-                if not cursor.fetchone():
-                    cursor.execute('CREATE INDEX idx_conversations_user_email ON conversations(user_email)')
+                cursor.execute('DROP INDEX IF EXISTS idx_conversations_user_email')
                 
                 cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_conversations_updated_at'")
                 if not cursor.fetchone():
                     cursor.execute('CREATE INDEX idx_conversations_updated_at ON conversations(updated_at DESC)')
             
+            # Extracted PDF text lives here, keyed by the PDF's SHA-256, instead of in the message's attachment
+            # JSON - it can be hundreds of thousands of characters and the client never needs it
+            if self.use_postgres:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS pdf_texts (
+                        content_sha256 VARCHAR(64) PRIMARY KEY,
+                        text TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+            else:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS pdf_texts (
+                        content_sha256 TEXT PRIMARY KEY,
+                        text TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+            
+            # Move any conversations still stored as a JSON blob into the messages table
+            self._backfill_messages_table(cursor)
+            # and any PDF text still stored in attachments into pdf_texts
+            self._backfill_pdf_texts(cursor)
+            
+            # Now that migrations are done, record what the schema supports so queries don't have to ask
+            self._resolve_capabilities(cursor)
+            
             # all parts of database are initialized, good to go
             conn.commit()
         except Exception as e:
@@ -280,6 +484,332 @@ class Database:
             if conn:
                 self._close_connection(conn)
     
+    def _resolve_capabilities(self, cursor):
+        """Probe the conversations table once and rebuild the precomputed SQL to match"""
+        try:
+            if self.use_postgres:
+                cursor.execute('''
+                    SELECT column_name 
+                    FROM information_schema.columns 
+                    WHERE LOWER(table_name)=LOWER('conversations')
+                ''')
+                columns = {row[0] for row in cursor.fetchall()}
+            else:
+                cursor.execute("PRAGMA table_info(conversations)")
+                columns = {col[1] for col in cursor.fetchall()}
+        except Exception as e:
+            print(f"Warning: Could not probe conversations schema: {e}")
+            columns = set()
+        
+        self.capabilities = {'has_message_count': 'message_count' in columns, 'has_returning': self.use_postgres or self._sqlite_has_returning()}
+        self._build_queries()
+    
+    def refresh_schema(self):
+        """Re-probe the schema - call this after running a migration outside of init_database"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            self._resolve_capabilities(conn.cursor())
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    @staticmethod
+    def _sqlite_has_returning() -> bool:
+        """RETURNING needs SQLite 3.35+"""
+        return not USE_POSTGRES and sqlite3.sqlite_version_info >= (3, 35, 0)
+    
+    def _build_queries(self):
+        """Precompute the SQL for the hot paths from the current capabilities"""
+        p = self._placeholder()
+        has_message_count = self.capabilities['has_message_count']
+        
+        # this makes it reverse compatible because I added the message_count column later
+        if has_message_count:
+            insert_conversation = f"INSERT INTO conversations (conversation_id, user_email, messages, message_count) VALUES ({p}, {p}, {p}, 0)"
+            count_column = "message_count"
+        else:
+            insert_conversation = f"INSERT INTO conversations (conversation_id, user_email, messages) VALUES ({p}, {p}, {p})"
+            # Fallback: count rows in the messages table
+            count_column = "(SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.conversation_id)"
+        
+        # parameters line up with _update_params
+        set_count = f", message_count = {p}" if has_message_count else ""
+        update_conversation = f"UPDATE conversations SET current_quality_score = {p}, current_feedback = {p}, message_scores = {p}{{title}}{set_count}, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = {p}"
+        
+        # one conversation turn (see save_conversation_turn) - the title is only filled in once
+        returning = " RETURNING title" if self.capabilities.get('has_returning') else ""
+        save_turn = f"UPDATE conversations SET current_quality_score = {p}, current_feedback = {p}, message_scores = {p}, title = COALESCE(title, {p}){set_count}, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = {p} AND user_email = {p}{returning}"
+        
+        summaries = f"""
+            SELECT conversation_id, user_email, title, created_at, updated_at, {count_column}
+            FROM conversations 
+            WHERE user_email = {p} 
+            ORDER BY {ACTIVITY_AT} DESC, conversation_id DESC
+        """
+        
+        # rows changed after a version, oldest change first (idx_conversations_user_version)
+        summaries_since = f"""
+            SELECT conversation_id, user_email, title, created_at, updated_at, {count_column}
+            FROM conversations 
+            WHERE user_email = {p} AND version > {p}
+            ORDER BY version
+            LIMIT {p}
+        """
+        
+        # keyset pages, in idx_conversations_user_activity order (conversation_id breaks ties)
+        summaries_keyset = f"""
+            SELECT conversation_id, user_email, title, created_at, updated_at, {count_column}
+            FROM conversations 
+            WHERE user_email = {p}{{after}}
+            ORDER BY {ACTIVITY_AT} DESC, conversation_id DESC
+            LIMIT {p}
+        """
+        
+        self._queries = {
+            'insert_conversation': insert_conversation,
+            'update_conversation': update_conversation.format(title=""),
+            'update_conversation_with_title': update_conversation.format(title=f", title = {p}"),
+            'save_turn': save_turn,
+            'insert_conversation_if_missing': insert_conversation + " ON CONFLICT (conversation_id) DO NOTHING",
+            'insert_user_if_missing': f"INSERT INTO users (email) VALUES ({p}) ON CONFLICT (email) DO NOTHING",
+            'bump_version': f"INSERT INTO conversation_versions (user_email, version) VALUES ({p}, 1) ON CONFLICT (user_email) DO UPDATE SET version = conversation_versions.version + 1{' RETURNING version' if self.capabilities.get('has_returning') else ''}",
+            'set_conversation_version': f"UPDATE conversations SET version = {p} WHERE conversation_id = {p}",
+            'insert_tombstone': f"INSERT INTO conversation_tombstones (user_email, conversation_id, version) VALUES ({p}, {p}, {p}) ON CONFLICT (user_email, conversation_id) DO UPDATE SET version = excluded.version, deleted_at = CURRENT_TIMESTAMP",
+            'insert_pdf_text': f"INSERT INTO pdf_texts (content_sha256, text) VALUES ({p}, {p}) ON CONFLICT (content_sha256) DO NOTHING",
+            'clear_tombstone': f"DELETE FROM conversation_tombstones WHERE user_email = {p} AND conversation_id = {p}",
+            'conversation_summaries': summaries,
+            'conversation_summaries_page': summaries + f" LIMIT {p} OFFSET {p}",
+            'conversation_summaries_since': summaries_since,
+            'conversation_summaries_first': summaries_keyset.format(after=""),
+            'conversation_summaries_after': summaries_keyset.format(after=f" AND ({ACTIVITY_AT}, conversation_id) < ({p}, {p})"),
+        }
+    
+    def _update_params(self, quality_score, feedback, scores_json, title, message_count, conversation_id) -> tuple:
+        """Parameters in the order the precomputed update_conversation SQL expects"""
+        params = [quality_score, feedback, scores_json]
+        if title is not None:
+            params.append(title)
+        if self.capabilities['has_message_count']:
+            params.append(message_count)
+        params.append(conversation_id)
+        return tuple(params)
+    
+    def _backfill_messages_table(self, cursor):
+        """Copy messages out of the legacy conversations.messages JSON blob into the messages table"""
+        p = self._placeholder()
+        cursor.execute('''
+            SELECT c.conversation_id, c.messages
+            FROM conversations c
+            WHERE c.messages IS NOT NULL AND c.messages <> '[]' AND c.messages <> ''
+            AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = c.conversation_id)
+        ''')
+        legacy_rows = cursor.fetchall()
+        
+        for conversation_id, messages_json in legacy_rows:
+            try:
+                messages = json.loads(messages_json)
+            except (json.JSONDecodeError, TypeError):
+                print(f"Warning: Skipping backfill of conversation {conversation_id}, messages column is not valid JSON")
+                continue
+            if not isinstance(messages, list):
+                continue
+            
+            self._insert_messages(cursor, conversation_id, 0, messages)
+            # the rows are the source of truth now, so empty the blob
+            cursor.execute(
+                f"UPDATE conversations SET messages = {p}, message_count = {p} WHERE conversation_id = {p}",
+                (json.dumps([]), len(messages), conversation_id)
+            )
+        
+        if legacy_rows:
+            print(f"Backfilled {len(legacy_rows)} conversation(s) into the messages table")
+    
+    def _backfill_pdf_texts(self, cursor):
+        """Move extracted_text out of stored attachments into pdf_texts (messages keep content_sha256)"""
+        p = self._placeholder()
+        cursor.execute("SELECT conversation_id, seq, attachments FROM messages WHERE attachments LIKE '%extracted_text%'")
+        rows = cursor.fetchall()
+        moved = 0
+        
+        for conversation_id, seq, attachments_json in rows:
+            try:
+                attachments = json.loads(attachments_json)
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if not isinstance(attachments, list):
+                continue
+            for att in attachments:
+                if not isinstance(att, dict) or 'extracted_text' not in att:
+                    continue
+                text = att.pop('extracted_text')
+                digest = att.get('content_sha256')
+                if not digest:
+                    # every attachment that got text also got a hash, but don't lose the text if one didn't
+                    digest = att['content_sha256'] = hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+                if text is not None:
+                    cursor.execute(self._queries['insert_pdf_text'], (digest, text))
+                    moved += 1
+            cursor.execute(
+                f"UPDATE messages SET attachments = {p} WHERE conversation_id = {p} AND seq = {p}",
+                (json.dumps(attachments), conversation_id, seq)
+            )
+        
+        if moved:
+            print(f"Moved {moved} extracted PDF text(s) out of message attachments")
+    
+    def get_pdf_text(self, content_sha256: str) -> Optional[str]:
+        """Extracted text for a PDF by its SHA-256 (None if it was never stored)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            p = self._placeholder()
+            cursor.execute(f"SELECT text FROM pdf_texts WHERE content_sha256 = {p}", (content_sha256,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    def save_pdf_text(self, content_sha256: str, text: str) -> None:
+        """Store a PDF's extracted text (the same bytes always give the same text, so the first write wins)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(self._queries['insert_pdf_text'], (content_sha256, text))
+            conn.commit()
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    def _placeholder(self) -> str:
+        """Parameter placeholder for the current database driver"""
+        return "%s" if self.use_postgres else "?"
+    
+    @staticmethod
+    def _message_columns(msg: Dict) -> tuple:
+        """(role, content, attachments, timestamp, extra) for a message dict - extra is every other key, as JSON"""
+        attachments = msg.get('attachments')
+        extra = {key: value for key, value in msg.items() if key not in MESSAGE_COLUMNS}
+        return (
+            msg.get('role'),
+            msg.get('content'),
+            json.dumps(attachments) if attachments is not None else None,
+            msg.get('timestamp'),
+            json.dumps(extra) if extra else None
+        )
+    
+    @staticmethod
+    def _row_to_message(row) -> Dict:
+        """Rebuild a message dict from a (role, content, attachments, timestamp, extra) row"""
+        msg = {}
+        if row[4]:
+            try:
+                msg.update(json.loads(row[4]))
+            except (json.JSONDecodeError, TypeError):
+                pass
+        msg['role'] = row[0]
+        msg['content'] = row[1] if row[1] is not None else ''
+        if row[3] is not None:
+            msg['timestamp'] = row[3]
+        if row[2]:
+            try:
+                msg['attachments'] = json.loads(row[2])
+            except (json.JSONDecodeError, TypeError):
+                pass
+        return msg
+    
+    def _insert_messages(self, cursor, conversation_id: str, start_seq: int, messages: List[Dict]):
+        """Write messages at sequence numbers start_seq, start_seq + 1, ... (the backfill, nothing else writes then)"""
+        if not messages:
+            return
+        p = self._placeholder()
+        cursor.executemany(
+            f"INSERT INTO messages (conversation_id, seq, role, content, attachments, timestamp, extra) VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p})",
+            [(conversation_id, start_seq + i) + self._message_columns(msg) for i, msg in enumerate(messages)]
+        )
+    
+    def _append_messages(self, cursor, conversation_id: str, messages: List[Dict]) -> int:
+        """Append messages after whatever is stored, returns the new message count
+        
+        Each row takes its seq in the INSERT itself, so nothing can slip in between reading MAX(seq) and
+        writing the row. Two transactions can still pick the same seq on Postgres (neither sees the other's
+        uncommitted row) - the loser gets a primary key violation and _append_with_retry runs it again.
+        """
+        if messages:
+            p = self._placeholder()
+            cursor.executemany(
+                f"INSERT INTO messages (conversation_id, seq, role, content, attachments, timestamp, extra) "
+                f"SELECT {p}, COALESCE(MAX(seq), -1) + 1, {p}, {p}, {p}, {p}, {p} FROM messages WHERE conversation_id = {p}",
+                [(conversation_id,) + self._message_columns(msg) + (conversation_id,) for msg in messages]
+            )
+        return self._next_message_seq(cursor, conversation_id)
+    
+    @staticmethod
+    def _is_seq_conflict(error: Exception) -> bool:
+        if isinstance(error, sqlite3.IntegrityError):
+            return True
+        return USE_POSTGRES and isinstance(error, psycopg2.IntegrityError)
+    
+    def _append_with_retry(self, work):
+        """Run work(cursor) in its own transaction and commit, starting over if a concurrent append took the same seq"""
+        for attempt in range(MESSAGE_APPEND_ATTEMPTS):
+            conn = self._get_connection()
+            try:
+                result = work(conn.cursor())
+                conn.commit()
+                return result
+            except Exception as e:
+                conn.rollback()
+                if attempt + 1 < MESSAGE_APPEND_ATTEMPTS and self._is_seq_conflict(e):
+                    print(f"WARNING: Message seq conflict, retrying ({e})")
+                    continue
+                raise
+            finally:
+                self._close_connection(conn)
+    
+    def _next_message_seq(self, cursor, conversation_id: str) -> int:
+        """Sequence number the next appended message gets (= number of stored messages)"""
+        p = self._placeholder()
+        cursor.execute(f"SELECT MAX(seq) FROM messages WHERE conversation_id = {p}", (conversation_id,))
+        row = cursor.fetchone()
+        return row[0] + 1 if row and row[0] is not None else 0
+    
+    def _prune_tombstones(self, cursor, email: str) -> None:
+        """Drop the user's tombstones older than the retention window, remembering the newest version dropped"""
+        p = self._placeholder()
+        # same format CURRENT_TIMESTAMP fills deleted_at with (UTC)
+        cutoff = (datetime.utcnow() - timedelta(days=self.tombstone_retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            f"SELECT MAX(version) FROM conversation_tombstones WHERE user_email = {p} AND deleted_at < {p}",
+            (email, cutoff)
+        )
+        row = cursor.fetchone()
+        if not row or row[0] is None:
+            return
+        cursor.execute(
+            f"UPDATE conversation_versions SET tombstones_pruned_version = {p} WHERE user_email = {p} AND tombstones_pruned_version < {p}",
+            (row[0], email, row[0])
+        )
+        cursor.execute(f"DELETE FROM conversation_tombstones WHERE user_email = {p} AND deleted_at < {p}", (email, cutoff))
+    
+    def _bump_version(self, cursor, email: str, conversation_id: str = None) -> int:
+        """Advance the user's conversation version in the caller's transaction and stamp it on the conversation"""
+        cursor.execute(self._queries['bump_version'], (email,))
+        if not self.capabilities.get('has_returning'):
+            p = self._placeholder()
+            cursor.execute(f"SELECT version FROM conversation_versions WHERE user_email = {p}", (email,))
+        version = cursor.fetchone()[0]
+        if conversation_id is not None:
+            cursor.execute(self._queries['set_conversation_version'], (version, conversation_id))
+        return version
+    
     def create_user(self, email: str, first_name: str = None, last_name: str = None, google_id: str = None, profile_picture_url: str = None) -> bool:
         """Create a new user (doesn't do anything for existing users)"""
         conn = None
@@ -370,6 +900,45 @@ class Database:
             if conn:
                 self._close_connection(conn)
     
+    def update_user_logins(self, logins: Dict[str, str]) -> int:
+        """Write a batch of last_login timestamps (email -> 'YYYY-MM-DD HH:MM:SS' UTC) in one statement"""
+        if not logins:
+            return 0
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            p = self._placeholder()
+            rows = list(logins.items())
+            values = ", ".join(f"({p}, {p})" for _ in rows)
+            params = tuple(value for row in rows for value in row)
+            
+            if self.use_postgres:
+                cursor.execute(
+                    f"UPDATE users AS u SET last_login = v.last_login::timestamp FROM (VALUES {values}) AS v(email, last_login) WHERE u.email = v.email",
+                    params
+                )
+            elif sqlite3.sqlite_version_info >= (3, 33, 0):
+                # SQLite names the VALUES columns column1, column2...
+                cursor.execute(
+                    f"UPDATE users SET last_login = v.column2 FROM (VALUES {values}) AS v WHERE users.email = v.column1",
+                    params
+                )
+            else:
+                # no UPDATE ... FROM before SQLite 3.33, still one transaction though
+                cursor.executemany("UPDATE users SET last_login = ? WHERE email = ?", [(stamp, email) for email, stamp in rows])
+            
+            conn.commit()
+            return len(rows)
+        except Exception as e:
+            print(f"Error updating user last_login batch: {e}")
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
     # shouldn't get called a ton, but in case an update is needed
     def update_user_profile(self, email: str, first_name: str = None, last_name: str = None, google_id: str = None, profile_picture_url: str = None) -> bool:
         """Update user profile information"""
@@ -455,46 +1024,9 @@ class Database:
             cursor = conn.cursor()
             
             # Create conversation directly in conversations table
-            # Check if message_count column exists first
-            has_message_count = False
-            if self.use_postgres:
-                try:
-                    cursor.execute('''
-                        SELECT column_name 
-                        FROM information_schema.columns 
-                        WHERE LOWER(table_name)=LOWER('conversations') AND column_name='message_count'
-                    ''')
-                    has_message_count = cursor.fetchone() is not None
-                except:
-                    has_message_count = False
-            else:
-                cursor.execute("PRAGMA table_info(conversations)")
-                columns = cursor.fetchall()
-                has_message_count = any(col[1] == 'message_count' for col in columns)
-            
-            # this makes it reverse compatible because I added the message_count column later
-            if has_message_count:
-                if self.use_postgres:
-                    cursor.execute(
-                        "INSERT INTO conversations (conversation_id, user_email, messages, message_count) VALUES (%s, %s, %s, %s)",
-                        (conversation_id, email, json.dumps([]), 0)
-                    )
-                else:
-                    cursor.execute(
-                        "INSERT INTO conversations (conversation_id, user_email, messages, message_count) VALUES (?, ?, ?, ?)",
-                        (conversation_id, email, json.dumps([]), 0)
-                    )
-            else:
-                if self.use_postgres:
-                    cursor.execute(
-                        "INSERT INTO conversations (conversation_id, user_email, messages) VALUES (%s, %s, %s)",
-                        (conversation_id, email, json.dumps([]))
-                    )
-                else:
-                    cursor.execute(
-                        "INSERT INTO conversations (conversation_id, user_email, messages) VALUES (?, ?, ?)",
-                        (conversation_id, email, json.dumps([]))
-                    )
+            cursor.execute(self._queries['insert_conversation'], (conversation_id, email, json.dumps([])))
+            cursor.execute(self._queries['clear_tombstone'], (email, conversation_id))
+            self._bump_version(cursor, email, conversation_id)
             
             conn.commit()
             return True
@@ -507,75 +1039,193 @@ class Database:
             if conn:
                 self._close_connection(conn)
     
+    def _load_conversation(self, cursor, conversation_id: str, limit_messages: int = None) -> Optional[Dict]:
+        """Read a conversation and its messages with an open cursor (None if it doesn't exist)"""
+        p = self._placeholder()
+        cursor.execute(
+            f"SELECT user_email, current_quality_score, current_feedback, message_scores, title, version FROM conversations WHERE conversation_id = {p}",
+            (conversation_id,)
+        )
+        result = cursor.fetchone()
+        if not result:
+            return None
+        
+        # now is decoding the result that comes 
+        message_scores = []
+        if result[3]:
+            try:
+                message_scores = json.loads(result[3])
+            except json.JSONDecodeError:
+                message_scores = []
+        
+        # Deserialize feedback if it's a JSON string
+        feedback = None
+        if result[2]:
+            try:
+                feedback = json.loads(result[2])
+            except (json.JSONDecodeError, TypeError):
+                # If it's not JSON, treat it as a plain string (backward compatibility)
+                feedback = result[2]
+        
+        # If limit_messages is specified, only read the last N rows (range scan on the primary key)
+        if limit_messages is not None and limit_messages > 0:
+            total_message_count = self._next_message_seq(cursor, conversation_id)
+            start_seq = max(total_message_count - limit_messages, 0)
+        else:
+            total_message_count = None
+            start_seq = 0
+        
+        cursor.execute(
+            f"SELECT role, content, attachments, timestamp, extra FROM messages WHERE conversation_id = {p} AND seq >= {p} ORDER BY seq",
+            (conversation_id, start_seq)
+        )
+        messages = [self._row_to_message(row) for row in cursor.fetchall()]
+        if total_message_count is None:
+            total_message_count = len(messages)
+        
+        return {
+            'conversation_id': conversation_id,
+            'user_email': result[0],
+            'messages': messages,
+            'quality_score': result[1] if result[1] is not None else None,
+            'feedback': feedback,
+            'message_scores': message_scores,
+            'title': result[4],
+            'total_message_count': total_message_count,
+            'has_more_messages': limit_messages is not None and total_message_count > limit_messages,
+            'version': result[5] or 0
+        }
+    
     # this is to get the conversation data when a user clicks on a conversation 
     def get_conversation(self, conversation_id: str, limit_messages: int = None) -> Optional[Dict]:
         """Get conversation data, optionally limiting to last N messages"""
         conn = None
+        try:
+            conn = self._get_connection()
+            return self._load_conversation(conn.cursor(), conversation_id, limit_messages)
+        except Exception as e:
+            print(f"Error getting conversation: {e}")
+            import traceback
+            print(traceback.format_exc())
+            return None
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    def get_conversation_version(self, conversation_id: str, email: str) -> Optional[int]:
+        """The conversation's version if it exists and belongs to the user (a primary key lookup, no messages read)"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            p = self._placeholder()
+            cursor.execute(f"SELECT version FROM conversations WHERE conversation_id = {p} AND user_email = {p}", (conversation_id, email))
+            row = cursor.fetchone()
+            return (row[0] or 0) if row else None
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    def get_conversations_version(self, email: str) -> int:
+        """The user's conversation version - it changes whenever any of their conversations does"""
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            p = self._placeholder()
+            cursor.execute(f"SELECT version FROM conversation_versions WHERE user_email = {p}", (email,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    # send_message used to do get -> create user -> create -> get -> update -> get, each on its own connection.
+    # A turn is now two short transactions: begin (before the model calls) and save (after them)
+    def begin_conversation_turn(self, conversation_id: str, email: str) -> Optional[Dict]:
+        """Load a conversation for a new turn, creating it (and the user) in the same transaction if it's new.
+        
+        Returns None if the conversation belongs to a different user. The returned dict has 'created' set
+        when this call made the conversation.
+        """
+        conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            if self.use_postgres:
-                cursor.execute(
-                    "SELECT user_email, messages, current_quality_score, current_feedback, message_scores, title FROM conversations WHERE conversation_id = %s",
-                    (conversation_id,)
-                )
-            else:
-                cursor.execute(
-                    "SELECT user_email, messages, current_quality_score, current_feedback, message_scores, title FROM conversations WHERE conversation_id = ?",
-                    (conversation_id,)
-                )
-            
-            result = cursor.fetchone()
-            
-            # now is decoding the result that comes 
-            if result:
-                message_scores = []
-                if len(result) > 4 and result[4]:
-                    try:
-                        message_scores = json.loads(result[4])
-                    except json.JSONDecodeError:
-                        message_scores = []
-                
-                # Deserialize feedback if it's a JSON string
-                feedback = None
-                if len(result) > 3 and result[3]:
-                    try:
-                        feedback = json.loads(result[3])
-                    except (json.JSONDecodeError, TypeError):
-                        # If it's not JSON, treat it as a plain string (backward compatibility)
-                        feedback = result[3]
-                
-                # Parse messages
-                all_messages = json.loads(result[1])
-                
-                # If limit_messages is specified, return only the last N messages
-                if limit_messages is not None and limit_messages > 0 and len(all_messages) > limit_messages:
-                    messages = all_messages[-limit_messages:]
+            conversation = self._load_conversation(cursor, conversation_id)
+            created = False
+            if conversation is None:
+                # the conversation id comes from the frontend, so two tabs can race to create it - ON CONFLICT
+                # makes that a no-op for the loser, which then just reads what the winner made
+                cursor.execute(self._queries['insert_user_if_missing'], (email,))
+                cursor.execute(self._queries['insert_conversation_if_missing'], (conversation_id, email, json.dumps([])))
+                created = cursor.rowcount == 1
+                if created:
+                    cursor.execute(self._queries['clear_tombstone'], (email, conversation_id))
+                    conversation = {
+                        'conversation_id': conversation_id, 'user_email': email, 'messages': [], 'quality_score': None,
+                        'feedback': None, 'message_scores': [], 'title': None, 'total_message_count': 0, 'has_more_messages': False,
+                        'version': self._bump_version(cursor, email, conversation_id)
+                    }
                 else:
-                    messages = all_messages
-                
-                return {
-                    'conversation_id': conversation_id,
-                    'user_email': result[0],
-                    'messages': messages,
-                    'quality_score': result[2] if result[2] is not None else None,
-                    'feedback': feedback,
-                    'message_scores': message_scores,
-                    'title': result[5] if len(result) > 5 else None,
-                    'total_message_count': len(all_messages),
-                    'has_more_messages': limit_messages is not None and len(all_messages) > limit_messages
-                }
-            return None
+                    conversation = self._load_conversation(cursor, conversation_id)
+            conn.commit()
+            
+            if conversation is None or conversation['user_email'] != email:
+                return None
+            conversation['created'] = created
+            return conversation
         except Exception as e:
-            print(f"Error getting conversation: {e}")
+            if conn:
+                conn.rollback()
+            print(f"Error starting conversation turn: {e}")
             import traceback
             print(traceback.format_exc())
-            return None
+            raise
         finally:
             if conn:
                 self._close_connection(conn)
     
+    def save_conversation_turn(self, conversation_id: str, email: str, new_messages: List[Dict], quality_score: float,
+                               message_scores: List[float] = None, feedback: str = None, title: str = None) -> Optional[str]:
+        """Append a turn's messages and its score/feedback in one transaction, returns the conversation's title.
+        
+        The title is only set if the conversation doesn't have one yet, and the stored one comes back from the
+        same UPDATE (RETURNING) instead of a separate read.
+        """
+        try:
+            return self._append_with_retry(
+                lambda cursor: self._save_turn(cursor, conversation_id, email, new_messages, quality_score, message_scores, feedback, title)
+            )
+        except Exception as e:
+            print(f"Error saving conversation turn: {e}")
+            import traceback
+            print(traceback.format_exc())
+            raise
+    
+    def _save_turn(self, cursor, conversation_id, email, new_messages, quality_score, message_scores, feedback, title) -> Optional[str]:
+        message_count = self._append_messages(cursor, conversation_id, new_messages)
+        scores_json = json.dumps(message_scores) if message_scores else None
+        params = [quality_score, feedback, scores_json, title]
+        if self.capabilities['has_message_count']:
+            params.append(message_count)
+        params += [conversation_id, email]
+        cursor.execute(self._queries['save_turn'], tuple(params))
+        
+        if self.capabilities['has_returning']:
+            row = cursor.fetchone()
+        else:
+            # SQLite before 3.35 has no RETURNING
+            p = self._placeholder()
+            cursor.execute(f"SELECT title FROM conversations WHERE conversation_id = {p} AND user_email = {p}", (conversation_id, email))
+            row = cursor.fetchone()
+        if row is None:
+            # not this user's conversation - raising rolls back the messages appended above
+            raise ValueError(f"Conversation {conversation_id} not found for this user")
+        self._bump_version(cursor, email, conversation_id)
+        return row[0]
+    
     # newest functionality, allows you to delete a conversation
     def delete_conversation(self, conversation_id: str, user_email: str) -> bool:
         """Delete a conversation, verifying it belongs to the user"""
@@ -606,17 +1256,22 @@ class Database:
                 # Conversation belongs to a different user
                 return False
             
-            # Delete the conversation
+            # Delete the conversation (messages first, SQLite doesn't enforce the cascade)
             if self.use_postgres:
+                cursor.execute("DELETE FROM messages WHERE conversation_id = %s", (conversation_id,))
                 cursor.execute(
                     "DELETE FROM conversations WHERE conversation_id = %s AND user_email = %s",
                     (conversation_id, user_email)
                 )
             else:
+                cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
                 cursor.execute(
                     "DELETE FROM conversations WHERE conversation_id = ? AND user_email = ?",
                     (conversation_id, user_email)
                 )
+            version = self._bump_version(cursor, user_email)
+            cursor.execute(self._queries['insert_tombstone'], (user_email, conversation_id, version))
+            self._prune_tombstones(cursor, user_email)
             
             conn.commit()
             return True
@@ -632,200 +1287,166 @@ class Database:
                 self._close_connection(conn)
     
     def update_conversation(self, conversation_id: str, messages: List[Dict], quality_score: float, message_scores: List[float] = None, feedback: str = None, title: str = None):
-        """Update conversation with new messages, quality score, feedback, and optionally title"""
+        """Update conversation with new messages, quality score, feedback, and optionally title.
+        
+        messages is the full conversation, but only messages beyond what's already stored are written.
+        """
+        try:
+            self._append_with_retry(
+                lambda cursor: self._update_conversation(cursor, conversation_id, messages, quality_score, message_scores, feedback, title)
+            )
+        except Exception as e:
+            print(f"Error updating conversation: {e}")
+            import traceback
+            print(traceback.format_exc())
+    
+    def _update_conversation(self, cursor, conversation_id, messages, quality_score, message_scores, feedback, title) -> None:
+        # Messages are append-only: only the ones past what's already stored get inserted. A shorter list
+        # (say, one loaded with limit_messages) never deletes anything.
+        messages = messages or []
+        stored_count = self._next_message_seq(cursor, conversation_id)
+        message_count = self._append_messages(cursor, conversation_id, messages[stored_count:])
+        
+        # Handle message scores
+        scores_json = json.dumps(message_scores) if message_scores else None
+        
+        # Only update title if provided (the SQL itself already knows whether message_count exists)
+        if title is not None:
+            cursor.execute(
+                self._queries['update_conversation_with_title'],
+                self._update_params(quality_score, feedback, scores_json, title, message_count, conversation_id)
+            )
+        else:
+            cursor.execute(
+                self._queries['update_conversation'],
+                self._update_params(quality_score, feedback, scores_json, None, message_count, conversation_id)
+            )
+        
+        p = self._placeholder()
+        cursor.execute(f"SELECT user_email FROM conversations WHERE conversation_id = {p}", (conversation_id,))
+        owner = cursor.fetchone()
+        if owner:
+            self._bump_version(cursor, owner[0], conversation_id)
+    
+    # just queries for the summary information for the left panel and returns it as an array of dicts
+    def get_user_conversation_summaries(self, email: str, limit: int = None, offset: int = 0) -> List[Dict]:
+        """Get all conversation summaries for a user in a single query """
         conn = None
         try:
             conn = self._get_connection()
             cursor = conn.cursor()
             
-            # Check if message_count column exists (for backward compatibility)
-            has_message_count = False
-            if self.use_postgres:
-                try:
-                    cursor.execute('''
-                        SELECT column_name 
-                        FROM information_schema.columns 
-                        WHERE LOWER(table_name)=LOWER('conversations') AND column_name='message_count'
-                    ''')
-                    has_message_count = cursor.fetchone() is not None
-                except Exception as e:
-                    print(f"Warning: Could not check for message_count column: {e}")
-                    has_message_count = False
+            if limit is not None:
+                cursor.execute(self._queries['conversation_summaries_page'], (email, limit, offset))
             else:
-                cursor.execute("PRAGMA table_info(conversations)")
-                columns = cursor.fetchall()
-                has_message_count = any(col[1] == 'message_count' for col in columns)
-            
-            # Handle message scores
-            scores_json = json.dumps(message_scores) if message_scores else None
-            message_count = len(messages) if messages else 0
-            
-            # Build update query - only update title if provided, and message_count if column exists (which is why there are a bunch of if else here, backwards compatibility including with sqlite)
-            if title is not None:
-                if has_message_count:
-                    if self.use_postgres:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = %s, current_quality_score = %s, current_feedback = %s, message_scores = %s, title = %s, message_count = %s, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = %s",
-                            (json.dumps(messages), quality_score, feedback, scores_json, title, message_count, conversation_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = ?, current_quality_score = ?, current_feedback = ?, message_scores = ?, title = ?, message_count = ?, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = ?",
-                            (json.dumps(messages), quality_score, feedback, scores_json, title, message_count, conversation_id)
-                        )
-                else:
-                    if self.use_postgres:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = %s, current_quality_score = %s, current_feedback = %s, message_scores = %s, title = %s, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = %s",
-                            (json.dumps(messages), quality_score, feedback, scores_json, title, conversation_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = ?, current_quality_score = ?, current_feedback = ?, message_scores = ?, title = ?, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = ?",
-                            (json.dumps(messages), quality_score, feedback, scores_json, title, conversation_id)
-                        )
-            else:
-                if has_message_count:
-                    if self.use_postgres:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = %s, current_quality_score = %s, current_feedback = %s, message_scores = %s, message_count = %s, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = %s",
-                            (json.dumps(messages), quality_score, feedback, scores_json, message_count, conversation_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = ?, current_quality_score = ?, current_feedback = ?, message_scores = ?, message_count = ?, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = ?",
-                            (json.dumps(messages), quality_score, feedback, scores_json, message_count, conversation_id)
-                        )
-                else:
-                    if self.use_postgres:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = %s, current_quality_score = %s, current_feedback = %s, message_scores = %s, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = %s",
-                            (json.dumps(messages), quality_score, feedback, scores_json, conversation_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE conversations SET messages = ?, current_quality_score = ?, current_feedback = ?, message_scores = ?, updated_at = CURRENT_TIMESTAMP WHERE conversation_id = ?",
-                            (json.dumps(messages), quality_score, feedback, scores_json, conversation_id)
-                        )
+                cursor.execute(self._queries['conversation_summaries'], (email,))
             
-            conn.commit()
+            return self._summaries_from_rows(cursor.fetchall())
         except Exception as e:
-            print(f"Error updating conversation: {e}")
+            print(f"Error getting user conversation summaries: {e}")
             import traceback
             print(traceback.format_exc())
-            if conn:
-                conn.rollback()
+            return []
         finally:
             if conn:
                 self._close_connection(conn)
     
-    # just queries for the summary information for the left panel and returns it as an array of dicts
-    def get_user_conversation_summaries(self, email: str, limit: int = None, offset: int = 0) -> List[Dict]:
-        """Get all conversation summaries for a user in a single query """
+    def get_user_conversation_page(self, email: str, limit: int, cursor: Optional[str] = None) -> Dict:
+        """One page of conversation summaries, newest first - returns {'conversations': [...], 'next_cursor': str or None}
+        
+        Raises ValueError for a cursor that wasn't produced by this method.
+        """
+        after = decode_page_cursor(cursor) if cursor else None
         conn = None
         try:
             conn = self._get_connection()
-            cursor = conn.cursor()
+            db_cursor = conn.cursor()
             
-            # Check if message_count column exists (for backward compatibility)
-            has_message_count = False
-            if self.use_postgres:
-                try:
-                    cursor.execute('''
-                        SELECT column_name 
-                        FROM information_schema.columns 
-                        WHERE LOWER(table_name)=LOWER('conversations') AND column_name='message_count'
-                    ''')
-                    has_message_count = cursor.fetchone() is not None
-                except Exception as e:
-                    print(f"Warning: Could not check for message_count column: {e}")
-                    has_message_count = False
+            # one extra row tells us whether there is another page without counting anything
+            if after:
+                db_cursor.execute(self._queries['conversation_summaries_after'], (email, after[0], after[1], limit + 1))
             else:
-                cursor.execute("PRAGMA table_info(conversations)")
-                columns = cursor.fetchall()
-                has_message_count = any(col[1] == 'message_count' for col in columns)
+                db_cursor.execute(self._queries['conversation_summaries_first'], (email, limit + 1))
+            rows = db_cursor.fetchall()
             
-            # Build query based on whether message_count column exists
-            if self.use_postgres:
-                if has_message_count:
-                    base_query = """
-                        SELECT conversation_id, user_email, title, created_at, updated_at, message_count 
-                        FROM conversations 
-                        WHERE user_email = %s 
-                        ORDER BY updated_at DESC
-                    """
-                else:
-                    # Fallback: parse messages JSON to count
-                    base_query = """
-                        SELECT conversation_id, user_email, messages, title, created_at, updated_at 
-                        FROM conversations 
-                        WHERE user_email = %s 
-                        ORDER BY updated_at DESC
-                    """
-                if limit is not None:
-                    query = base_query + " LIMIT %s OFFSET %s"
-                    cursor.execute(query, (email, limit, offset))
-                else:
-                    cursor.execute(base_query, (email,))
-            else:
-                if has_message_count:
-                    base_query = """
-                        SELECT conversation_id, user_email, title, created_at, updated_at, message_count 
-                        FROM conversations 
-                        WHERE user_email = ? 
-                        ORDER BY updated_at DESC
-                    """
-                else:
-                    # Fallback: parse messages JSON to count
-                    base_query = """
-                        SELECT conversation_id, user_email, messages, title, created_at, updated_at 
-                        FROM conversations 
-                        WHERE user_email = ? 
-                        ORDER BY updated_at DESC
-                    """
-                if limit is not None:
-                    query = base_query + " LIMIT ? OFFSET ?"
-                    cursor.execute(query, (email, limit, offset))
-                else:
-                    cursor.execute(base_query, (email,))
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                activity_at = last[4] or last[3]
+                next_cursor = encode_page_cursor(str(activity_at) if activity_at else None, last[0])
             
-            results = cursor.fetchall()
-            conversations = []
+            return {'conversations': self._summaries_from_rows(rows), 'next_cursor': next_cursor}
+        finally:
+            if conn:
+                self._close_connection(conn)
+    
+    def get_conversation_changes(self, email: str, since_version: int, limit: int) -> Dict:
+        """What changed in the user's conversation list after since_version - the same summaries as
+        get_user_conversation_summaries, but only for conversations changed since then, plus the deleted ids.
+        
+        Returns {'version', 'upserted', 'deleted', 'reset'}. reset means the client should reload the list instead
+        (its version is from the future, older than the tombstones still kept, or more than limit conversations
+        were changed or deleted).
+        """
+        conn = None
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            p = self._placeholder()
             
-            for row in results:
-                try:
-                    if has_message_count:
-                        # Use message_count column
-                        conversations.append({
-                            'conversation_id': row[0],
-                            'user_email': row[1],
-                            'title': row[2],  # title
-                            'created_at': str(row[3]) if row[3] else None,
-                            'updated_at': str(row[4]) if row[4] else None,
-                            'message_count': row[5] if row[5] is not None else 0
-                        })
-                    else:
-                        # Parse messages JSON to count
-                        messages = json.loads(row[2]) if row[2] else []
-                        conversations.append({
-                            'conversation_id': row[0],
-                            'user_email': row[1],
-                            'title': row[3],  # title
-                            'created_at': str(row[4]) if row[4] else None,
-                            'updated_at': str(row[5]) if row[5] else None,
-                            'message_count': len(messages)
-                        })
-                except (IndexError, TypeError, json.JSONDecodeError) as e:
-                    print(f"Error parsing conversation {row[0] if row else 'unknown'}: {e}")
-                    # Skip malformed conversations
-                    continue
+            # read the version first - anything that changes after this shows up again next time, which is harmless
+            cursor.execute(f"SELECT version, tombstones_pruned_version FROM conversation_versions WHERE user_email = {p}", (email,))
+            row = cursor.fetchone()
+            version, pruned_version = (row[0], row[1] or 0) if row else (0, 0)
+            changes = {'version': version, 'upserted': [], 'deleted': [], 'reset': since_version > version}
+            if since_version >= version:
+                return changes
+            if since_version < pruned_version:
+                # a delete after since_version may already be pruned, so a delta could miss it
+                changes['reset'] = True
+                return changes
             
-            return conversations
-        except Exception as e:
-            print(f"Error getting user conversation summaries: {e}")
-            import traceback
-            print(traceback.format_exc())
-            return []
+            # one extra row tells us there are too many changes for a delta
+            cursor.execute(self._queries['conversation_summaries_since'], (email, since_version, limit + 1))
+            rows = cursor.fetchall()
+            if len(rows) > limit:
+                changes['reset'] = True
+                return changes
+            changes['upserted'] = self._summaries_from_rows(rows)
+            
+            cursor.execute(
+                f"SELECT conversation_id FROM conversation_tombstones WHERE user_email = {p} AND version > {p} ORDER BY version LIMIT {p}",
+                (email, since_version, limit + 1)
+            )
+            deleted = [row[0] for row in cursor.fetchall()]
+            if len(deleted) > limit:
+                changes['upserted'] = []
+                changes['reset'] = True
+                return changes
+            changes['deleted'] = deleted
+            return changes
         finally:
             if conn:
-                self._close_connection(conn)
\ No newline at end of file
+                self._close_connection(conn)
+    
+    def _summaries_from_rows(self, rows) -> List[Dict]:
+        """Summary dicts for the left panel from conversation_summaries rows"""
+        conversations = []
+        
+        for row in rows:
+            try:
+                conversations.append({
+                    'conversation_id': row[0],
+                    'user_email': row[1],
+                    'title': row[2],  # title
+                    'created_at': str(row[3]) if row[3] else None,
+                    'updated_at': str(row[4]) if row[4] else None,
+                    'message_count': row[5] if row[5] is not None else 0
+                })
+            except (IndexError, TypeError) as e:
+                print(f"Error parsing conversation {row[0] if row else 'unknown'}: {e}")
+                # Skip malformed conversations
+                continue
+        
+        return conversations
\ No newline at end of file
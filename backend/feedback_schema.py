@@ -0,0 +1,154 @@
+# The feedback model's reply, constrained and validated. The call asks for structured output against
+# FEEDBACK_JSON_SCHEMA so the model can't wrap the JSON in prose or drop keys, and FeedbackResult checks
+# the values (score range, label, exactly 3 tips) in one place instead of patching up a dict afterwards.
+# FeedbackUsage keeps per-call token counts and the parse failure rate so the cost of the call is visible.
+import json
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+QUALITY_LABELS = ('Poor', 'Fair', 'Good', 'Excellent')
+
+GENERIC_TIPS = [
+    'Be more specific in your requests',
+    'Provide context from previous messages',
+    'Ask clear, focused questions'
+]
+
+FEEDBACK_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number"},
+        "quality_label": {"type": "string", "enum": list(QUALITY_LABELS)},
+        "improvement_tips": {"type": "array", "items": {"type": "string"}},
+        "example_improved_prompt": {"type": "string"}
+    },
+    "required": ["score", "quality_label", "improvement_tips", "example_improved_prompt"],
+    "additionalProperties": False
+}
+
+# response_format for the feedback call - strict mode means the reply always parses against the schema
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "prompt_feedback", "strict": True, "schema": FEEDBACK_JSON_SCHEMA}
+}
+
+# for models without structured output support, still guarantees a single JSON object
+JSON_OBJECT_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+class FeedbackParseError(ValueError):
+    """The feedback model's reply wasn't usable feedback"""
+
+
+def label_for_score(score: float) -> str:
+    """Quality label for a score, same bands the feedback prompt gives the model"""
+    if score <= 4:
+        return 'Poor'
+    elif score <= 6:
+        return 'Fair'
+    elif score <= 8:
+        return 'Good'
+    return 'Excellent'
+
+
+@dataclass(frozen=True)
+class FeedbackResult:
+    score: float
+    quality_label: str
+    improvement_tips: List[str] = field(default_factory=list)
+    example_improved_prompt: str = 'No example available'
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'FeedbackResult':
+        """Validate the model's fields. The score has to be there, everything else has a sane fallback"""
+        if not isinstance(data, dict):
+            raise FeedbackParseError("Feedback is not a JSON object")
+        try:
+            score = float(data['score'])
+        except (KeyError, TypeError, ValueError):
+            raise FeedbackParseError(f"Feedback has no numeric score: {data.get('score')!r}")
+        if score != score:
+            raise FeedbackParseError("Feedback score is NaN")
+        score = round(min(max(score, 1.0), 10.0), 1)
+
+        label = data.get('quality_label')
+        if label not in QUALITY_LABELS:
+            label = label_for_score(score)
+
+        tips = data.get('improvement_tips')
+        tips = [tip.strip() for tip in tips if isinstance(tip, str) and tip.strip()] if isinstance(tips, list) else []
+        # exactly 3 tips, padded with generic ones if the model came up short
+        tips = (tips + GENERIC_TIPS[len(tips):])[:3]
+
+        example = data.get('example_improved_prompt')
+        if not isinstance(example, str) or not example.strip():
+            example = 'No example available'
+
+        return cls(score=score, quality_label=label, improvement_tips=tips, example_improved_prompt=example)
+
+    @classmethod
+    def from_json(cls, text: Optional[str]) -> 'FeedbackResult':
+        """Parse the feedback model's reply (a single JSON object, guaranteed by the response format)"""
+        if not text:
+            raise FeedbackParseError("Empty feedback response")
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise FeedbackParseError(f"Feedback is not valid JSON: {e}")
+        return cls.from_dict(data)
+
+    def to_feedback(self) -> Dict:
+        """The feedback object the frontend displays (the score travels separately)"""
+        feedback = asdict(self)
+        del feedback['score']
+        return feedback
+
+
+class FeedbackUsage:
+    """Token counts, latency and parse failures of the feedback model calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.parse_failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.seconds = 0.0
+        self.last_call = None
+        self._lock = threading.Lock()
+
+    def record(self, response, seconds: float, parsed: bool) -> None:
+        """Record one feedback call from the response's usage block"""
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0)
+        completion_tokens = getattr(usage, 'completion_tokens', 0)
+        prompt_tokens = prompt_tokens if isinstance(prompt_tokens, int) else 0
+        completion_tokens = completion_tokens if isinstance(completion_tokens, int) else 0
+        with self._lock:
+            self.calls += 1
+            self.parse_failures += 0 if parsed else 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.seconds += seconds
+            self.last_call = {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'seconds': round(seconds, 3),
+                'parsed': parsed,
+            }
+
+    def stats(self) -> Dict:
+        """Averages per call plus the parse failure rate"""
+        with self._lock:
+            calls = self.calls
+            return {
+                'calls': calls,
+                'parse_failures': self.parse_failures,
+                'parse_failure_rate': round(self.parse_failures / calls, 4) if calls else 0.0,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'avg_prompt_tokens': round(self.prompt_tokens / calls, 1) if calls else 0.0,
+                'avg_completion_tokens': round(self.completion_tokens / calls, 1) if calls else 0.0,
+                'avg_seconds': round(self.seconds / calls, 3) if calls else 0.0,
+                'last_call': self.last_call,
+            }
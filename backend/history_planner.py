@@ -0,0 +1,132 @@
+# Keeps the history we send to the models inside a token budget. Long conversations used to go out in
+# full on every call (twice for feedback), so request size grew with every turn. The newest messages are
+# kept as they are and everything older is collapsed into a short extractive summary, one cached line
+# per message so the summary rolls forward cheaply as the conversation grows.
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# rough OpenAI numbers - about 4 characters per token, a few tokens of framing per message,
+# and a flat cost per image (what a high detail 512px tile costs)
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 765
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def estimate_tokens(content) -> int:
+    """Offline token estimate for message content (a string or a vision content array)"""
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'image_url':
+                total += IMAGE_TOKENS
+            elif isinstance(part, dict):
+                total += estimate_tokens(part.get('text', ''))
+        return total
+    text = str(content) if content else ''
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(msg: Dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(msg.get('content'))
+
+
+def _content_text(content) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get('text', '') for part in content if isinstance(part, dict) and part.get('type') == 'text')
+    return str(content) if content else ''
+
+
+class HistoryPlanner:
+    """Splits a message list into a summary of older messages plus the newest messages that fit the budget"""
+
+    def __init__(self, summary_budget_tokens: int, line_chars: int = 200, max_cached_lines: int = 4096):
+        self.summary_budget_tokens = summary_budget_tokens
+        self.line_chars = line_chars
+        self.max_cached_lines = max_cached_lines
+        self._lines = OrderedDict()  # hash of role + content -> summary line
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.trimmed_calls = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.line_hits = 0
+        self.line_misses = 0
+
+    def _summary_line(self, msg: Dict) -> str:
+        role = msg.get('role', 'user')
+        text = _content_text(msg.get('content'))
+        key = hashlib.sha256(f"{role}\0{text}".encode('utf-8')).hexdigest()
+        with self._lock:
+            line = self._lines.get(key)
+            if line is not None:
+                self._lines.move_to_end(key)
+                self.line_hits += 1
+                return line
+        self.line_misses += 1
+        # extractive: the first sentence is usually the ask (or the gist of the answer)
+        text = " ".join(text.split())
+        first = _SENTENCE_END.split(text, maxsplit=1)[0] if text else "(no text)"
+        if len(first) > self.line_chars:
+            first = first[:self.line_chars].rstrip() + "..."
+        line = f"- {'User' if role == 'user' else 'Assistant'}: {first}"
+        with self._lock:
+            self._lines[key] = line
+            while len(self._lines) > self.max_cached_lines:
+                self._lines.popitem(last=False)
+        return line
+
+    def summarize(self, messages: List[Dict]) -> str:
+        """One line per message, dropping the oldest lines if the summary goes over its own budget"""
+        lines = [self._summary_line(msg) for msg in messages]
+        used = 0
+        kept = []
+        for line in reversed(lines):
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.summary_budget_tokens:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+        omitted = len(lines) - len(kept)
+        if omitted:
+            kept.insert(0, f"({omitted} earlier message(s) not shown)")
+        return "\n".join(kept)
+
+    def plan(self, messages: List[Dict], budget_tokens: int) -> Tuple[Optional[str], List[Dict]]:
+        """Return (summary of older messages or None, newest messages to send verbatim)"""
+        costs = [estimate_message_tokens(msg) for msg in messages]
+        total = sum(costs)
+        self.calls += 1
+        self.tokens_in += total
+        if total <= budget_tokens or len(messages) <= 1:
+            self.tokens_out += total
+            return None, messages
+        
+        # the latest message always goes in verbatim, older ones while they fit next to the summary
+        available = budget_tokens - self.summary_budget_tokens
+        start = len(messages) - 1
+        used = costs[start]
+        while start > 0 and used + costs[start - 1] <= available:
+            start -= 1
+            used += costs[start]
+        summary = self.summarize(messages[:start])
+        self.trimmed_calls += 1
+        self.tokens_out += used + estimate_tokens(summary)
+        return summary, messages[start:]
+
+    def stats(self) -> Dict:
+        """Counters for monitoring how much history is being trimmed"""
+        lookups = self.line_hits + self.line_misses
+        return {
+            'calls': self.calls,
+            'trimmed_calls': self.trimmed_calls,
+            'estimated_tokens_in': self.tokens_in,
+            'estimated_tokens_sent': self.tokens_out,
+            'summary_line_hit_rate': round(self.line_hits / lookups, 4) if lookups else 0.0,
+            'cached_lines': len(self._lines),
+        }
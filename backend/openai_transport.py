@@ -0,0 +1,259 @@
+# How AIService talks to OpenAI: explicit httpx clients (pooled keep-alive connections, HTTP/2 when the
+# h2 package is installed), a timeout per kind of call, retries with exponential backoff that honor
+# Retry-After, and a circuit breaker so a degraded upstream fails fast instead of tying up every worker.
+# Calls the app waits on with a deadline (feedback, title) get that deadline as a budget for all of their
+# attempts - each attempt can use whatever is left of it, and a retry only happens if there's enough left.
+# The SDK's own retries are turned off (max_retries=0) so every attempt goes through here and gets counted.
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Optional
+import httpx
+import openai
+from config import Config
+
+# errors worth another attempt - rate limits, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+# the subset that means the upstream itself is in trouble (429 is us, not them)
+UPSTREAM_FAILURES = (openai.APIConnectionError, openai.InternalServerError)
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=Config.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.OPENAI_KEEPALIVE_EXPIRY_SECONDS
+    )
+
+
+def build_http_client() -> httpx.Client:
+    """httpx client for openai.OpenAI(http_client=...)"""
+    return httpx.Client(limits=_limits(), http2=http2_available(), timeout=httpx.Timeout(Config.CHAT_TIMEOUT_SECONDS, connect=Config.OPENAI_CONNECT_TIMEOUT_SECONDS))
+
+
+def build_async_http_client() -> httpx.AsyncClient:
+    """httpx client for openai.AsyncOpenAI(http_client=...)"""
+    return httpx.AsyncClient(limits=_limits(), http2=http2_available(), timeout=httpx.Timeout(Config.CHAT_TIMEOUT_SECONDS, connect=Config.OPENAI_CONNECT_TIMEOUT_SECONDS))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling OpenAI while the breaker is open"""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold upstream failures in a row, lets one trial call through after reset_seconds"""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError("OpenAI connection is failing right now (circuit open), please try again in a moment")
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                # only one trial call at a time while we find out if the upstream recovered
+                if self._trial_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError("OpenAI connection is recovering (circuit half open), please try again in a moment")
+                self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._trial_in_flight = False
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def record_neutral(self) -> None:
+        """The call failed for a reason that says nothing about the upstream (bad request, rate limit)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+        }
+
+
+class OpenAITransport:
+    """Wraps chat.completions.create with per call type timeouts, retries and the circuit breaker
+    
+    timeouts are per attempt. A call type in deadlines also has its whole call (every attempt and the
+    backoff between them) fit in that many seconds - an attempt gets what's left, capped by its timeout,
+    and there's no retry unless at least min_attempt_seconds would be left after the backoff.
+    """
+
+    def __init__(self, timeouts: Dict[str, float], max_retries: int = 2, backoff_base: float = 0.5,
+                 max_backoff: float = 8.0, breaker: Optional[CircuitBreaker] = None,
+                 deadlines: Optional[Dict[str, float]] = None, min_attempt_seconds: float = 1.0):
+        self.timeouts = timeouts
+        self.deadlines = deadlines or {}
+        self.min_attempt_seconds = min_attempt_seconds
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _record(self, call_type: str, key: str, amount: float = 1) -> None:
+        with self._lock:
+            metrics = self._metrics.setdefault(call_type, {'calls': 0, 'retries': 0, 'failures': 0, 'timeouts': 0, 'total_seconds': 0.0})
+            metrics[key] += amount
+
+    def _timeout(self, call_type: str, deadline: Optional[float] = None):
+        # for streams the read timeout is what bounds time to first token (and the gaps between chunks)
+        seconds = self.timeouts[call_type]
+        if deadline is not None:
+            seconds = min(seconds, max(deadline - time.monotonic(), 0))
+        return httpx.Timeout(seconds, connect=min(seconds, Config.OPENAI_CONNECT_TIMEOUT_SECONDS))
+
+    def _deadline(self, call_type: str, started: float) -> Optional[float]:
+        budget = self.deadlines.get(call_type)
+        return started + budget if budget is not None else None
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, 'response', None)
+        headers = response.headers if response is not None else {}
+        try:
+            if headers.get('retry-after-ms'):
+                return min(float(headers['retry-after-ms']) / 1000, self.max_backoff)
+            if headers.get('retry-after'):
+                return min(float(headers['retry-after']), self.max_backoff)
+        except ValueError:
+            pass
+        delay = min(self.max_backoff, self.backoff_base * (2 ** attempt))
+        # jitter so retries from different workers spread out
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _settle(self, call_type: str, error: Exception, attempt: int, deadline: Optional[float] = None) -> Optional[float]:
+        """Record a failed attempt, returns how long to wait before retrying (None means give up)"""
+        if isinstance(error, openai.APITimeoutError):
+            self._record(call_type, 'timeouts')
+        if isinstance(error, UPSTREAM_FAILURES):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_neutral()
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= self.max_retries or self.breaker.state == 'open':
+            self._record(call_type, 'failures')
+            return None
+        delay = self._backoff(attempt, error)
+        if deadline is not None and time.monotonic() + delay + self.min_attempt_seconds > deadline:
+            # not enough time left for another attempt to have a real chance of finishing
+            self._record(call_type, 'failures')
+            return None
+        self._record(call_type, 'retries')
+        return delay
+
+    def create(self, client, call_type: str, **params):
+        """client.chat.completions.create(**params) with the policy for call_type ('feedback', 'title', 'chat', 'stream')"""
+        self._record(call_type, 'calls')
+        started = time.monotonic()
+        deadline = self._deadline(call_type, started)
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.breaker.before_call()
+                try:
+                    result = client.chat.completions.create(timeout=self._timeout(call_type, deadline), **params)
+                except Exception as e:
+                    delay = self._settle(call_type, e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    print(f"WARNING: OpenAI {call_type} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                return result
+        finally:
+            self._record(call_type, 'total_seconds', time.monotonic() - started)
+
+    async def acreate(self, client, call_type: str, **params):
+        """Async version of create() for AsyncOpenAI"""
+        self._record(call_type, 'calls')
+        started = time.monotonic()
+        deadline = self._deadline(call_type, started)
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.breaker.before_call()
+                try:
+                    result = await client.chat.completions.create(timeout=self._timeout(call_type, deadline), **params)
+                except Exception as e:
+                    delay = self._settle(call_type, e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                return result
+        finally:
+            self._record(call_type, 'total_seconds', time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        """Per call type counters plus the breaker state"""
+        with self._lock:
+            calls = {
+                call_type: {
+                    'calls': int(m['calls']),
+                    'retries': int(m['retries']),
+                    'failures': int(m['failures']),
+                    'timeouts': int(m['timeouts']),
+                    'avg_seconds': round(m['total_seconds'] / m['calls'], 3) if m['calls'] else 0.0,
+                }
+                for call_type, m in self._metrics.items()
+            }
+        return {'calls': calls, 'circuit_breaker': self.breaker.stats(), 'http2': http2_available()}
+
+
+def create_openai_transport() -> OpenAITransport:
+    """Build the transport from the OPENAI_* / *_TIMEOUT_SECONDS settings"""
+    return OpenAITransport(
+        timeouts={
+            'feedback': Config.FEEDBACK_TIMEOUT_SECONDS,
+            'title': Config.TITLE_TIMEOUT_SECONDS,
+            'chat': Config.CHAT_TIMEOUT_SECONDS,
+            'stream': Config.STREAM_FIRST_TOKEN_TIMEOUT_SECONDS,
+        },
+        max_retries=Config.OPENAI_MAX_RETRIES,
+        # send_message waits this long for feedback and the title, so that's all the retries get too
+        deadlines={
+            'feedback': Config.FEEDBACK_TIMEOUT_SECONDS,
+            'title': Config.TITLE_TIMEOUT_SECONDS,
+        },
+        min_attempt_seconds=Config.OPENAI_MIN_RETRY_SECONDS,
+        breaker=CircuitBreaker(
+            failure_threshold=Config.OPENAI_BREAKER_FAILURE_THRESHOLD,
+            reset_seconds=Config.OPENAI_BREAKER_RESET_SECONDS
+        )
+    )
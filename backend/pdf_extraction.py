@@ -0,0 +1,230 @@
+# PDF text extraction off the request thread. PyPDF2 is pure Python and CPU bound, so a big PDF parsed
+# inline holds the gunicorn worker (and the GIL) for seconds. Documents go to a small process pool instead,
+# each with a wall clock budget, a page limit and a character budget. When a limit is hit we keep the
+# pages extracted so far and say where we stopped. The pool gets a document a batch of pages at a time, so
+# even a worker stuck on one page only loses that batch - the pages before it still come back. A request can
+# also pass a cancel event (set when its client disconnects), which stops the document at the next batch.
+import base64
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Dict, List, Optional
+from config import Config
+
+FAILURE_PREFIX = "[PDF content could not be extracted"
+
+# how much longer than its own time budget a document gets before we give up on the worker process
+HARD_TIMEOUT_GRACE_SECONDS = 2.0
+# pages per pool task - each task parses the document again, so not too small either
+PAGES_PER_TASK = 10
+# how often a wait on the pool looks at the cancel event
+CANCEL_POLL_SECONDS = 0.1
+
+
+def extract_pdf_pages(pdf_bytes: bytes, max_pages: int, max_chars: int, time_budget: float, first_page: int = 0) -> Dict:
+    """Extract text page by page until the document ends or a limit is hit (runs in the pool processes)
+    
+    Starts at first_page and stops before page max_pages, both counted from the start of the document.
+    """
+    from PyPDF2 import PdfReader
+    
+    started = time.monotonic()
+    pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+    total_pages = len(pdf_reader.pages)
+    text_content = []
+    chars = 0
+    pages_extracted = first_page
+    stopped = None
+    
+    for page_num in range(first_page, total_pages):
+        page = pdf_reader.pages[page_num]
+        if page_num >= max_pages:
+            stopped = 'page limit'
+            break
+        # checked between pages - a single page can't be interrupted, the hard timeout covers that
+        if time.monotonic() - started > time_budget:
+            stopped = 'time limit'
+            break
+        page_text = page.extract_text() or ''
+        pages_extracted = page_num + 1
+        if page_text.strip():
+            part = f"--- Page {page_num + 1} ---\n{page_text}"
+            if chars + len(part) > max_chars:
+                text_content.append(part[:max_chars - chars])
+                stopped = 'character limit'
+                break
+            text_content.append(part)
+            chars += len(part)
+    
+    return {
+        'text': "\n\n".join(text_content),
+        'pages_extracted': pages_extracted,
+        'total_pages': total_pages,
+        'stopped': stopped,
+    }
+
+
+def format_extraction(result: Dict) -> str:
+    """Extracted text plus a note for the model when only part of the document was read"""
+    text = result['text']
+    if result.get('stopped') and not result['pages_extracted']:
+        note = f"[No pages were extracted ({result['stopped']})]"
+        text = f"{text}\n\n{note}" if text else note
+    elif result.get('stopped'):
+        note = f"[Only pages 1-{result['pages_extracted']} of {result['total_pages']} were extracted ({result['stopped']})]"
+        text = f"{text}\n\n{note}" if text else note
+    return text
+
+
+def is_cacheable(text: str) -> bool:
+    """Failures and time-limited or cancelled partial text can come out differently next time, everything else is deterministic"""
+    return not text.startswith(FAILURE_PREFIX) and "(time limit)]" not in text and "(cancelled)]" not in text
+
+
+class PDFExtractor:
+    """Runs extract_pdf_pages in a bounded process pool (or inline when max_workers is 0)"""
+
+    def __init__(self, max_workers: int, timeout_seconds: float, max_pages: int, max_chars: int):
+        self.max_workers = max_workers
+        self.timeout_seconds = timeout_seconds
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self._pool = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.truncated = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn rather than fork, forking a process that already has threads running can deadlock
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _recycle_pool(self) -> None:
+        """Throw the pool away after a worker got stuck on a page (the next document starts a fresh one)
+        
+        A running task can't be killed through the executor, so the stuck worker finishes its page and exits
+        on its own - it just doesn't hold up anything that comes after it.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def extract(self, base64_data: str, cancel_event: Optional[threading.Event] = None) -> Dict:
+        """Extract text from a base64 PDF within the configured limits
+        
+        If cancel_event gets set (the client went away) the pages extracted so far come back with stopped='cancelled'.
+        """
+        started = time.monotonic()
+        try:
+            pdf_bytes = base64.b64decode(base64_data)
+            if self.max_workers <= 0:
+                result = extract_pdf_pages(pdf_bytes, self.max_pages, self.max_chars, self.timeout_seconds)
+            else:
+                result = self._extract_in_pool(pdf_bytes, cancel_event)
+        except TimeoutError:
+            raise
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.total_seconds += time.monotonic() - started
+        self.completed += 1
+        if result.get('stopped') == 'cancelled':
+            self.cancelled += 1
+        elif result.get('stopped'):
+            self.truncated += 1
+        return result
+
+    def _submit(self, pdf_bytes: bytes, first_page: int, max_pages: int, max_chars: int, time_budget: float) -> Future:
+        return self._get_pool().submit(extract_pdf_pages, pdf_bytes, max_pages, max_chars, time_budget, first_page)
+
+    def _wait(self, future: Future, hard_deadline: float, cancel_event: Optional[threading.Event]) -> Optional[Dict]:
+        """The batch's result, or None if cancel_event got set first (raises FuturesTimeoutError past the hard deadline)"""
+        if cancel_event is None:
+            return future.result(timeout=max(hard_deadline - time.monotonic(), 0))
+        while True:
+            try:
+                return future.result(timeout=min(max(hard_deadline - time.monotonic(), 0), CANCEL_POLL_SECONDS))
+            except FuturesTimeoutError:
+                if cancel_event.is_set():
+                    # drops it if it hasn't started, a batch that's already running finishes its pages and is ignored
+                    future.cancel()
+                    return None
+                if time.monotonic() >= hard_deadline:
+                    raise
+
+    def _extract_in_pool(self, pdf_bytes: bytes, cancel_event: Optional[threading.Event] = None) -> Dict:
+        started = time.monotonic()
+        hard_deadline = started + self.timeout_seconds + HARD_TIMEOUT_GRACE_SECONDS
+        texts: List[str] = []
+        chars = 0
+        first_page = 0
+        total_pages = None
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return self._merge(texts, first_page, total_pages, 'cancelled')
+            time_left = self.timeout_seconds - (time.monotonic() - started)
+            if total_pages is not None and time_left <= 0:
+                return self._merge(texts, first_page, total_pages, 'time limit')
+            batch_end = min(first_page + PAGES_PER_TASK, self.max_pages)
+            future = self._submit(pdf_bytes, first_page, batch_end, self.max_chars - chars, time_left)
+            try:
+                result = self._wait(future, hard_deadline, cancel_event)
+            except FuturesTimeoutError:
+                self.timeouts += 1
+                self._recycle_pool()
+                if total_pages is None:
+                    raise TimeoutError(f"no result after {self.timeout_seconds + HARD_TIMEOUT_GRACE_SECONDS:.0f}s")
+                # stuck on a page in this batch, keep what the earlier batches got
+                return self._merge(texts, first_page, total_pages, 'time limit')
+            if result is None:
+                return self._merge(texts, first_page, total_pages, 'cancelled')
+            total_pages = result['total_pages']
+            if result['text']:
+                texts.append(result['text'])
+                chars += len(result['text'])
+            first_page = result['pages_extracted']
+            # only the batch boundary stopped it, the next batch carries on from there
+            if result['stopped'] == 'page limit' and batch_end < self.max_pages:
+                continue
+            return self._merge(texts, first_page, total_pages, result['stopped'])
+
+    @staticmethod
+    def _merge(texts: List[str], pages_extracted: int, total_pages: Optional[int], stopped) -> Dict:
+        return {
+            'text': "\n\n".join(texts),
+            'pages_extracted': pages_extracted,
+            'total_pages': total_pages,
+            'stopped': stopped,
+        }
+
+    def stats(self) -> Dict:
+        """Counters for monitoring extraction"""
+        return {
+            'workers': self.max_workers,
+            'completed': self.completed,
+            'truncated': self.truncated,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+            'failures': self.failures,
+            'avg_seconds': round(self.total_seconds / self.completed, 3) if self.completed else 0.0,
+        }
+
+
+def create_pdf_extractor() -> PDFExtractor:
+    """Build the extractor from the PDF_EXTRACTION_* settings"""
+    return PDFExtractor(
+        max_workers=Config.PDF_EXTRACTION_WORKERS,
+        timeout_seconds=Config.PDF_EXTRACTION_TIMEOUT_SECONDS,
+        max_pages=Config.PDF_EXTRACTION_MAX_PAGES,
+        max_chars=Config.PDF_EXTRACTION_MAX_CHARS
+    )
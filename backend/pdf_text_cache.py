@@ -0,0 +1,137 @@
+# Extracted PDF text keyed by the SHA-256 of the PDF bytes. Parsing with PyPDF2 is slow and the same
+# PDF gets formatted again on every model call, so the text is kept in a small in-memory LRU and in a
+# directory on disk (shared by the gunicorn workers and kept across restarts). The app also plugs in the
+# database's pdf_texts table as the last tier - that's where the text of PDFs from earlier turns lives, since
+# stored messages only keep the hash (the text never goes back to the client).
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from config import Config
+
+
+def pdf_content_hash(base64_data: str) -> str:
+    """SHA-256 of the decoded PDF bytes (falls back to hashing the raw string if it isn't valid base64)"""
+    try:
+        content = base64.b64decode(base64_data, validate=True)
+    except (binascii.Error, ValueError, TypeError):
+        content = (base64_data or '').encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class PDFTextCache:
+    """Two tier cache: in-memory LRU (bounded by characters) in front of one text file per document"""
+
+    def __init__(self, max_chars: int, directory: Optional[str] = None):
+        self.max_chars = max_chars
+        self.directory = directory or None
+        self._entries = OrderedDict()  # sha256 -> text
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_hits = 0
+        self._store_load: Optional[Callable[[str], Optional[str]]] = None
+        self._store_save: Optional[Callable[[str, str], None]] = None
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                print(f"WARNING: Could not create PDF text cache directory {self.directory} ({e}), using memory only")
+                self.directory = None
+
+    def set_store(self, load: Callable[[str], Optional[str]], save: Callable[[str, str], None]) -> None:
+        """Durable tier behind memory and disk (the database's pdf_texts table)"""
+        self._store_load = load
+        self._store_save = save
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    def _remember(self, digest: str, text: str) -> None:
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            if digest in self._entries:
+                self._chars -= len(self._entries.pop(digest))
+            self._entries[digest] = text
+            self._chars += len(text)
+            while self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+                self.evictions += 1
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            text = self._entries.get(digest)
+            if text is not None:
+                self._entries.move_to_end(digest)
+                self.memory_hits += 1
+                return text
+        if self.directory:
+            try:
+                with open(self._path(digest), 'r', encoding='utf-8') as f:
+                    text = f.read()
+                self.disk_hits += 1
+                self._remember(digest, text)
+                return text
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"WARNING: Could not read cached PDF text {digest}: {e}")
+        if self._store_load is not None:
+            try:
+                text = self._store_load(digest)
+            except Exception as e:
+                print(f"WARNING: Could not load stored PDF text {digest}: {e}")
+                text = None
+            if isinstance(text, str):
+                self.store_hits += 1
+                self._remember(digest, text)
+                return text
+        self.misses += 1
+        return None
+
+    def put(self, digest: str, text: str) -> None:
+        self._remember(digest, text)
+        if self._store_save is not None:
+            try:
+                self._store_save(digest, text)
+            except Exception as e:
+                print(f"WARNING: Could not store PDF text {digest}: {e}")
+        if self.directory:
+            # write to a temp file and rename so another worker never reads half a file
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self._path(digest))
+            except OSError as e:
+                print(f"WARNING: Could not write cached PDF text {digest}: {e}")
+
+    def stats(self) -> Dict:
+        """Counters for monitoring the cache"""
+        hits = self.memory_hits + self.disk_hits + self.store_hits
+        lookups = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'chars_held': self._chars,
+            'disk': self.directory is not None,
+        }
+
+
+def create_pdf_text_cache() -> PDFTextCache:
+    """Build the PDF text cache from PDF_TEXT_CACHE_* settings (an empty directory means memory only)"""
+    return PDFTextCache(Config.PDF_TEXT_CACHE_MAX_CHARS, Config.PDF_TEXT_CACHE_DIR)
@@ -0,0 +1,192 @@
+# Reconciles the Auth0 identity (name, sub, picture) with the users table once per identity instead of on
+# every request. /api/user/profile (page load) and /messages sync and remember the result. /response only
+# looks the result up, so nothing between the request and the first token writes the profile. If /response
+# comes in before any sync on this worker, it reads the stored row through the user cache (so the name is the
+# same whichever worker answers) and the next /messages or profile load does the sync.
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """What a request needs to know about the user, resolved ahead of time"""
+    email: str
+    first_name: Optional[str]
+    sub: Optional[str] = None
+    # False if the profile hasn't been reconciled on this worker yet (built from the stored row or the token)
+    synced: bool = False
+
+
+def split_auth0_name(user_data: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """First and last name from Auth0's name field (a list from our token parsing or a full name string)"""
+    name = user_data.get('name')
+    if isinstance(name, list):
+        return (name[0] if len(name) > 0 else None), (name[1] if len(name) > 1 else None)
+    if isinstance(name, str) and name.strip():
+        name_parts = name.strip().split(maxsplit=1)
+        return name_parts[0], (name_parts[1] if len(name_parts) > 1 else None)
+    return None, None
+
+
+def extract_user_name(user_data: Dict, user_from_db: Optional[Dict] = None) -> Optional[str]:
+    """Extract user's first name from Auth0 data or database, with fallbacks"""
+    # Option 1 - gets from database
+    if user_from_db and user_from_db.get('first_name'):
+        return user_from_db['first_name']
+
+    # Second option - gets from Auth0 name field
+    first_name, _ = split_auth0_name(user_data)
+    if first_name:
+        return first_name
+
+    # Could also have auth0 nickname
+    nickname = user_data.get('nickname')
+    if nickname:
+        return nickname
+
+    # Email prefix (last resort)
+    email = user_data.get('email', '')
+    if email:
+        return email.split('@')[0]
+
+    return None
+
+
+class ProfileSync:
+    """Memoizes profile reconciliation per Auth0 identity and hands out immutable UserContexts"""
+
+    def __init__(self, load_user: Callable[[str], Optional[Dict]], update_profile: Callable[..., bool],
+                 invalidate_user: Callable[[str], None], ttl_seconds: float = 3600, max_entries: int = 10000):
+        self._load_user = load_user
+        self._update_profile = update_profile
+        self._invalidate_user = invalidate_user
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._contexts = OrderedDict()  # identity -> (UserContext, expires_at)
+        self._lock = threading.Lock()
+        self.syncs = 0
+        self.profile_updates = 0
+        self.hits = 0
+        self.stored_reads = 0
+        self.token_only = 0
+
+    @staticmethod
+    def _identity(user_data: Dict) -> Tuple:
+        # everything reconciliation looks at, so a changed name in Auth0 counts as a new identity
+        name = user_data.get('name')
+        return (
+            user_data.get('sub') or user_data.get('email'),
+            user_data.get('email'),
+            tuple(name) if isinstance(name, list) else name,
+            user_data.get('nickname'),
+            user_data.get('picture'),
+        )
+
+    def _lookup(self, identity: Tuple) -> Optional[UserContext]:
+        with self._lock:
+            entry = self._contexts.get(identity)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            self._contexts.move_to_end(identity)
+            self.hits += 1
+            return entry[0]
+
+    def remember(self, user_data: Dict, user_from_db: Optional[Dict]) -> UserContext:
+        """Store the context for a profile that was just reconciled (by sync or the profile endpoint)"""
+        context = UserContext(
+            email=user_data.get('email'),
+            first_name=extract_user_name(user_data, user_from_db),
+            sub=user_data.get('sub'),
+            synced=True
+        )
+        if self.ttl_seconds > 0:
+            with self._lock:
+                self._contexts[self._identity(user_data)] = (context, time.monotonic() + self.ttl_seconds)
+                while len(self._contexts) > self.max_entries:
+                    self._contexts.popitem(last=False)
+        return context
+
+    def sync(self, user_data: Dict) -> UserContext:
+        """Reconcile the Auth0 name with the users table (the database can be written here)"""
+        user_email = user_data.get('email')
+        user_from_db = self._load_user(user_email) if user_email else None
+        auth0_first_name, auth0_last_name = split_auth0_name(user_data)
+        if not auth0_first_name:
+            auth0_first_name = user_data.get('nickname')
+
+        # Update profile if name is missing in database or Auth0 has better/updated data
+        db_first_name = user_from_db.get('first_name') if user_from_db else None
+        email_prefix = user_email.split('@')[0] if user_email else ''
+        should_update_profile = False
+
+        # Update if name is missing in database
+        if not db_first_name and auth0_first_name and auth0_first_name != email_prefix:
+            should_update_profile = True
+        # Update if Auth0 has a real name but database has email prefix
+        elif db_first_name == email_prefix and auth0_first_name and auth0_first_name != email_prefix:
+            should_update_profile = True
+
+        if should_update_profile and user_from_db:
+            try:
+                self._update_profile(
+                    email=user_email,
+                    first_name=auth0_first_name,
+                    last_name=auth0_last_name,
+                    google_id=user_data.get('sub'),
+                    profile_picture_url=user_data.get('picture')
+                )
+                # Refresh from database after update
+                self._invalidate_user(user_email)
+                user_from_db = self._load_user(user_email)
+                with self._lock:
+                    self.profile_updates += 1
+            except Exception as e:
+                print(f"WARNING: Failed to update profile: {e}")
+
+        with self._lock:
+            self.syncs += 1
+        return self.remember(user_data, user_from_db)
+
+    def resolve(self, user_data: Dict) -> UserContext:
+        """The remembered context, syncing first if this identity hasn't been seen yet"""
+        return self._lookup(self._identity(user_data)) or self.sync(user_data)
+
+    def peek(self, user_data: Dict) -> UserContext:
+        """The remembered context without reconciling (never writes)
+        
+        On a miss the stored row is read through load_user (the user cache), only if that fails or there's no
+        row does it fall back to what the token says.
+        """
+        context = self._lookup(self._identity(user_data))
+        if context is not None:
+            return context
+        user_email = user_data.get('email')
+        user_from_db = None
+        if user_email:
+            try:
+                user_from_db = self._load_user(user_email)
+            except Exception as e:
+                print(f"WARNING: Could not read the profile for {user_email}, using the name from the token: {e}")
+        with self._lock:
+            if user_from_db:
+                self.stored_reads += 1
+            else:
+                self.token_only += 1
+        return UserContext(email=user_email, first_name=extract_user_name(user_data, user_from_db), sub=user_data.get('sub'))
+
+    def stats(self) -> Dict:
+        """How often the request path found a reconciled profile"""
+        with self._lock:
+            lookups = self.hits + self.stored_reads + self.token_only
+            return {
+                'identities': len(self._contexts),
+                'syncs': self.syncs,
+                'profile_updates': self.profile_updates,
+                'hits': self.hits,
+                'stored_reads': self.stored_reads,
+                'token_only': self.token_only,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
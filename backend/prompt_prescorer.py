@@ -0,0 +1,128 @@
+# Local scoring in front of the feedback model. The feedback prompt already says replies like "ok", "idk"
+# or "help me" score 1/10, so sending them to gpt-4o (600 max tokens) only adds a second or two of latency
+# and cost to get an answer we know in advance. Only confident matches are short-circuited - the latest
+# user message has to be one of the rubric's own 1/10 examples (after normalizing), have no attachments, and
+# not be answering a question (if I just asked "want me to continue?", "ok" is a fine reply).
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_APOSTROPHES = re.compile(r"['\u2019]")
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+
+# canned feedback per kind of reply, written like the feedback model's (second person, the AI as "I")
+_CANNED = {
+    'acknowledgement': {
+        'improvement_tips': [
+            "Tell me what you want to do next instead of just acknowledging my last answer.",
+            "Point to the part of my answer you want to build on, question, or apply.",
+            "Say what you'll do with the answer so I can tailor the next step to it."
+        ],
+        'example_improved_prompt': "That makes sense. Can you walk me through how the second step applies to my own project, and I'll try the first step myself?"
+    },
+    'no_effort': {
+        'improvement_tips': [
+            "Share what you already know or have tried, even if you're unsure about it.",
+            "Name the specific part that's confusing you instead of the whole topic.",
+            "Ask a focused question I can answer in a few sentences."
+        ],
+        'example_improved_prompt': "I understand what recursion is, but I get lost when the function calls itself twice. Can you explain how the calls unwind in a Fibonacci example?"
+    },
+    'continue': {
+        'improvement_tips': [
+            "Tell me which part of my last answer you want me to continue or expand.",
+            "Say why you need more, for example a missing example or a step you didn't follow.",
+            "Set the direction, like going deeper, giving an example, or moving to the next step."
+        ],
+        'example_improved_prompt': "Can you continue with the part about error handling and show an example of what happens when the file is missing?"
+    },
+    'help': {
+        'improvement_tips': [
+            "Say what you need help with and what you're working on.",
+            "Describe what you've tried so far and where you got stuck.",
+            "Tell me what kind of help you want, like an explanation, feedback, or a hint."
+        ],
+        'example_improved_prompt': "I'm writing a lab report on enzyme activity and my results don't match my hypothesis. Can you help me think through possible sources of error? I'll write the discussion section myself."
+    },
+}
+
+# normalized reply -> kind of canned feedback. Only the examples the feedback rubric itself scores 1/10
+# (yes/no/maybe are left out, they're too often real answers) - anything else is the model's call.
+DEGENERATE_REPLIES = {
+    'ok': 'acknowledgement',
+    'idk': 'no_effort', 'i dont know': 'no_effort', 'whatever': 'no_effort',
+    'continue': 'continue',
+    'help': 'help', 'help me': 'help',
+}
+
+
+def normalize_reply(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace ("OK!!" and "ok" are the same reply)"""
+    text = _APOSTROPHES.sub("", (text or "").lower())
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+class PromptPrescorer:
+    """Scores degenerate replies locally and keeps bypass metrics"""
+
+    SCORE = 1.0
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.checked = 0
+        self.bypassed = 0
+        # running average of real feedback calls, to estimate the latency each bypass saves
+        self.model_calls = 0
+        self.model_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def score(self, messages: List[Dict]) -> Optional[Tuple[float, Dict, float]]:
+        """(quality_score, feedback, message_score) like get_feedback_response, or None if the model should decide"""
+        if not self.enabled:
+            return None
+        latest = next((msg for msg in reversed(messages) if msg.get('role') == 'user'), None)
+        with self._lock:
+            self.checked += 1
+        if latest is None or latest.get('attachments'):
+            return None
+        kind = DEGENERATE_REPLIES.get(normalize_reply(latest.get('content', '')))
+        if kind is None:
+            return None
+        if self._answers_question(messages, latest):
+            return None
+        with self._lock:
+            self.bypassed += 1
+        canned = _CANNED[kind]
+        feedback = {
+            'quality_label': 'Poor',
+            'improvement_tips': list(canned['improvement_tips']),
+            'example_improved_prompt': canned['example_improved_prompt'],
+        }
+        return self.SCORE, feedback, self.SCORE
+
+    @staticmethod
+    def _answers_question(messages: List[Dict], latest: Dict) -> bool:
+        """Whether the assistant message right before the latest user message ends with a question"""
+        index = next(i for i in range(len(messages) - 1, -1, -1) if messages[i] is latest)
+        previous = messages[index - 1] if index > 0 else None
+        if previous is None or previous.get('role') != 'assistant':
+            return False
+        return (previous.get('content') or '').rstrip().endswith('?')
+
+    def record_model_call(self, seconds: float) -> None:
+        with self._lock:
+            self.model_calls += 1
+            self.model_seconds += seconds
+
+    def stats(self) -> Dict:
+        """Bypass rate and the latency it saved (estimated from the average real feedback call)"""
+        with self._lock:
+            avg_model_seconds = self.model_seconds / self.model_calls if self.model_calls else 0.0
+            return {
+                'enabled': self.enabled,
+                'checked': self.checked,
+                'bypassed': self.bypassed,
+                'bypass_rate': round(self.bypassed / self.checked, 4) if self.checked else 0.0,
+                'avg_feedback_call_seconds': round(avg_model_seconds, 3),
+                'estimated_seconds_saved': round(self.bypassed * avg_model_seconds, 1),
+            }
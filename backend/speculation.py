@@ -0,0 +1,184 @@
+# Speculative chat responses: while the feedback model is scoring a new message, start streaming the
+# reply under the previous turn's score bucket. The system prompt only depends on the bucket (and the
+# user's name), so if the new score lands in the same bucket the buffered reply is exactly what /response
+# would have asked for and it can be handed over instead of starting from scratch.
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+
+def score_bucket(quality_score: float) -> int:
+    """Which system prompt a quality score maps to (PromptRegistry keys the chat prompts on this)"""
+    if quality_score <= 3:
+        return 0
+    elif quality_score <= 5:
+        return 1
+    elif quality_score <= 7:
+        return 2
+    return 3
+
+
+class SpeculativeResponse:
+    """A chat response streaming into a buffer on a background thread"""
+
+    def __init__(self, conversation_id: str, bucket: int, user_name: Optional[str], stream_factory: Callable[[Callable], Iterator[str]]):
+        # stream_factory is called with a callback that gets the upstream (OpenAI) stream once it's open, so
+        # cancel() can close it from another thread instead of waiting for the next chunk to notice
+        self.conversation_id = conversation_id
+        self.bucket = bucket
+        self.user_name = user_name
+        self.started_at = time.monotonic()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+        self._upstream = None
+        self._thread = threading.Thread(target=self._run, args=(stream_factory,), name=f"speculate-{conversation_id}", daemon=True)
+        self._thread.start()
+
+    def _run(self, stream_factory):
+        stream = None
+        try:
+            stream = stream_factory(self._attach_upstream)
+            for chunk in stream:
+                if self._cancelled.is_set():
+                    break
+                if chunk:
+                    with self._cond:
+                        self.chunks.append(chunk)
+                        self._cond.notify_all()
+        except Exception as e:
+            # closing the upstream from cancel() makes the read fail, that's not an error anyone needs to see
+            if not self._cancelled.is_set():
+                self.error = e
+        finally:
+            if stream is not None and hasattr(stream, 'close'):
+                # stops the upstream request if we bailed out early
+                stream.close()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def _attach_upstream(self, upstream) -> None:
+        with self._cond:
+            self._upstream = upstream
+        if self._cancelled.is_set():
+            self._close_upstream(upstream)
+
+    @staticmethod
+    def _close_upstream(upstream) -> None:
+        try:
+            upstream.close()
+        except Exception as e:
+            print(f"WARNING: Could not close speculative stream: {e}")
+
+    def cancel(self) -> None:
+        """Stop generating - closes the upstream stream right away if it's open"""
+        self._cancelled.set()
+        with self._cond:
+            upstream = self._upstream
+        if upstream is not None and not self.finished:
+            self._close_upstream(upstream)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def matches(self, bucket: int, user_name: Optional[str]) -> bool:
+        return self.bucket == bucket and self.user_name == user_name
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Yield what's buffered so far, then keep following the stream until it finishes"""
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.chunks) and not self.finished:
+                        self._cond.wait(timeout=1.0)
+                    pending = self.chunks[index:]
+                    index += len(pending)
+                    finished = self.finished
+                for chunk in pending:
+                    yield chunk
+                if finished and index >= len(self.chunks):
+                    if self.error:
+                        raise self.error
+                    return
+        finally:
+            # the consumer went away (e.g. client disconnected) - no point generating the rest
+            if not self.finished:
+                self.cancel()
+
+
+class SpeculationRegistry:
+    """Tracks in-flight speculative responses per conversation, with hit rate and waste counters"""
+
+    def __init__(self, max_active: int = 16, ttl_seconds: float = 120):
+        self.max_active = max_active
+        self.ttl_seconds = ttl_seconds
+        self._active: Dict[str, SpeculativeResponse] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.abandoned = 0
+        # stream deltas are roughly one token each, so this approximates the tokens we paid for and threw away
+        self.wasted_tokens = 0
+
+    def _discard(self, speculation: SpeculativeResponse) -> None:
+        speculation.cancel()
+        self.wasted_tokens += len(speculation.chunks)
+
+    def _sweep(self, now: float) -> None:
+        # speculations nobody claimed (the /response call never came, or went to another worker)
+        for conversation_id, speculation in list(self._active.items()):
+            if now - speculation.started_at > self.ttl_seconds:
+                del self._active[conversation_id]
+                self._discard(speculation)
+                self.abandoned += 1
+
+    def start(self, conversation_id: str, bucket: int, user_name: Optional[str], stream_factory: Callable[[], Iterator[str]]) -> Optional[SpeculativeResponse]:
+        """Start speculating for a conversation (replaces any earlier speculation for it)"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            previous = self._active.pop(conversation_id, None)
+            if previous is not None:
+                self._discard(previous)
+                self.abandoned += 1
+            if len(self._active) >= self.max_active:
+                self.skipped += 1
+                return None
+            speculation = SpeculativeResponse(conversation_id, bucket, user_name, stream_factory)
+            self._active[conversation_id] = speculation
+            self.started += 1
+            return speculation
+
+    def claim(self, conversation_id: str, bucket: int, user_name: Optional[str]) -> Optional[SpeculativeResponse]:
+        """Hand over the speculation if it was generated under the right prompt, otherwise cancel it"""
+        with self._lock:
+            self._sweep(time.monotonic())
+            speculation = self._active.pop(conversation_id, None)
+            if speculation is None:
+                return None
+            if speculation.matches(bucket, user_name) and not speculation.cancelled and speculation.error is None:
+                self.hits += 1
+                return speculation
+            self._discard(speculation)
+            self.misses += 1
+            return None
+
+    def stats(self) -> Dict:
+        """Counters for monitoring speculation"""
+        resolved = self.hits + self.misses
+        return {
+            'started': self.started,
+            'skipped': self.skipped,
+            'hits': self.hits,
+            'misses': self.misses,
+            'abandoned': self.abandoned,
+            'hit_rate': round(self.hits / resolved, 4) if resolved else 0.0,
+            'wasted_tokens': self.wasted_tokens,
+            'active': len(self._active),
+        }
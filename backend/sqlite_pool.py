@@ -0,0 +1,117 @@
+# Thread-local SQLite connections for database.py. Opening a connection and setting it up (WAL, cache,
+# mmap...) on every query was most of the cost of the small queries, so each thread keeps one connection
+# open and reuses it. Connections of threads that have exited are closed on the next checkout, so the
+# number of open connections (and file descriptors) stays bounded by the number of live threads.
+import os
+import sqlite3
+import threading
+from typing import Dict
+
+
+def count_open_fds() -> int:
+    """File descriptors this process has open (-1 where /proc isn't available)"""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return -1
+
+
+class SQLiteConnectionPool:
+    """One connection per thread with the pragmas applied once, when it's opened"""
+
+    def __init__(self, path: str, timeout: float = 30.0, busy_timeout_ms: int = 30000,
+                 cache_size_kib: int = 8192, mmap_size: int = 64 * 1024 * 1024):
+        self.path = path
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        # thread ident -> connection, so connections of dead threads can be found and closed
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.reused = 0
+        self.checkouts = 0
+        self.checkins = 0
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False only so the sweep can close connections of threads that are gone
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # negative cache_size is in KiB instead of pages
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        self.opened += 1
+        return conn
+
+    def _close(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Warning: Failed to close SQLite connection: {e}")
+        self.closed += 1
+
+    def _sweep(self) -> None:
+        live = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in live]:
+            self._close(self._connections.pop(ident))
+
+    def acquire(self) -> sqlite3.Connection:
+        """This thread's connection (opened on first use)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.total_changes  # raises if someone closed it behind our back
+            except sqlite3.ProgrammingError:
+                conn = None
+        with self._lock:
+            self.checkouts += 1
+            if conn is None:
+                self._sweep()
+                # thread idents get reused, so this slot can still hold the connection of an exited thread
+                stale = self._connections.pop(threading.get_ident(), None)
+                if stale is not None:
+                    self._close(stale)
+                conn = self._open()
+                self._local.conn = conn
+                self._connections[threading.get_ident()] = conn
+            else:
+                self.reused += 1
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Give the connection back - it stays open, but nothing uncommitted is left on it"""
+        with self._lock:
+            self.checkins += 1
+        self._local.depth = max(getattr(self._local, 'depth', 1) - 1, 0)
+        if self._local.depth == 0 and getattr(self._local, 'conn', None) is conn:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.ProgrammingError:
+                pass
+
+    def close_all(self) -> None:
+        """Close every pooled connection (shutdown and tests)"""
+        with self._lock:
+            for conn in self._connections.values():
+                self._close(conn)
+            self._connections.clear()
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        """Leak counters - open_connections should track live threads, checked_out should be 0 at rest"""
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'closed': self.closed,
+                'open_connections': len(self._connections),
+                'reused': self.reused,
+                'checked_out': self.checkouts - self.checkins,
+                'open_fds': count_open_fds(),
+            }
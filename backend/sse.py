@@ -0,0 +1,210 @@
+# Server-Sent Events helpers for the /response streams. Text that's already available (a non-streaming
+# model's whole answer) is sent right away in a few large frames instead of being dribbled out with
+# sleeps - sleeping on a worker thread just holds the worker. If a visible typing effect is wanted, the
+# async route can space the frames out with SIMULATED_STREAM_PACING_MS, which awaits instead of blocking.
+#
+# Live model streams go through SSEWriter, which packs the 1-3 character deltas into bigger frames (by size
+# or by time since the last frame) so each response is a handful of writes instead of one per token.
+# write_frames / awrite_frames drive the writer from the routes and also flush on the interval while waiting
+# for the next delta, so a stalled upstream doesn't hold text back. The done event only carries the answer's
+# length and hash, the client already has the text from the frames.
+import asyncio
+import hashlib
+import json
+import queue
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+
+def sse_event(payload: Dict) -> str:
+    """Format a payload as a Server-Sent Event (compact JSON)"""
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+def text_frames(text: str, max_chars: int = 512) -> Iterator[str]:
+    """Split already-available text into frames of at most max_chars, breaking after whitespace when possible"""
+    max_chars = max(max_chars, 1)
+    pos = 0
+    while pos < len(text):
+        end = pos + max_chars
+        if end >= len(text):
+            yield text[pos:]
+            return
+        # cut after the last space/newline in the window so words aren't split between frames
+        cut = max(text.rfind(' ', pos, end), text.rfind('\n', pos, end))
+        cut = cut + 1 if cut > pos else end
+        yield text[pos:cut]
+        pos = cut
+
+
+class SSEWriter:
+    """Coalesces streamed deltas into SSE frames and keeps the whole answer in a list-join buffer"""
+
+    def __init__(self, max_bytes: int = 1024, flush_interval: float = 0.05, stats: Optional['SSEStats'] = None):
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.parts = []
+        self.deltas = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self._pending = []
+        self._pending_bytes = 0
+        # starts way back so the first delta goes out right away (time to first token matters most)
+        self._last_flush = float('-inf')
+
+    def _frame(self, payload: Dict) -> str:
+        event = sse_event(payload)
+        self.frames += 1
+        self.bytes_sent += len(event.encode('utf-8'))
+        self._last_flush = time.monotonic()
+        return event
+
+    def add(self, delta: str) -> Optional[str]:
+        """Buffer a delta, returns a frame to send once enough bytes or time have piled up"""
+        if not delta:
+            return None
+        self.parts.append(delta)
+        self._pending.append(delta)
+        self._pending_bytes += len(delta.encode('utf-8'))
+        self.deltas += 1
+        if self._pending_bytes >= self.max_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return None
+
+    def time_until_flush(self) -> Optional[float]:
+        """Seconds until the buffered text is due to go out on the interval (None if nothing is buffered)"""
+        if not self._pending:
+            return None
+        return max(self._last_flush + self.flush_interval - time.monotonic(), 0.0)
+
+    def flush(self) -> Optional[str]:
+        """Frame whatever is buffered (None if nothing is)"""
+        if not self._pending:
+            return None
+        chunk = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        return self._frame({'chunk': chunk})
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def done(self, text: Optional[str] = None) -> str:
+        """The completion event - length (in characters) and sha256 of the answer instead of the answer itself"""
+        text = self.text if text is None else text
+        event = self._frame({'done': True, 'length': len(text), 'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest()})
+        if self.stats is not None:
+            self.stats.record(self)
+        return event
+
+
+_END = object()
+
+
+def write_frames(chunks: Iterator[str], writer: SSEWriter) -> Iterator[str]:
+    """The frames for a stream of deltas, also flushing on the interval while the next delta is slow to come
+    
+    The deltas are read on a helper thread so the wait for the next one can time out. Errors from the stream
+    are raised here. Whatever is still buffered at the end is left for writer.flush().
+    """
+    deltas = queue.Queue()
+    stop = threading.Event()
+
+    def read():
+        error = None
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                deltas.put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # closes the upstream too when the client went away (closing it from here, the thread iterating it)
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            deltas.put((_END, error))
+
+    threading.Thread(target=read, name="sse-reader", daemon=True).start()
+    try:
+        while True:
+            try:
+                item = deltas.get(timeout=writer.time_until_flush())
+            except queue.Empty:
+                frame = writer.flush()
+                if frame:
+                    yield frame
+                continue
+            if isinstance(item, tuple) and item[0] is _END:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            frame = writer.add(item)
+            if frame:
+                yield frame
+    finally:
+        stop.set()
+
+
+async def awrite_frames(chunks: AsyncIterator[str], writer: SSEWriter) -> AsyncIterator[str]:
+    """Async version of write_frames - the wait for the next delta is bounded by the flush interval instead"""
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=writer.time_until_flush())
+            if not done:
+                frame = writer.flush()
+                if frame:
+                    yield frame
+                continue
+            task, pending = pending, None
+            try:
+                delta = task.result()
+            except StopAsyncIteration:
+                return
+            frame = writer.add(delta)
+            if frame:
+                yield frame
+    finally:
+        if pending is not None:
+            # stopped early (client went away) - let the read in progress finish cancelling before chunks is closed
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                pass
+
+
+class SSEStats:
+    """Frames, deltas and bytes per streamed response"""
+
+    def __init__(self):
+        self.responses = 0
+        self.deltas = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def record(self, writer: SSEWriter) -> None:
+        with self._lock:
+            self.responses += 1
+            self.deltas += writer.deltas
+            self.frames += writer.frames
+            self.bytes_sent += writer.bytes_sent
+
+    def stats(self) -> Dict:
+        """Averages per response - frames is also the number of writes to the socket"""
+        with self._lock:
+            responses = self.responses
+            return {
+                'responses': responses,
+                'avg_deltas': round(self.deltas / responses, 1) if responses else 0.0,
+                'avg_frames': round(self.frames / responses, 1) if responses else 0.0,
+                'avg_bytes': round(self.bytes_sent / responses, 1) if responses else 0.0,
+                'deltas_per_frame': round(self.deltas / self.frames, 2) if self.frames else 0.0,
+            }
@@ -7,6 +7,18 @@ import os
 import tempfile
 import json
 from unittest.mock import Mock, patch
+
+# keep the app's attachment store in memory so tests don't leave a SQLite file in /tmp (has to be set before config is imported)
+os.environ.setdefault('ATTACHMENT_STORE_BACKEND', 'memory')
+# same for extracted PDF text - memory only
+os.environ.setdefault('PDF_TEXT_CACHE_DIR', '')
+# parse PDFs inline so tests can patch PyPDF2 (test_pdf_extraction.py covers the process pool)
+os.environ.setdefault('PDF_EXTRACTION_WORKERS', '0')
+# endpoint tests swap app.db for a different mock each time, so no user caching or batched writes between them (test_user_cache.py covers those)
+os.environ.setdefault('USER_CACHE_TTL_SECONDS', '0')
+os.environ.setdefault('LAST_LOGIN_FLUSH_SECONDS', '0')
+os.environ.setdefault('PROFILE_SYNC_TTL_SECONDS', '0')
+
 from database import Database
 
 # Use test database
@@ -72,9 +84,10 @@ def test_db(monkeypatch):
                 ''')
                 conn.commit()
         finally:
-            conn.close()
+            db._close_connection(conn)
         
         yield db
+        db.close()
     finally:
         # Cleanup: delete temporary database file
         try:
@@ -4,6 +4,7 @@ Unit tests for ai_service.py
 Tests AI service operations with mocked OpenAI API calls
 """
 import pytest
+import json
 from unittest.mock import Mock, patch, MagicMock
 from ai_service import AIService
 
@@ -329,4 +330,189 @@ class TestAIService:
         # Invalid base64 should return error message
         text = ai_service._extract_pdf_text("invalid-base64!!!")
         assert "could not be extracted" in text or "error" in text.lower()
-
+    
+    # the same PDF should only be parsed once, the second time comes from the content hash cache
+    def test_get_pdf_text_uses_cache(self, ai_service):
+        """Test that PDF text extraction is cached by content hash"""
+        import base64
+        pdf_base64 = base64.b64encode(b"same pdf bytes").decode('utf-8')
+        with patch.object(ai_service, '_extract_pdf_text', return_value="Cached text") as mock_extract:
+            first = ai_service.get_pdf_text({"filename": "a.pdf", "data": pdf_base64})
+            second = ai_service.get_pdf_text({"filename": "renamed.pdf", "data": pdf_base64})
+        
+        assert first == second == "Cached text"
+        assert mock_extract.call_count == 1
+    
+    def test_get_pdf_text_does_not_cache_failures(self, ai_service):
+        """Test that a failed extraction is retried next time"""
+        with patch.object(ai_service, '_extract_pdf_text', return_value="[PDF content could not be extracted: bad]") as mock_extract:
+            ai_service.get_pdf_text({"data": "YmFk"})
+            ai_service.get_pdf_text({"data": "YmFk"})
+        assert mock_extract.call_count == 2
+    
+    # follow-up turns only have the stored metadata, the extracted text should still reach the model
+    def test_format_message_with_stored_pdf_text(self, ai_service):
+        """Test formatting a stored PDF attachment that has no base64 data"""
+        import base64
+        import hashlib
+        attachment = {"filename": "notes.pdf", "file_type": "application/pdf", "data": base64.b64encode(b"notes").decode('utf-8')}
+        with patch.object(ai_service, '_extract_pdf_text', return_value="Lecture notes"):
+            ai_service.prepare_pdf_attachment(attachment)
+        stored = {key: value for key, value in attachment.items() if key != 'data'}
+        
+        with patch.object(ai_service, '_extract_pdf_text') as mock_extract:
+            formatted = ai_service._format_message_with_attachments({"role": "user", "content": "Summarize", "attachments": [stored]})
+        
+        assert stored['content_sha256'] == hashlib.sha256(b"notes").hexdigest()
+        assert "Lecture notes" in formatted['content']
+        mock_extract.assert_not_called()
+    
+    # long conversations get windowed, and the system prompt no longer repeats every user message
+    @patch('ai_service.Config')
+    def test_feedback_history_is_windowed(self, mock_config, ai_service):
+        """Test that feedback only sends recent messages verbatim past the token budget"""
+        mock_config.FEEDBACK_HISTORY_TOKEN_BUDGET = 300
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value.choices = [MagicMock()]
+        mock_client.chat.completions.create.return_value.choices[0].message.content = '{"score": 6}'
+        ai_service.client = mock_client
+        messages = []
+        for i in range(20):
+            messages.append({"role": "user", "content": f"Unique question number {i}. " + "padding " * 30})
+            messages.append({"role": "assistant", "content": f"Answer {i}. " + "padding " * 30})
+        
+        ai_service.get_feedback_response(messages)
+        
+        sent = mock_client.chat.completions.create.call_args[1]['messages']
+        assert "Unique question number" not in sent[0]['content']
+        assert "Unique question number 19." in sent[1]['content']
+        assert "summarized" in sent[1]['content']
+        assert len(sent[1]['content']) < len(json.dumps(messages))
+    
+    @patch('ai_service.Config')
+    def test_chat_history_is_windowed(self, mock_config, ai_service):
+        """Test that the chat call gets a summary message plus the newest turns"""
+        mock_config.CHAT_HISTORY_TOKEN_BUDGET = 500
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = iter([])
+        ai_service.client = mock_client
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i}. " + "padding " * 40} for i in range(30)]
+        
+        list(ai_service.get_chat_response_stream(messages, 7.5))
+        
+        sent = mock_client.chat.completions.create.call_args[1]['messages']
+        assert sent[1]['role'] == "system"
+        assert "Summary of the earlier conversation" in sent[1]['content']
+        assert sent[-1]['content'] == messages[-1]['content']
+        assert len(sent) < len(messages)
+    
+    # the ASGI server uses the async client, same prompt and chunks as the sync stream
+    def test_get_chat_response_stream_async(self, ai_service, sample_messages):
+        """Test async streaming chat response"""
+        import asyncio
+        
+        def make_chunk(text):
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            return chunk
+        
+        class FakeAsyncStream:
+            def __init__(self):
+                self.closed = False
+                self._chunks = iter([make_chunk("Hello"), make_chunk(" world")])
+            def __aiter__(self):
+                return self
+            async def __anext__(self):
+                try:
+                    return next(self._chunks)
+                except StopIteration:
+                    raise StopAsyncIteration
+            async def close(self):
+                self.closed = True
+        
+        stream = FakeAsyncStream()
+        async def create(**kwargs):
+            assert kwargs['stream'] is True
+            assert kwargs['messages'][0]['role'] == "system"
+            return stream
+        ai_service._async_client = MagicMock()
+        ai_service._async_client.chat.completions.create = create
+        
+        async def collect():
+            return [chunk async for chunk in ai_service.get_chat_response_stream_async(sample_messages, 7.5)]
+        
+        assert asyncio.run(collect()) == ["Hello", " world"]
+        assert stream.closed
+    
+    # "ok" scores 1/10 by the rubric anyway, so it shouldn't cost a feedback call
+    def test_feedback_skips_model_for_degenerate_reply(self, ai_service):
+        """Test that the prescorer short-circuits the feedback call"""
+        mock_client = MagicMock()
+        ai_service.client = mock_client
+        
+        quality_score, feedback, message_score = ai_service.get_feedback_response([{"role": "user", "content": "ok"}], [6.0])
+        
+        assert quality_score == 1.0
+        assert feedback['quality_label'] == 'Poor'
+        mock_client.chat.completions.create.assert_not_called()
+    
+    # the feedback call asks for schema-constrained output and records what it cost
+    def test_feedback_uses_structured_output_and_records_usage(self, ai_service, sample_messages):
+        """Test the feedback request payload and per call usage counters"""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = '{"score": 6.5, "quality_label": "Good", "improvement_tips": ["One", "Two"], "example_improved_prompt": "Better"}'
+        mock_response.usage.prompt_tokens = 1200
+        mock_response.usage.completion_tokens = 90
+        mock_client.chat.completions.create.return_value = mock_response
+        ai_service.client = mock_client
+        
+        quality_score, feedback, _ = ai_service.get_feedback_response(sample_messages, [])
+        
+        params = mock_client.chat.completions.create.call_args.kwargs
+        assert params['response_format']['type'] == 'json_schema'
+        assert params['response_format']['json_schema']['strict'] is True
+        assert "USER: " in params['messages'][1]['content']
+        assert '"role"' not in params['messages'][1]['content']
+        assert quality_score == 6.5
+        assert feedback['improvement_tips'][:2] == ["One", "Two"]
+        assert len(feedback['improvement_tips']) == 3
+        stats = ai_service.feedback_usage.stats()
+        assert stats['calls'] == 1
+        assert stats['prompt_tokens'] == 1200
+        assert stats['completion_tokens'] == 90
+        assert stats['parse_failure_rate'] == 0.0
+    
+    def test_feedback_parse_failure_is_counted(self, ai_service, sample_messages):
+        """Test that unparseable feedback falls back to 5.0 and counts as a parse failure"""
+        mock_client = MagicMock()
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "Not JSON at all"
+        mock_client.chat.completions.create.return_value = mock_response
+        ai_service.client = mock_client
+        
+        quality_score, feedback, _ = ai_service.get_feedback_response(sample_messages, [])
+        
+        assert quality_score == 5.0
+        assert feedback == "Not JSON at all"
+        assert ai_service.feedback_usage.stats()['parse_failure_rate'] == 1.0
+    
+    # the static part of each prompt has to stay byte-identical so the upstream prefix cache can reuse it
+    def test_prompt_registry_keeps_static_prefix(self, ai_service):
+        """Test that only the dynamic parts of the system prompts change between requests"""
+        prompts = ai_service.prompts
+        plain = prompts.chat_system_prompt(6.0)
+        named = prompts.chat_system_prompt(6.5, "Ada")
+        assert plain is prompts.chat_prefixes[2]
+        assert named.startswith(plain)
+        assert named.endswith("Don't name the user every single time you respond.")
+        assert prompts.chat_system_prompt(2.0) != plain
+        
+        first = prompts.feedback_system_prompt(2, 1, [])
+        later = prompts.feedback_system_prompt(6, 3, [4.0, 5.5])
+        assert first.startswith(prompts.feedback_prefix)
+        assert later.startswith(prompts.feedback_prefix)
+        assert "Previous scores: [4.0, 5.5]" in later
@@ -10,6 +10,7 @@ import json
 from unittest.mock import patch, MagicMock, Mock
 from flask import Flask
 from app import app
+from config import Config
 
 class TestAppIntegration:
     """Integration tests for Flask app endpoints"""
@@ -52,6 +53,28 @@ class TestAppIntegration:
         response = client.get('/api/user/profile', headers={'Authorization': 'Bearer test-token'})
         assert response.status_code == 200
     
+    # with the cache on, repeat page loads don't touch the database at all (last_login is batched)
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_get_user_profile_is_cached(self, mock_auth_service, mock_db, client):
+        """Test that profile reads are served from the user cache"""
+        from app import user_cache
+        mock_auth_service.get_user_from_token.return_value = {"sub": "auth0|123", "email": "cached@example.com", "name": ["Test", "User"]}
+        mock_db.get_user_by_email.return_value = {"email": "cached@example.com", "first_name": "Test", "last_name": "User", "google_id": "auth0|123"}
+        
+        with patch.object(user_cache, 'ttl_seconds', 300), patch.object(user_cache, 'flush_interval', 3600):
+            for _ in range(3):
+                response = client.get('/api/user/profile', headers={'Authorization': 'Bearer test-token'})
+                assert response.status_code == 200
+                assert json.loads(response.data)['first_name'] == "Test"
+            assert mock_db.get_user_by_email.call_count == 1
+            mock_db.update_user_logins.assert_not_called()
+            mock_db.update_user_login.assert_not_called()
+            # the three logins go out as one batch
+            assert user_cache.flush_pending_logins() == 1
+            mock_db.update_user_logins.assert_called_once()
+        user_cache.invalidate("cached@example.com")
+    
     @patch('app.db')
     @patch('auth_service.auth_service')
     def test_create_conversation(self, mock_auth_service, mock_db, client):
@@ -83,10 +106,8 @@ class TestAppIntegration:
             "quality_score": None,
             "message_scores": []
         }
-        mock_db.get_conversation.side_effect = [None, mock_conversation, mock_conversation]
-        mock_db.create_user.return_value = True
-        mock_db.create_conversation.return_value = True
-        mock_db.update_conversation.return_value = True
+        mock_db.begin_conversation_turn.return_value = {**mock_conversation, "user_email": "test@example.com", "created": True}
+        mock_db.save_conversation_turn.return_value = "Test Title"
         
         # Mock AI service rather than using real API
         mock_ai_service.get_feedback_response.return_value = (7.5, {"quality_label": "Good"}, 7.5)
@@ -159,12 +180,51 @@ class TestAppIntegration:
             {"conversation_id": "conv-2", "title": "Test 2", "message_count": 3, "updated_at": "2024-01-02"}
         ]
         # just basically saying when you look for this, the return value is mock_conversations
-        mock_db.get_user_conversation_summaries.return_value = mock_conversations
+        mock_db.get_user_conversation_page.return_value = {"conversations": mock_conversations, "next_cursor": "abc"}
+        mock_db.get_conversations_version.return_value = 4
         
         response = client.get('/api/conversations', headers={'Authorization': 'Bearer test-token'})
         assert response.status_code == 200
         data = json.loads(response.data)
-        assert len(data) == 2
+        assert len(data['conversations']) == 2
+        assert data['next_cursor'] == "abc"
+        # the starting point for /api/conversations/changes
+        assert data['version'] == 4
+        # the server always pages, even when the client doesn't ask
+        mock_db.get_user_conversation_page.assert_called_once_with("test@example.com", 50, cursor=None)
+    
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_get_conversations_page_params(self, mock_auth_service, mock_db, client):
+        """Test that ?limit= is capped and a bad cursor is a 400"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_user_conversation_page.return_value = {"conversations": [], "next_cursor": None}
+        mock_db.get_conversations_version.return_value = 0
+        
+        response = client.get('/api/conversations?limit=100000&cursor=xyz', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        mock_db.get_user_conversation_page.assert_called_once_with("test@example.com", 200, cursor="xyz")
+        
+        mock_db.get_user_conversation_page.side_effect = ValueError("Invalid cursor: 'xyz'")
+        response = client.get('/api/conversations?cursor=xyz', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 400
+    
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_get_conversation_changes(self, mock_auth_service, mock_db, client):
+        """Test the sidebar delta endpoint"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        changes = {"version": 9, "upserted": [{"conversation_id": "conv-1", "title": "Test 1"}], "deleted": ["conv-2"], "reset": False}
+        mock_db.get_conversation_changes.return_value = changes
+        
+        response = client.get('/api/conversations/changes?since=5', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        assert json.loads(response.data) == changes
+        mock_db.get_conversation_changes.assert_called_once_with("test@example.com", 5, 200)
+        
+        # the version has to come from somewhere
+        response = client.get('/api/conversations/changes', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 400
     
     @patch('app.db')
     @patch('auth_service.auth_service')
@@ -190,11 +250,83 @@ class TestAppIntegration:
     def test_get_conversation_not_found(self, mock_auth_service, mock_db, client):
         """Test getting non-existent conversation"""
         mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
-        mock_db.get_conversation.return_value = None
+        mock_db.get_conversation_version.return_value = None
         
         response = client.get('/api/conversations/nonexistent', headers={'Authorization': 'Bearer test-token'})
         # so when it goes the user is found but the conversation isn't
         assert response.status_code == 404
+        mock_db.get_conversation.assert_not_called()
+    
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_get_conversation_not_modified(self, mock_auth_service, mock_db, client):
+        """Test that a matching If-None-Match gets a 304 without loading the messages"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversation_version.return_value = 7
+        mock_db.get_conversation.return_value = {"conversation_id": "test-123", "messages": [], "version": 7}
+        
+        response = client.get('/api/conversations/test-123', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        
+        mock_db.get_conversation.reset_mock()
+        response = client.get('/api/conversations/test-123', headers={'Authorization': 'Bearer test-token', 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        mock_db.get_conversation.assert_not_called()
+        
+        # a new turn bumps the version
+        mock_db.get_conversation_version.return_value = 8
+        mock_db.get_conversation.return_value = {"conversation_id": "test-123", "messages": [], "version": 8}
+        response = client.get('/api/conversations/test-123', headers={'Authorization': 'Bearer test-token', 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_get_conversations_not_modified(self, mock_auth_service, mock_db, client):
+        """Test that the conversation list answers 304 while the user's version hasn't moved"""
+        from app import conditional_get_stats
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversations_version.return_value = 3
+        mock_db.get_user_conversation_page.return_value = {"conversations": [], "next_cursor": None}
+        
+        etag = client.get('/api/conversations', headers={'Authorization': 'Bearer test-token'}).headers['ETag']
+        before = conditional_get_stats.stats().get('conversations', {}).get('not_modified', 0)
+        response = client.get('/api/conversations', headers={'Authorization': 'Bearer test-token', 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert mock_db.get_user_conversation_page.call_count == 1
+        assert conditional_get_stats.stats()['conversations']['not_modified'] == before + 1
+        
+        # another page size is a different body
+        response = client.get('/api/conversations?limit=10', headers={'Authorization': 'Bearer test-token', 'If-None-Match': etag})
+        assert response.status_code == 200
+    
+    @patch('app.db')
+    @patch('auth_service.auth_service')
+    def test_etags_are_per_user(self, mock_auth_service, mock_db, client):
+        """Test that two users at the same version never share an ETag (same browser, different sign-in)"""
+        mock_db.get_conversations_version.return_value = 3
+        mock_db.get_user_conversation_page.return_value = {"conversations": [], "next_cursor": None}
+        mock_db.get_conversation_version.return_value = 3
+        mock_db.get_conversation.return_value = {"conversation_id": "shared-id", "messages": [], "version": 3}
+        
+        etags = {}
+        for email in ("a@example.com", "b@example.com"):
+            mock_auth_service.get_user_from_token.return_value = {"email": email}
+            list_response = client.get('/api/conversations', headers={'Authorization': 'Bearer test-token'})
+            conversation_response = client.get('/api/conversations/shared-id', headers={'Authorization': 'Bearer test-token'})
+            assert 'Authorization' in list_response.headers['Vary']
+            assert 'Authorization' in conversation_response.headers['Vary']
+            etags[email] = (list_response.headers['ETag'], conversation_response.headers['ETag'])
+        
+        assert etags["a@example.com"][0] != etags["b@example.com"][0]
+        assert etags["a@example.com"][1] != etags["b@example.com"][1]
+        
+        # b revalidating a's cached list gets the full body
+        response = client.get('/api/conversations', headers={'Authorization': 'Bearer test-token', 'If-None-Match': etags["a@example.com"][0]})
+        assert response.status_code == 200
     
     @patch('app.db')
     @patch('app.ai_service')
@@ -209,10 +341,8 @@ class TestAppIntegration:
             "quality_score": None,
             "message_scores": []
         }
-        mock_db.get_conversation.side_effect = [None, mock_conversation, mock_conversation]
-        mock_db.create_user.return_value = True
-        mock_db.create_conversation.return_value = True
-        mock_db.update_conversation.return_value = True
+        mock_db.begin_conversation_turn.return_value = {**mock_conversation, "user_email": "test@example.com", "created": True}
+        mock_db.save_conversation_turn.return_value = "Test Title"
         mock_ai_service.get_feedback_response.return_value = (7.5, {"quality_label": "Good"}, 7.5)
         mock_ai_service.get_conversation_title.return_value = "Test Title"
         
@@ -231,6 +361,33 @@ class TestAppIntegration:
         # sent fake file, making sure it worked
         assert response.status_code == 200
     
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_send_message_pdf_text_stays_on_server(self, mock_auth_service, mock_ai_service, mock_db, client):
+        """Test that extracted PDF text is neither stored with the message nor sent back"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.begin_conversation_turn.return_value = {
+            "conversation_id": "test-123", "messages": [], "quality_score": None, "message_scores": [],
+            "user_email": "test@example.com", "created": False
+        }
+        mock_db.save_conversation_turn.return_value = "Title"
+        mock_ai_service.get_feedback_response.return_value = (7.5, {"quality_label": "Good"}, 7.5)
+        
+        def prepare(att, **kwargs):
+            att['content_sha256'] = "abc123"
+            att['extracted_text'] = "x" * 200000
+        mock_ai_service.prepare_pdf_attachment.side_effect = prepare
+        
+        payload = {"message": "Summarize", "file_attachments": [{"filename": "notes.pdf", "file_type": "application/pdf", "data": "cGRm"}]}
+        response = client.post('/api/conversations/test-123/messages', json=payload, headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        
+        returned = json.loads(response.data)['messages'][-1]['attachments'][0]
+        stored = mock_db.save_conversation_turn.call_args[0][2][-1]['attachments'][0]
+        for attachment in (returned, stored):
+            assert attachment == {"filename": "notes.pdf", "file_type": "application/pdf", "content_sha256": "abc123"}
+    
     @patch('app.db')
     @patch('auth_service.auth_service')
     def test_send_message_file_validation(self, mock_auth_service, mock_db, client):
@@ -302,8 +459,7 @@ class TestAppIntegration:
             "quality_score": 7.5,
             "message_scores": [7.5] * 20
         }
-        mock_db.get_conversation.return_value = mock_conversation
-        mock_db.create_user.return_value = True
+        mock_db.begin_conversation_turn.return_value = mock_conversation
         mock_ai_service.get_conversation_title.return_value = "Test Title"
         
         response = client.post(
@@ -377,3 +533,134 @@ class TestAppIntegration:
         data = response.data.decode('utf-8')
         assert 'data: ' in data
 
+    
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_get_ai_response_skips_profile_io(self, mock_auth_service, mock_ai_service, mock_db, client):
+        """Test that /response takes the name from the synced profile without touching the users table"""
+        from app import profile_sync
+        user_data = {"email": "synced@example.com", "sub": "auth0|synced", "name": ["Grace"]}
+        mock_auth_service.get_user_from_token.return_value = user_data
+        mock_db.get_conversation.return_value = {
+            "conversation_id": "test-123",
+            "messages": [{"role": "user", "content": "Hello", "timestamp": "2024-01-01T00:00:00"}],
+            "quality_score": 7.5,
+            "message_scores": [7.5]
+        }
+        mock_ai_service.get_chat_response_stream.return_value = iter(["Hi Grace."])
+        
+        with patch.object(profile_sync, 'ttl_seconds', 300):
+            profile_sync.remember(user_data, {"first_name": "Gracie"})
+            response = client.post('/api/conversations/test-123/response', headers={'Authorization': 'Bearer test-token'})
+        
+        assert response.status_code == 200
+        mock_db.get_user_by_email.assert_not_called()
+        mock_db.update_user_profile.assert_not_called()
+        assert mock_ai_service.get_chat_response_stream.call_args.kwargs['user_name'] == "Gracie"
+    
+    @patch('auth_service.auth_service')
+    def test_get_metrics(self, mock_auth_service, client):
+        """Test the cache metrics endpoint"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        
+        with patch.object(Config, 'METRICS_ADMIN_EMAILS', {"test@example.com"}):
+            response = client.get('/api/metrics', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert 'hit_rate' in data['attachment_store']
+        assert 'bytes_held' in data['attachment_store']
+        assert 'hits' in data['jwks_cache']
+    
+    # any signed-in user can hit the endpoint, only the configured admins get the process-wide stats
+    @patch('auth_service.auth_service')
+    def test_get_metrics_requires_admin(self, mock_auth_service, client):
+        mock_auth_service.get_user_from_token.return_value = {"email": "someone@example.com"}
+        
+        with patch.object(Config, 'METRICS_ADMIN_EMAILS', {"admin@example.com"}):
+            response = client.get('/api/metrics', headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 403
+    
+    # feedback and title are separate OpenAI calls, they should overlap instead of running one after the other
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_send_message_feedback_and_title_run_concurrently(self, mock_auth_service, mock_ai_service, mock_db, client):
+        """Test that first-message latency is max(feedback, title) rather than the sum"""
+        import time
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_conversation = {"conversation_id": "test-123", "messages": [], "quality_score": None, "message_scores": []}
+        mock_db.begin_conversation_turn.return_value = {**mock_conversation, "user_email": "test@example.com", "created": True}
+        mock_db.save_conversation_turn.return_value = "Test Title"
+        
+        def slow_feedback(*args, **kwargs):
+            time.sleep(0.3)
+            return (7.5, {"quality_label": "Good"}, 7.5)
+        
+        def slow_title(*args, **kwargs):
+            time.sleep(0.3)
+            return "Test Title"
+        
+        mock_ai_service.get_feedback_response.side_effect = slow_feedback
+        mock_ai_service.get_conversation_title.side_effect = slow_title
+        
+        started = time.monotonic()
+        response = client.post('/api/conversations/test-123/messages', json={"message": "Hello"}, headers={'Authorization': 'Bearer test-token'})
+        elapsed = time.monotonic() - started
+        
+        assert response.status_code == 200
+        assert elapsed < 0.55
+        # the title is passed to the database update
+        assert mock_db.save_conversation_turn.call_args.kwargs['title'] == "Test Title"
+    
+    @patch('app.Config')
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_send_message_slow_title_falls_back(self, mock_auth_service, mock_ai_service, mock_db, mock_config, client):
+        """Test that a slow title call doesn't hold up the feedback response"""
+        import time
+        mock_config.FEEDBACK_TIMEOUT_SECONDS = 5
+        mock_config.TITLE_TIMEOUT_SECONDS = 0.05
+        mock_config.USE_AI_TITLE_GENERATION = True
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_conversation = {"conversation_id": "test-123", "messages": [], "quality_score": None, "message_scores": []}
+        mock_db.begin_conversation_turn.return_value = {**mock_conversation, "user_email": "test@example.com", "created": True}
+        mock_db.save_conversation_turn.return_value = "Hello there"
+        mock_ai_service.get_feedback_response.return_value = (7.5, {"quality_label": "Good"}, 7.5)
+        
+        def slow_title(*args, **kwargs):
+            time.sleep(0.5)
+            return "Too Late"
+        mock_ai_service.get_conversation_title.side_effect = slow_title
+        
+        response = client.post('/api/conversations/test-123/messages', json={"message": "Hello there"}, headers={'Authorization': 'Bearer test-token'})
+        assert response.status_code == 200
+        assert mock_db.save_conversation_turn.call_args.kwargs['title'] == "Hello there"
+    
+    # with speculation on, the reply started during /messages should be reused by /response
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_speculative_response_is_reused(self, mock_auth_service, mock_ai_service, mock_db, client):
+        """Test that /response streams the speculative reply when the score bucket didn't change"""
+        from config import Config
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com", "name": ["Test"]}
+        mock_conversation = {"conversation_id": "test-spec", "user_email": "test@example.com", "messages": [], "quality_score": 7.5, "message_scores": [7.5]}
+        mock_db.get_conversation.return_value = mock_conversation
+        mock_db.begin_conversation_turn.return_value = mock_conversation
+        mock_db.save_conversation_turn.return_value = None
+        mock_db.get_user_by_email.return_value = {"first_name": "Test"}
+        mock_ai_service._supports_streaming.return_value = True
+        mock_ai_service.get_feedback_response.return_value = (8.0, {"quality_label": "Good"}, 8.0)
+        mock_ai_service.get_chat_response_stream.side_effect = lambda *args, **kwargs: iter(["Speculated ", "reply"])
+        
+        with patch.object(Config, 'SPECULATIVE_RESPONSES', True):
+            response = client.post('/api/conversations/test-spec/messages', json={"message": "Hello"}, headers={'Authorization': 'Bearer test-token'})
+            assert response.status_code == 200
+            response = client.post('/api/conversations/test-spec/response', headers={'Authorization': 'Bearer test-token'})
+            assert response.status_code == 200
+            assert b'Speculated ' in response.data
+        
+        # only the speculative call went out
+        assert mock_ai_service.get_chat_response_stream.call_count == 1
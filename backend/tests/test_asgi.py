@@ -0,0 +1,173 @@
+"""
+Tests for asgi.py
+Drives the ASGI app in-process with httpx - /response runs on the async path, everything else goes to Flask
+"""
+import asyncio
+import hashlib
+import json
+import time
+import httpx
+from unittest.mock import patch, MagicMock
+from asgi import application
+
+def run_requests(*requests):
+    """Send requests to the ASGI app concurrently and return the responses"""
+    async def go():
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*(client.request(method, url, headers=headers) for method, url, headers in requests))
+    return asyncio.run(go())
+
+def sse_payloads(response):
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+class TestAsgiApp:
+    """Test the ASGI entry point"""
+
+    def test_other_routes_go_to_flask(self):
+        response, = run_requests(("GET", "/api/health", {}))
+        assert response.status_code == 200
+        assert response.json()['status'] == 'healthy'
+
+    # the Flask routes run on a thread pool, not one shared thread, so a slow one doesn't hold up the rest
+    def test_flask_routes_overlap(self):
+        import app as backend
+        
+        def slow_health():
+            time.sleep(0.3)
+            return {'status': 'healthy'}
+        
+        with patch.dict(backend.app.view_functions, {'health_check': slow_health}):
+            started = time.monotonic()
+            responses = run_requests(*[("GET", "/api/health", {}) for _ in range(5)])
+            elapsed = time.monotonic() - started
+        
+        assert all(r.status_code == 200 for r in responses)
+        assert elapsed < 1.0
+
+    # /response runs outside Flask but gets the same CORS headers flask-cors puts on the Flask routes
+    def test_response_cors_matches_flask(self):
+        origin = {"Origin": "http://localhost:3000"}
+        flask_response, async_response = run_requests(("GET", "/api/health", origin), ("POST", "/api/conversations/test-123/response", origin))
+        for header in ('access-control-allow-origin', 'access-control-allow-credentials', 'vary'):
+            assert async_response.headers.get(header) == flask_response.headers.get(header)
+        assert async_response.headers['access-control-allow-origin'] == "http://localhost:3000"
+
+    def test_response_requires_auth(self):
+        response, = run_requests(("POST", "/api/conversations/test-123/response", {}))
+        assert response.status_code == 401
+
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_streams_response(self, mock_auth_service, mock_ai_service, mock_db):
+        """Test the async SSE stream and that the response gets saved"""
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com", "name": ["Test"]}
+        mock_db.get_conversation.return_value = {
+            "conversation_id": "test-123",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "quality_score": 7.5,
+            "message_scores": [7.5]
+        }
+        mock_db.get_user_by_email.return_value = {"first_name": "Test"}
+        mock_ai_service._supports_streaming.return_value = True
+        
+        async def fake_stream(*args, **kwargs):
+            for chunk in ["Hello", " there"]:
+                yield chunk
+        mock_ai_service.get_chat_response_stream_async = fake_stream
+        
+        response, = run_requests(("POST", "/api/conversations/test-123/response", AUTH))
+        
+        assert response.status_code == 200
+        assert 'text/event-stream' in response.headers['content-type']
+        payloads = sse_payloads(response)
+        assert "".join(p['chunk'] for p in payloads if 'chunk' in p) == "Hello there"
+        # the done event only describes the answer, the text itself came in the frames
+        assert payloads[-1] == {'done': True, 'length': 11, 'sha256': hashlib.sha256(b"Hello there").hexdigest()}
+        saved_messages = mock_db.update_conversation.call_args[0][1]
+        assert saved_messages[-1]['content'] == "Hello there"
+
+    # a non-streaming model's answer is sent in a few frames right away, not 2 words every 50ms
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_simulated_stream_is_not_delayed(self, mock_auth_service, mock_ai_service, mock_db):
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversation.return_value = {
+            "conversation_id": "test-123",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "quality_score": 7.5,
+            "message_scores": [7.5]
+        }
+        mock_db.get_user_by_email.return_value = {"first_name": "Test"}
+        mock_ai_service._supports_streaming.return_value = False
+        answer = " ".join(["word"] * 600)
+        
+        async def fake_response(*args, **kwargs):
+            return answer
+        mock_ai_service.get_chat_response_async = fake_response
+        
+        started = time.monotonic()
+        response, = run_requests(("POST", "/api/conversations/test-123/response", AUTH))
+        
+        assert time.monotonic() - started < 2
+        payloads = sse_payloads(response)
+        chunks = [p['chunk'] for p in payloads if 'chunk' in p]
+        assert "".join(chunks) == answer
+        assert len(chunks) <= 10
+        assert payloads[-1]['done'] is True
+
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_missing_conversation(self, mock_auth_service, mock_ai_service, mock_db):
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversation.return_value = None
+        response, = run_requests(("POST", "/api/conversations/nope/response", AUTH))
+        assert response.status_code == 404
+
+    # slow streams are coroutines, so they overlap instead of each needing a worker
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_concurrent_streams_overlap(self, mock_auth_service, mock_ai_service, mock_db):
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversation.return_value = {"conversation_id": "c", "messages": [{"role": "user", "content": "Hi"}], "quality_score": 7.5}
+        mock_db.get_user_by_email.return_value = {"first_name": "Test"}
+        mock_ai_service._supports_streaming.return_value = True
+        
+        async def slow_stream(*args, **kwargs):
+            for chunk in ["a", "b", "c"]:
+                await asyncio.sleep(0.1)
+                yield chunk
+        mock_ai_service.get_chat_response_stream_async = slow_stream
+        
+        started = time.monotonic()
+        responses = run_requests(*[("POST", f"/api/conversations/c{i}/response", AUTH) for i in range(20)])
+        elapsed = time.monotonic() - started
+        
+        assert all(r.status_code == 200 for r in responses)
+        # 20 streams of ~0.3s each, far below the 6s it would take one at a time
+        assert elapsed < 2.0
+
+    @patch('app.db')
+    @patch('app.ai_service')
+    @patch('auth_service.auth_service')
+    def test_stream_error_event(self, mock_auth_service, mock_ai_service, mock_db):
+        mock_auth_service.get_user_from_token.return_value = {"email": "test@example.com"}
+        mock_db.get_conversation.return_value = {"conversation_id": "c", "messages": [{"role": "user", "content": "Hi"}], "quality_score": 7.5}
+        mock_db.get_user_by_email.return_value = None
+        mock_ai_service._supports_streaming.return_value = True
+        
+        async def failing_stream(*args, **kwargs):
+            yield "partial"
+            raise Exception("Rate limit exceeded. Please try again in a moment.")
+        mock_ai_service.get_chat_response_stream_async = failing_stream
+        
+        response, = run_requests(("POST", "/api/conversations/c/response", AUTH))
+        payloads = sse_payloads(response)
+        assert payloads[-1]['error'] == "Rate limit exceeded. Please try again in a moment."
+        mock_db.update_conversation.assert_not_called()
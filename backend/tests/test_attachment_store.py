@@ -0,0 +1,185 @@
+"""
+Unit tests for attachment_store.py
+Tests the in-memory, SQLite and Redis attachment stores (Redis against a tiny local stand-in server)
+"""
+import pytest
+import socket
+import socketserver
+import threading
+import time
+from attachment_store import AttachmentStore, InMemoryAttachmentStore, SQLiteAttachmentStore, RedisAttachmentStore
+
+# what send_message puts in the store - messages with base64 attachment data
+def make_messages(data="aGVsbG8="):
+    return [{"role": "user", "content": "Look at this", "attachments": [{"filename": "a.png", "file_type": "image/png", "data": data}]}]
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough RESP for SET/GETDEL (PX expiry is ignored)"""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            count = int(line[1:-2])
+            args = []
+            for _ in range(count):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].upper()
+            self.server.commands.append(command)
+            data = self.server.data
+            if command == b'SET':
+                data[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif command == b'GETDEL':
+                value = data.pop(args[1], None)
+                time.sleep(self.server.reply_delay)
+                if value is None:
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(f"${len(value)}\r\n".encode() + value + b"\r\n")
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+class TestAttachmentStore:
+    """Test the shared base class"""
+
+    # a backend that forgets _put/_pop should fail when it's built, not on the first request
+    def test_backend_must_implement_put_and_pop(self):
+        class HalfStore(AttachmentStore):
+            def _put(self, key, payload):
+                pass
+
+        with pytest.raises(TypeError):
+            HalfStore(max_bytes=10_000, ttl_seconds=300)
+
+class TestInMemoryAttachmentStore:
+    """Test the per-process store"""
+
+    def test_put_and_pop_is_one_time_use(self):
+        store = InMemoryAttachmentStore(max_bytes=10_000, ttl_seconds=300)
+        assert store.put("conv-1", make_messages())
+        assert store.pop("conv-1") == make_messages()
+        assert store.pop("conv-1") is None
+
+        stats = store.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['bytes_held'] == 0
+
+    def test_ttl_expiry(self):
+        store = InMemoryAttachmentStore(max_bytes=10_000, ttl_seconds=0.01)
+        store.put("conv-1", make_messages())
+        time.sleep(0.02)
+        assert store.pop("conv-1") is None
+        assert store.stats()['evictions'] == 1
+
+    # over the byte budget the oldest entries go first
+    def test_byte_budget_evicts_lru(self):
+        entry_size = len(InMemoryAttachmentStore(1, 1)._encode(make_messages()))
+        store = InMemoryAttachmentStore(max_bytes=entry_size * 2, ttl_seconds=300)
+        store.put("conv-1", make_messages())
+        store.put("conv-2", make_messages())
+        store.put("conv-3", make_messages())
+
+        assert store.pop("conv-1") is None
+        assert store.pop("conv-3") is not None
+        assert store.stats()['evictions'] == 1
+        assert store.bytes_held() == entry_size
+
+    def test_oversized_entry_rejected(self):
+        store = InMemoryAttachmentStore(max_bytes=10, ttl_seconds=300)
+        assert store.put("conv-1", make_messages()) is False
+        assert store.stats()['rejected'] == 1
+
+class TestSQLiteAttachmentStore:
+    """Test the store that's shared between worker processes"""
+
+    @pytest.fixture
+    def store_path(self, tmp_path):
+        return str(tmp_path / "attachments.db")
+
+    # two stores on the same file stand in for two gunicorn workers
+    def test_shared_between_workers(self, store_path):
+        worker_1 = SQLiteAttachmentStore(store_path, max_bytes=10_000, ttl_seconds=300)
+        worker_2 = SQLiteAttachmentStore(store_path, max_bytes=10_000, ttl_seconds=300)
+
+        worker_1.put("conv-1", make_messages())
+        assert worker_2.pop("conv-1") == make_messages()
+        assert worker_1.pop("conv-1") is None
+
+    def test_ttl_and_budget(self, store_path):
+        entry_size = len(InMemoryAttachmentStore(1, 1)._encode(make_messages()))
+        store = SQLiteAttachmentStore(store_path, max_bytes=entry_size * 2, ttl_seconds=300)
+        for key in ["conv-1", "conv-2", "conv-3"]:
+            store.put(key, make_messages())
+        assert store.pop("conv-1") is None
+        assert store.bytes_held() == entry_size * 2
+
+        store.ttl_seconds = 0
+        store.put("conv-4", make_messages())
+        assert store.pop("conv-4") is None
+
+class TestRedisAttachmentStore:
+    """Test the Redis protocol client against a local stand-in"""
+
+    @pytest.fixture
+    def redis_server(self):
+        server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+        server.daemon_threads = True
+        server.data = {}
+        server.commands = []
+        server.reply_delay = 0
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def test_put_and_pop(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisAttachmentStore(f"redis://{host}:{port}/0", max_entry_bytes=10_000, ttl_seconds=300)
+
+        store.put("conv-1", make_messages())
+        assert b"promptly:attachments:conv-1" in redis_server.data
+        assert store.pop("conv-1") == make_messages()
+        assert store.pop("conv-1") is None
+        assert store.stats()['hit_rate'] == 0.5
+
+    # the client should reconnect if the server dropped the connection
+    def test_reconnects(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisAttachmentStore(f"redis://{host}:{port}/0", max_entry_bytes=10_000, ttl_seconds=300)
+        store.put("conv-1", make_messages())
+        store._sock.shutdown(socket.SHUT_RDWR)
+        store.put("conv-2", make_messages())
+        assert store.pop("conv-2") == make_messages()
+
+    # the server may have run GETDEL before the reply timed out, sending it again would just get nil
+    def test_pop_not_retried_after_reply_timeout(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisAttachmentStore(f"redis://{host}:{port}/0", max_entry_bytes=10_000, ttl_seconds=300, timeout=0.2)
+        store.put("conv-1", make_messages())
+        redis_server.reply_delay = 0.5
+        
+        with pytest.raises(OSError):
+            store.pop("conv-1")
+        assert redis_server.commands.count(b'GETDEL') == 1
+
+    # a connection the server already closed is noticed before GETDEL is sent, so that still reconnects
+    def test_pop_reconnects_when_stale(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisAttachmentStore(f"redis://{host}:{port}/0", max_entry_bytes=10_000, ttl_seconds=300)
+        store.put("conv-1", make_messages())
+        store._sock.shutdown(socket.SHUT_RDWR)
+        assert store.pop("conv-1") == make_messages()
+
+    # redis has no total budget of its own here, only the per-entry cap
+    def test_entry_cap(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisAttachmentStore(f"redis://{host}:{port}/0", max_entry_bytes=10, ttl_seconds=300)
+        assert store.put("conv-1", make_messages()) is False
+        assert redis_server.data == {}
+        assert store.stats()['max_bytes'] is None
+        assert store.stats()['max_entry_bytes'] == 10
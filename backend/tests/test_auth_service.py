@@ -4,9 +4,11 @@ Unit tests for auth_service.py
 Tests authentication and JWT token verification with mocked Auth0
 """
 import pytest
+import threading
+import time
 from unittest.mock import Mock, patch, MagicMock
 from flask import Flask
-from auth_service import AuthService, require_auth
+from auth_service import AuthService, JWKSCache, require_auth
 import requests
 
 class TestAuthService:
@@ -19,10 +21,19 @@ class TestAuthService:
             mock_config.AUTH0_DOMAIN = "test.auth0.com"
             mock_config.AUTH0_API_AUDIENCE = "test-audience"
             mock_config.AUTH0_ALGORITHMS = "RS256"
+            mock_config.JWKS_CACHE_TTL_SECONDS = 3600
+            mock_config.JWKS_MIN_REFETCH_INTERVAL_SECONDS = 30
+            mock_config.TOKEN_CACHE_MAX_ENTRIES = 1024
+            mock_config.TOKEN_CACHE_NEGATIVE_TTL_SECONDS = 10
+            mock_config.TOKEN_CACHE_PARTIAL_TTL_SECONDS = 30
+            mock_config.AUTH0_HTTP_POOL_SIZE = 10
+            mock_config.AUTH0_CONNECT_TIMEOUT_SECONDS = 3
+            mock_config.AUTH0_READ_TIMEOUT_SECONDS = 5
+            mock_config.AUTH0_HTTP_MAX_RETRIES = 2
             service = AuthService()
             return service
     
-    @patch('auth_service.requests.get')
+    @patch('auth_service.requests.Session.get')
     @patch('auth_service.jwt.get_unverified_header')
     def test_get_public_key(self, mock_jwt_header, mock_requests_get, auth_service):
         """Test getting public key from Auth0"""
@@ -52,7 +63,77 @@ class TestAuthService:
         assert public_key['kid'] == "test-kid"
         mock_requests_get.assert_called_once()
     
-    @patch('auth_service.requests.get')
+    # the JWKS should only be downloaded once, after that the key comes from the cache
+    @patch('auth_service.requests.Session.get')
+    @patch('auth_service.jwt.get_unverified_header')
+    def test_get_public_key_uses_cache(self, mock_jwt_header, mock_requests_get, auth_service):
+        """Test that repeated lookups for the same kid don't refetch the JWKS"""
+        mock_response = Mock()
+        mock_response.json.return_value = {"keys": [{"kid": "test-kid", "kty": "RSA", "use": "sig", "n": "test-n", "e": "test-e"}]}
+        mock_response.raise_for_status = Mock()
+        mock_requests_get.return_value = mock_response
+        mock_jwt_header.return_value = {"kid": "test-kid"}
+        
+        for _ in range(5):
+            assert auth_service.get_public_key("test-token")['kid'] == "test-kid"
+        
+        mock_requests_get.assert_called_once()
+        stats = auth_service.jwks_cache.stats()
+        assert stats['hits'] == 4
+        assert stats['misses'] == 1
+    
+    # key rotation: a new kid should force one refetch, but a bogus kid shouldn't keep hammering Auth0
+    @patch('auth_service.requests.Session.get')
+    @patch('auth_service.jwt.get_unverified_header')
+    def test_get_public_key_unknown_kid_refetches(self, mock_jwt_header, mock_requests_get, auth_service):
+        """Test that an unknown kid forces a refetch, rate limited by the refetch interval"""
+        old_jwks = Mock()
+        old_jwks.json.return_value = {"keys": [{"kid": "old-kid", "kty": "RSA", "use": "sig", "n": "n", "e": "e"}]}
+        new_jwks = Mock()
+        new_jwks.json.return_value = {"keys": [{"kid": "new-kid", "kty": "RSA", "use": "sig", "n": "n", "e": "e"}]}
+        mock_requests_get.side_effect = [old_jwks, new_jwks]
+        
+        mock_jwt_header.return_value = {"kid": "old-kid"}
+        auth_service.get_public_key("old-token")
+        
+        # Allow the forced refetch straight away
+        auth_service.jwks_cache._last_forced_refetch = 0.0
+        auth_service.jwks_cache.min_refetch_interval = 0
+        mock_jwt_header.return_value = {"kid": "new-kid"}
+        assert auth_service.get_public_key("new-token")['kid'] == "new-kid"
+        assert mock_requests_get.call_count == 2
+        
+        # Within the interval an unknown kid fails without another network call
+        auth_service.jwks_cache.min_refetch_interval = 3600
+        mock_jwt_header.return_value = {"kid": "bogus-kid"}
+        with pytest.raises(ValueError):
+            auth_service.get_public_key("bogus-token")
+        assert mock_requests_get.call_count == 2
+    
+    # stale keys keep being served while the refresh happens in the background
+    @patch('auth_service.requests.Session.get')
+    @patch('auth_service.jwt.get_unverified_header')
+    def test_get_public_key_stale_refreshes_in_background(self, mock_jwt_header, mock_requests_get, auth_service):
+        """Test stale-while-revalidate behavior of the JWKS cache"""
+        mock_response = Mock()
+        mock_response.json.return_value = {"keys": [{"kid": "test-kid", "kty": "RSA", "use": "sig", "n": "test-n", "e": "test-e"}]}
+        mock_response.raise_for_status = Mock()
+        mock_requests_get.return_value = mock_response
+        mock_jwt_header.return_value = {"kid": "test-kid"}
+        
+        auth_service.get_public_key("test-token")
+        auth_service.jwks_cache.ttl_seconds = 0
+        
+        with patch('auth_service.threading.Thread') as mock_thread:
+            assert auth_service.get_public_key("test-token")['kid'] == "test-kid"
+            mock_thread.assert_called_once()
+            # run the refresh inline instead of on a real thread
+            mock_thread.call_args.kwargs['target']()
+        
+        assert mock_requests_get.call_count == 2
+        assert auth_service.jwks_cache.stats()['refreshes'] == 2
+    
+    @patch('auth_service.requests.Session.get')
     @patch('auth_service.jwt.decode')
     @patch('auth_service.jwt.get_unverified_header')
     def test_verify_token_valid(self, mock_jwt_header, mock_jwt_decode, mock_requests_get, auth_service):
@@ -81,7 +162,7 @@ class TestAuthService:
         assert payload is not None
         assert payload['email'] == "test@example.com"
     
-    @patch('auth_service.requests.get')
+    @patch('auth_service.requests.Session.get')
     @patch('auth_service.jwt.get_unverified_header')
     def test_verify_token_invalid(self, mock_jwt_header, mock_requests_get, auth_service):
         """Test verifying an invalid token"""
@@ -103,7 +184,7 @@ class TestAuthService:
         """Test require_auth decorator with no token"""
         app = Flask(__name__)
         
-        // this is a mini Flask app that is used to test the require_auth decorator
+        # this is a mini Flask app that is used to test the require_auth decorator
         @app.route('/test')
         @require_auth
         def protected_route():
@@ -126,7 +207,7 @@ class TestAuthService:
         }
         mock_auth_service_class.return_value = mock_auth_service
         
-        // this is a mini Flask app that is used to test the require_auth decorator
+        # this is a mini Flask app that is used to test the require_auth decorator
         @app.route('/test')
         @require_auth
         def protected_route():
@@ -139,7 +220,7 @@ class TestAuthService:
             assert response.status_code in [200, 401]  # Depends on how decorator is set up
     
     # this tests when the JWT has the email, can we get it from the token?
-    @patch('auth_service.requests.get')
+    @patch('auth_service.requests.Session.get')
     @patch('auth_service.jwt.decode')
     @patch('auth_service.jwt.get_unverified_header')
     def test_get_user_from_token_with_email(self, mock_jwt_header, mock_jwt_decode, mock_requests_get, auth_service):
@@ -166,7 +247,7 @@ class TestAuthService:
             assert user_data['email'] == "test@example.com"
     
     # this tests when the JWT doesn't have the email, can we get it from the /userinfo endpoint?
-    @patch('auth_service.requests.get')
+    @patch('auth_service.requests.Session.get')
     @patch('auth_service.jwt.decode')
     @patch('auth_service.jwt.get_unverified_header')
     def test_get_user_from_token_fallback_to_userinfo(self, mock_jwt_header, mock_jwt_decode, mock_requests_get, auth_service):
@@ -201,3 +282,177 @@ class TestAuthService:
             # Verify that requests.get was called (for userinfo)
             assert mock_requests_get.called
 
+
+    # the same token on back to back requests shouldn't be decoded again or hit /userinfo again
+    @patch('auth_service.requests.Session.get')
+    def test_get_user_from_token_cached_until_exp(self, mock_requests_get, auth_service):
+        """Test that a verified token is served from the token cache"""
+        import time
+        mock_payload = {
+            "sub": "auth0|123",
+            "email": "test@example.com",
+            "exp": time.time() + 3600
+        }
+        mock_userinfo_response = Mock()
+        mock_userinfo_response.status_code = 200
+        mock_userinfo_response.json.return_value = {"email": "test@example.com", "name": "Test User", "picture": "https://example.com/pic.jpg"}
+        mock_requests_get.return_value = mock_userinfo_response
+        
+        with patch.object(auth_service, 'verify_token', return_value=mock_payload) as mock_verify:
+            first = auth_service.get_user_from_token("Bearer valid-token")
+            # callers mutating the result shouldn't change what's cached
+            first['name'].append("Changed")
+            second = auth_service.get_user_from_token("Bearer valid-token")
+            
+            assert mock_verify.call_count == 1
+            assert mock_requests_get.call_count == 1
+            assert second['name'] == ["Test", "User"]
+            
+            # a different token is a different cache entry
+            auth_service.get_user_from_token("Bearer other-token")
+            assert mock_verify.call_count == 2
+        
+        assert auth_service.token_cache.stats()['hits'] == 1
+    
+    def test_get_user_from_token_negative_cache(self, auth_service):
+        """Test that failed tokens are negatively cached for a short time"""
+        with patch.object(auth_service, 'verify_token', return_value=None) as mock_verify:
+            assert auth_service.get_user_from_token("Bearer bad-token") is None
+            assert auth_service.get_user_from_token("Bearer bad-token") is None
+            assert mock_verify.call_count == 1
+            
+            # once the negative entry expires we verify again
+            auth_service.token_cache.negative_ttl_seconds = 0
+            auth_service.token_cache.put_failure(auth_service.token_cache.digest("bad-token"))
+            assert auth_service.get_user_from_token("Bearer bad-token") is None
+            assert mock_verify.call_count == 2
+    
+    # Auth0 being unreachable says nothing about the token, so the next request has to try again
+    @patch('auth_service.time.sleep')
+    @patch('auth_service.requests.Session.get', side_effect=requests.exceptions.ConnectionError("down"))
+    @patch('auth_service.jwt.get_unverified_header')
+    def test_get_user_from_token_jwks_error_not_cached(self, mock_jwt_header, mock_requests_get, mock_sleep, auth_service):
+        mock_jwt_header.return_value = {"kid": "test-kid"}
+        assert auth_service.get_user_from_token("Bearer some-token") is None
+        assert auth_service.get_user_from_token("Bearer some-token") is None
+        # both requests went to Auth0 for the keys (1 call + 2 retries each)
+        assert mock_requests_get.call_count == 6
+        assert auth_service.token_cache.stats()['negative_hits'] == 0
+    
+    # a user built while /userinfo was failing has no name, it should be refetched soon, not kept until exp
+    @patch('auth_service.requests.Session.get')
+    def test_get_user_from_token_partial_user_cached_briefly(self, mock_requests_get, auth_service):
+        import time
+        mock_payload = {"sub": "auth0|123", "email": "test@example.com", "exp": time.time() + 3600}
+        mock_userinfo_response = Mock()
+        mock_userinfo_response.status_code = 503
+        mock_userinfo_response.text = "unavailable"
+        mock_userinfo_response.headers = {}
+        mock_requests_get.return_value = mock_userinfo_response
+        
+        with patch.object(auth_service, 'verify_token', return_value=mock_payload), patch('auth_service.time.sleep'):
+            user = auth_service.get_user_from_token("Bearer valid-token")
+        
+        assert user['email'] == "test@example.com"
+        assert user['name'] == []
+        _, expires_at = auth_service.token_cache._entries[auth_service.token_cache.digest("valid-token")]
+        assert expires_at <= time.time() + 30
+    
+    def test_token_cache_is_bounded(self):
+        """Test that the token cache evicts the least recently used entry"""
+        import time
+        from auth_service import TokenCache
+        cache = TokenCache(max_entries=2)
+        exp = time.time() + 3600
+        cache.put("a", {"email": "a@example.com"}, exp)
+        cache.put("b", {"email": "b@example.com"}, exp)
+        cache.get("a")  # a is now most recently used
+        cache.put("c", {"email": "c@example.com"}, exp)
+        
+        assert cache.get("b") == (False, None)
+        assert cache.get("a")[1]['email'] == "a@example.com"
+        assert cache.stats()['evictions'] == 1
+    
+    # 429/5xx from Auth0 should be retried (quickly, with jitter) and show up in the latency metrics
+    @patch('auth_service.time.sleep')
+    @patch('auth_service.requests.Session.get')
+    def test_http_client_retries_and_records_latency(self, mock_session_get, mock_sleep):
+        """Test the pooled Auth0 client retry loop and metrics"""
+        from auth_service import Auth0HTTPClient
+        rate_limited = Mock(status_code=429, ok=False, headers={'Retry-After': '1'})
+        success = Mock(status_code=200, ok=True, headers={})
+        mock_session_get.side_effect = [rate_limited, success]
+        client = Auth0HTTPClient(connect_timeout=1, read_timeout=2, max_retries=2)
+        
+        response = client.get('userinfo', "https://test.auth0.com/userinfo")
+        
+        assert response is success
+        assert mock_session_get.call_args.kwargs['timeout'] == (1, 2)
+        mock_sleep.assert_called_once_with(1.0)
+        stats = client.stats()['userinfo']
+        assert stats['calls'] == 2
+        assert stats['retries'] == 1
+        assert stats['errors'] == 1
+    
+    @patch('auth_service.time.sleep')
+    @patch('auth_service.requests.Session.get')
+    def test_http_client_gives_up_after_max_retries(self, mock_session_get, mock_sleep):
+        """Test that connection errors are retried a bounded number of times"""
+        from auth_service import Auth0HTTPClient
+        mock_session_get.side_effect = requests.exceptions.ConnectionError("down")
+        client = Auth0HTTPClient(max_retries=2, backoff_base=0.1, max_backoff=0.5)
+        
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get('jwks', "https://test.auth0.com/.well-known/jwks.json")
+        
+        assert mock_session_get.call_count == 3
+        assert all(call.args[0] <= 0.5 for call in mock_sleep.call_args_list)
+        assert client.stats()['jwks']['errors'] == 3
+
+class TestJWKSCache:
+    """Test the signing key cache on its own"""
+
+    def run_lookups(self, cache, count):
+        results = []
+        def lookup():
+            try:
+                results.append(cache.get_key("test-kid"))
+            except Exception as e:
+                results.append(e)
+        threads = [threading.Thread(target=lookup) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    # a cold cache hit by a burst of requests should download the JWKS once, not once per request
+    def test_concurrent_misses_fetch_once(self):
+        release = threading.Event()
+        fetch = Mock(side_effect=lambda: release.wait(2) and {"keys": [{"kid": "test-kid", "kty": "RSA", "use": "sig", "n": "n", "e": "e"}]})
+        cache = JWKSCache(fetch)
+        
+        threads, results = self.run_lookups(cache, 8)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert fetch.call_count == 1
+        assert [key['kid'] for key in results] == ["test-kid"] * 8
+        assert cache.stats()['misses'] == 8
+
+    # the threads that waited get the fetch's error too, not a None that looks like a bad kid
+    def test_waiters_see_fetch_error(self):
+        release = threading.Event()
+        def failing_fetch():
+            release.wait(2)
+            raise requests.ConnectionError("Auth0 is down")
+        cache = JWKSCache(Mock(side_effect=failing_fetch))
+        
+        threads, results = self.run_lookups(cache, 4)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert len(results) == 4
+        assert all(isinstance(result, requests.ConnectionError) for result in results)
@@ -5,6 +5,7 @@ Tests database operations: create_user, create_conversation, get_conversation, u
 """
 import pytest
 import json
+import sqlite3
 from database import Database
 
 class TestDatabase:
@@ -196,6 +197,196 @@ class TestDatabase:
         summaries = test_db.get_user_conversation_summaries(sample_user_email, limit=2, offset=2)
         assert len(summaries) == 2
     
+    def test_get_user_conversation_page_walks_every_conversation(self, test_db, sample_user_email):
+        """Test that following next_cursor visits each conversation once, newest first"""
+        test_db.create_user(sample_user_email)
+        test_db.create_user("other@example.com")
+        # created in the same second, so the cursor has to break updated_at ties by conversation_id
+        for i in range(7):
+            test_db.create_conversation(sample_user_email, f"conv-{i}")
+        test_db.create_conversation("other@example.com", "not-mine")
+        
+        seen = []
+        cursor = None
+        while True:
+            page = test_db.get_user_conversation_page(sample_user_email, 3, cursor=cursor)
+            assert len(page['conversations']) <= 3
+            seen.extend(c['conversation_id'] for c in page['conversations'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        assert sorted(seen) == [f"conv-{i}" for i in range(7)]
+        assert len(seen) == len(set(seen))
+        keys = [(c['updated_at'], c['conversation_id']) for c in test_db.get_user_conversation_page(sample_user_email, 10)['conversations']]
+        assert keys == sorted(keys, reverse=True)
+    
+    # rows from before updated_at was always set page by created_at instead of vanishing from the list
+    def test_get_user_conversation_page_null_updated_at(self, test_db, sample_user_email):
+        test_db.create_user(sample_user_email)
+        for i in range(5):
+            test_db.create_conversation(sample_user_email, f"conv-{i}")
+        conn = test_db._get_connection()
+        try:
+            conn.execute("UPDATE conversations SET updated_at = NULL, created_at = '2020-01-01 00:00:00' WHERE conversation_id IN ('conv-1', 'conv-3')")
+            conn.commit()
+        finally:
+            conn.close()
+        
+        seen = []
+        cursor = None
+        while True:
+            page = test_db.get_user_conversation_page(sample_user_email, 1, cursor=cursor)
+            seen.extend(c['conversation_id'] for c in page['conversations'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        # the old ones sort last, and every conversation shows up exactly once
+        assert seen == ["conv-4", "conv-2", "conv-0", "conv-3", "conv-1"]
+    
+    def test_get_user_conversation_page_last_page(self, test_db, sample_user_email):
+        """Test that an exactly full last page has no next_cursor"""
+        test_db.create_user(sample_user_email)
+        for i in range(3):
+            test_db.create_conversation(sample_user_email, f"conv-{i}")
+        assert test_db.get_user_conversation_page(sample_user_email, 3)['next_cursor'] is None
+        assert test_db.get_user_conversation_page(sample_user_email, 2)['next_cursor'] is not None
+    
+    def test_get_user_conversation_page_bad_cursor(self, test_db, sample_user_email):
+        """Test that a cursor we didn't make is rejected"""
+        with pytest.raises(ValueError):
+            test_db.get_user_conversation_page(sample_user_email, 3, cursor="not-a-cursor")
+    
+    def test_conversation_page_uses_composite_index(self, test_db):
+        """Test that pages come off idx_conversations_user_activity without a sort step"""
+        conn = test_db._get_connection()
+        try:
+            for query, params in (('conversation_summaries_first', ("a@example.com", 4)),
+                                  ('conversation_summaries_after', ("a@example.com", "2024-01-01 00:00:00", "conv", 4))):
+                plan = " ".join(str(row[-1]) for row in conn.execute("EXPLAIN QUERY PLAN " + test_db._queries[query], params))
+                assert "idx_conversations_user_activity" in plan
+                assert "TEMP B-TREE" not in plan
+        finally:
+            test_db._close_connection(conn)
+    
+    def test_conversation_versions_move_with_every_change(self, test_db, sample_user_email):
+        """Test the version counters the ETags are built from"""
+        test_db.create_user(sample_user_email)
+        assert test_db.get_conversations_version(sample_user_email) == 0
+        
+        test_db.create_conversation(sample_user_email, "conv-1")
+        v1 = test_db.get_conversation_version("conv-1", sample_user_email)
+        assert test_db.get_conversations_version(sample_user_email) == v1
+        
+        test_db.save_conversation_turn("conv-1", sample_user_email, [{"role": "user", "content": "Hi"}], 6.0, [6.0])
+        v2 = test_db.get_conversation_version("conv-1", sample_user_email)
+        assert v2 > v1
+        assert test_db.get_conversation("conv-1")['version'] == v2
+        
+        test_db.create_conversation(sample_user_email, "conv-2")
+        # the list moved, conv-1 didn't
+        assert test_db.get_conversations_version(sample_user_email) > v2
+        assert test_db.get_conversation_version("conv-1", sample_user_email) == v2
+        
+        before_delete = test_db.get_conversations_version(sample_user_email)
+        test_db.delete_conversation("conv-2", sample_user_email)
+        assert test_db.get_conversations_version(sample_user_email) > before_delete
+        
+        # someone else's conversation has no version for this user
+        assert test_db.get_conversation_version("conv-1", "other@example.com") is None
+    
+    def test_recreated_conversation_gets_a_new_version(self, test_db, sample_user_email):
+        """Test that deleting and recreating a conversation id can't bring back an old ETag"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, "conv-1")
+        old_version = test_db.get_conversation_version("conv-1", sample_user_email)
+        test_db.delete_conversation("conv-1", sample_user_email)
+        test_db.begin_conversation_turn("conv-1", sample_user_email)
+        assert test_db.get_conversation_version("conv-1", sample_user_email) > old_version
+    
+    def test_conversation_changes(self, test_db, sample_user_email):
+        """Test the sidebar delta sync - upserts and tombstones since a version"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, "conv-1")
+        test_db.create_conversation(sample_user_email, "conv-2")
+        test_db.create_conversation("other@example.com", "not-mine")
+        since = test_db.get_conversations_version(sample_user_email)
+        
+        assert test_db.get_conversation_changes(sample_user_email, since, 50) == {'version': since, 'upserted': [], 'deleted': [], 'reset': False}
+        
+        test_db.save_conversation_turn("conv-1", sample_user_email, [{"role": "user", "content": "Hi"}], 6.0, [6.0], title="Hello")
+        test_db.delete_conversation("conv-2", sample_user_email)
+        changes = test_db.get_conversation_changes(sample_user_email, since, 50)
+        assert changes['version'] == test_db.get_conversations_version(sample_user_email)
+        assert [c['conversation_id'] for c in changes['upserted']] == ["conv-1"]
+        assert changes['upserted'][0]['title'] == "Hello"
+        assert changes['upserted'][0]['message_count'] == 1
+        assert changes['deleted'] == ["conv-2"]
+        assert changes['reset'] is False
+        
+        # from scratch the deleted one is only a tombstone
+        changes = test_db.get_conversation_changes(sample_user_email, 0, 50)
+        assert [c['conversation_id'] for c in changes['upserted']] == ["conv-1"]
+        assert changes['deleted'] == ["conv-2"]
+    
+    def test_conversation_changes_recreated_id(self, test_db, sample_user_email):
+        """Test that recreating a deleted conversation id removes its tombstone"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, "conv-1")
+        test_db.delete_conversation("conv-1", sample_user_email)
+        test_db.begin_conversation_turn("conv-1", sample_user_email)
+        changes = test_db.get_conversation_changes(sample_user_email, 0, 50)
+        assert [c['conversation_id'] for c in changes['upserted']] == ["conv-1"]
+        assert changes['deleted'] == []
+    
+    def test_conversation_changes_reset(self, test_db, sample_user_email):
+        """Test that too many changes or a version from the future ask for a reload"""
+        test_db.create_user(sample_user_email)
+        for i in range(4):
+            test_db.create_conversation(sample_user_email, f"conv-{i}")
+        assert test_db.get_conversation_changes(sample_user_email, 0, 3)['reset'] is True
+        assert test_db.get_conversation_changes(sample_user_email, 0, 4)['reset'] is False
+        assert test_db.get_conversation_changes(sample_user_email, 1000, 50)['reset'] is True
+        
+        # the limit covers deletes too
+        since = test_db.get_conversations_version(sample_user_email)
+        for i in range(4):
+            test_db.delete_conversation(f"conv-{i}", sample_user_email)
+        assert test_db.get_conversation_changes(sample_user_email, since, 3)['reset'] is True
+        assert test_db.get_conversation_changes(sample_user_email, since, 4)['deleted'] == [f"conv-{i}" for i in range(4)]
+    
+    def test_old_tombstones_are_pruned(self, test_db, sample_user_email):
+        """Test that tombstones past the retention window go away and a client from before them gets a reset"""
+        test_db.create_user(sample_user_email)
+        for i in range(3):
+            test_db.create_conversation(sample_user_email, f"conv-{i}")
+        before_old_delete = test_db.get_conversations_version(sample_user_email)
+        test_db.delete_conversation("conv-0", sample_user_email)
+        
+        # age the tombstone past the window
+        conn = test_db._get_connection()
+        try:
+            conn.execute("UPDATE conversation_tombstones SET deleted_at = '2000-01-01 00:00:00'")
+            conn.commit()
+        finally:
+            conn.close()
+        after_old_delete = test_db.get_conversations_version(sample_user_email)
+        
+        # the next delete prunes it
+        test_db.delete_conversation("conv-1", sample_user_email)
+        conn = test_db._get_connection()
+        try:
+            remaining = [row[0] for row in conn.execute("SELECT conversation_id FROM conversation_tombstones")]
+        finally:
+            conn.close()
+        assert remaining == ["conv-1"]
+        
+        assert test_db.get_conversation_changes(sample_user_email, before_old_delete, 50)['reset'] is True
+        changes = test_db.get_conversation_changes(sample_user_email, after_old_delete, 50)
+        assert changes['reset'] is False
+        assert changes['deleted'] == ["conv-1"]
+    
     # also if I decided to paginate the messages in the chat window, this would be useful
     def test_get_conversation_with_limit_messages(self, test_db, sample_user_email, sample_conversation_id):
         """Test getting conversation with message limit"""
@@ -290,3 +481,211 @@ class TestDatabase:
         conv = next(s for s in summaries if s['conversation_id'] == sample_conversation_id)
         assert conv['message_count'] == 3
 
+
+    # a new turn should append rows, not rewrite the ones already there
+    def test_update_conversation_appends_messages(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test that update_conversation only inserts messages that aren't stored yet"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        test_db.update_conversation(sample_conversation_id, sample_messages, 7.5, [7.5], "Feedback")
+        
+        # The stored copy of an earlier message isn't touched even if the caller's copy differs
+        # (e.g. the streamed reply path still has base64 attachment data in memory)
+        changed = [dict(sample_messages[0], content="changed"), sample_messages[1]]
+        new_message = {"role": "user", "content": "Follow up", "timestamp": "2024-01-01T00:00:02",
+                       "attachments": [{"filename": "a.pdf", "file_type": "application/pdf"}]}
+        test_db.update_conversation(sample_conversation_id, changed + [new_message], 7.5, [7.5, 8.0], "Feedback")
+        
+        conversation = test_db.get_conversation(sample_conversation_id)
+        assert [m['content'] for m in conversation['messages']] == [sample_messages[0]['content'], sample_messages[1]['content'], "Follow up"]
+        assert conversation['messages'][2]['attachments'] == new_message['attachments']
+        assert conversation['messages'][0]['timestamp'] == sample_messages[0]['timestamp']
+        assert conversation['total_message_count'] == 3
+    
+    # a shorter list (e.g. loaded with limit_messages) must never delete stored messages
+    def test_update_conversation_never_truncates(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        test_db.update_conversation(sample_conversation_id, sample_messages, 7.5, [7.5], "Feedback")
+        test_db.update_conversation(sample_conversation_id, sample_messages[:1], 8.0, [8.0], "Feedback")
+        
+        conversation = test_db.get_conversation(sample_conversation_id)
+        assert conversation['messages'] == sample_messages
+        assert conversation['quality_score'] == 8.0
+        assert test_db.get_user_conversation_summaries(sample_user_email)[0]['message_count'] == 2
+    
+    # two turns saved from the same stale read both land, one after the other
+    def test_concurrent_turns_get_distinct_seqs(self, test_db, sample_user_email, sample_conversation_id):
+        test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        first = [{"role": "user", "content": "one"}, {"role": "assistant", "content": "1"}]
+        second = [{"role": "user", "content": "two"}, {"role": "assistant", "content": "2"}]
+        test_db.save_conversation_turn(sample_conversation_id, sample_user_email, first, 6.0, [6.0])
+        test_db.save_conversation_turn(sample_conversation_id, sample_user_email, second, 6.0, [6.0, 6.0])
+        
+        conversation = test_db.get_conversation(sample_conversation_id)
+        assert [m['content'] for m in conversation['messages']] == ["one", "1", "two", "2"]
+        assert test_db.get_user_conversation_summaries(sample_user_email)[0]['message_count'] == 4
+    
+    # a seq taken by someone else between our read and our insert is retried, not lost
+    def test_append_retries_seq_conflict(self, test_db, sample_user_email, sample_conversation_id):
+        test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        calls = []
+        
+        def work(cursor):
+            calls.append(1)
+            if len(calls) == 1:
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: messages.conversation_id, messages.seq")
+            return test_db._append_messages(cursor, sample_conversation_id, [{"role": "user", "content": "Hi"}])
+        
+        assert test_db._append_with_retry(work) == 1
+        assert len(calls) == 2
+    
+    # keys without a column of their own still come back (new writes and the legacy blob migration)
+    def test_extra_message_keys_are_kept(self, test_db, sample_user_email, sample_conversation_id):
+        test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        message = {"role": "user", "content": "Hi", "timestamp": "2024-01-01T00:00:00", "id": "m-1", "edited": True, "scores": {"clarity": 3}}
+        test_db.save_conversation_turn(sample_conversation_id, sample_user_email, [message], 6.0, [6.0])
+        assert test_db.get_conversation(sample_conversation_id)['messages'] == [message]
+        
+        conn = test_db._get_connection()
+        try:
+            conn.execute("INSERT INTO conversations (conversation_id, user_email, messages) VALUES (?, ?, ?)",
+                         ("legacy-conv", sample_user_email, json.dumps([message, {"role": "assistant", "content": "Hello", "model": "gpt-4o"}])))
+            conn.commit()
+        finally:
+            conn.close()
+        test_db.init_database()
+        assert test_db.get_conversation("legacy-conv")['messages'] == [message, {"role": "assistant", "content": "Hello", "model": "gpt-4o"}]
+    
+    def test_legacy_messages_blob_is_backfilled(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test that conversations stored as a JSON blob are moved into the messages table on startup"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        
+        # simulate a row written before the messages table existed
+        conn = test_db._get_connection()
+        try:
+            conn.execute("UPDATE conversations SET messages = ? WHERE conversation_id = ?", (json.dumps(sample_messages), sample_conversation_id))
+            conn.commit()
+        finally:
+            conn.close()
+        
+        # init_database runs the migration (and running it twice must not duplicate rows)
+        test_db.init_database()
+        test_db.init_database()
+        
+        conversation = test_db.get_conversation(sample_conversation_id)
+        assert conversation['messages'] == sample_messages
+        summary = test_db.get_user_conversation_summaries(sample_user_email)[0]
+        assert summary['message_count'] == 2
+    
+    def test_pdf_text_moves_out_of_attachments(self, test_db, sample_user_email, sample_conversation_id):
+        """Test the pdf_texts backfill - stored attachments keep the hash, the text moves to the side table"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        # written the way send_message used to store PDFs
+        legacy = [{"role": "user", "content": "Summarize", "attachments": [
+            {"filename": "notes.pdf", "file_type": "application/pdf", "content_sha256": "abc123", "extracted_text": "Lecture notes " * 1000}
+        ]}]
+        test_db.update_conversation(sample_conversation_id, legacy, 7.5, [7.5], "Feedback")
+        
+        test_db.init_database()
+        test_db.init_database()
+        
+        attachment = test_db.get_conversation(sample_conversation_id)['messages'][0]['attachments'][0]
+        assert attachment == {"filename": "notes.pdf", "file_type": "application/pdf", "content_sha256": "abc123"}
+        assert test_db.get_pdf_text("abc123") == "Lecture notes " * 1000
+    
+    def test_pdf_text_first_write_wins(self, test_db):
+        """Test saving and reading extracted PDF text by hash"""
+        assert test_db.get_pdf_text("abc123") is None
+        test_db.save_pdf_text("abc123", "First")
+        test_db.save_pdf_text("abc123", "Second")
+        assert test_db.get_pdf_text("abc123") == "First"
+    
+    def test_delete_conversation_removes_messages(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test that deleting a conversation also deletes its message rows"""
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        test_db.update_conversation(sample_conversation_id, sample_messages, 7.5, [7.5], "Feedback")
+        test_db.delete_conversation(sample_conversation_id, sample_user_email)
+        
+        # re-creating the id starts from an empty conversation
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        assert test_db.get_conversation(sample_conversation_id)['messages'] == []
+    
+    # the schema is probed once at startup, not on every query
+    def test_schema_capabilities_resolved_once(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test that the capability registry drives the precomputed SQL"""
+        assert test_db.capabilities['has_message_count'] is True
+        assert 'message_count' in test_db._queries['conversation_summaries']
+        
+        # pretend the column isn't there - summaries fall back to counting message rows
+        test_db.capabilities['has_message_count'] = False
+        test_db._build_queries()
+        test_db.create_user(sample_user_email)
+        test_db.create_conversation(sample_user_email, sample_conversation_id)
+        test_db.update_conversation(sample_conversation_id, sample_messages, 7.5, [7.5], "Feedback", title="Title")
+        summary = test_db.get_user_conversation_summaries(sample_user_email)[0]
+        assert summary['message_count'] == 2
+        assert summary['title'] == "Title"
+        
+        # an explicit refresh picks the real schema back up
+        test_db.refresh_schema()
+        assert test_db.capabilities['has_message_count'] is True
+    
+    # send_message's turn: create-if-missing + ownership check up front, then one write with the results
+    def test_conversation_turn(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test begin/save of a conversation turn"""
+        conversation = test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        assert conversation['created'] is True
+        assert conversation['messages'] == []
+        # the user row is created in the same transaction
+        assert test_db.get_user_by_email(sample_user_email) is not None
+        
+        title = test_db.save_conversation_turn(sample_conversation_id, sample_user_email, sample_messages[:1], 6.0, [6.0], "Feedback", title="First Title")
+        assert title == "First Title"
+        
+        conversation = test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        assert conversation['created'] is False
+        assert len(conversation['messages']) == 1
+        
+        # a title is only set once, the stored one comes back
+        title = test_db.save_conversation_turn(sample_conversation_id, sample_user_email, sample_messages[1:], 7.0, [6.0, 7.0], "More feedback", title="Other Title")
+        assert title == "First Title"
+        stored = test_db.get_conversation(sample_conversation_id)
+        assert [m['content'] for m in stored['messages']] == [m['content'] for m in sample_messages]
+        assert stored['message_scores'] == [6.0, 7.0]
+        assert test_db.get_user_conversation_summaries(sample_user_email)[0]['message_count'] == 2
+    
+    def test_conversation_turn_other_user(self, test_db, sample_user_email, sample_conversation_id, sample_messages):
+        """Test that another user's conversation can't be loaded or written through a turn"""
+        test_db.begin_conversation_turn(sample_conversation_id, sample_user_email)
+        assert test_db.begin_conversation_turn(sample_conversation_id, "someone@else.com") is None
+        with pytest.raises(ValueError):
+            test_db.save_conversation_turn(sample_conversation_id, "someone@else.com", sample_messages[:1], 5.0)
+        # and the rejected write was rolled back
+        assert test_db.get_conversation(sample_conversation_id)['messages'] == []
+    
+    # the same thread keeps using one connection instead of reconnecting for every query
+    def test_sqlite_connections_are_reused(self, test_db, sample_user_email):
+        """Test that queries reuse the pooled connection and nothing stays checked out"""
+        before = test_db.pool_stats()
+        for _ in range(20):
+            test_db.create_user(sample_user_email)
+            test_db.get_user_by_email(sample_user_email)
+        after = test_db.pool_stats()
+        assert after['opened'] == before['opened']
+        assert after['checked_out'] == 0
+    
+    # what the user cache's flusher calls - one statement for the whole batch
+    def test_update_user_logins_batch(self, test_db):
+        """Test writing several last_login stamps at once"""
+        for email in ["a@example.com", "b@example.com", "c@example.com"]:
+            test_db.create_user(email)
+        written = test_db.update_user_logins({"a@example.com": "2030-01-01 10:00:00", "b@example.com": "2030-01-02 11:00:00", "missing@example.com": "2030-01-03 12:00:00"})
+        assert written == 3
+        assert test_db.get_user_by_email("a@example.com")['last_login'] == "2030-01-01 10:00:00"
+        assert test_db.get_user_by_email("b@example.com")['last_login'] == "2030-01-02 11:00:00"
+        assert test_db.get_user_by_email("c@example.com")['last_login'] != "2030-01-03 12:00:00"
+        assert test_db.get_user_by_email("missing@example.com") is None
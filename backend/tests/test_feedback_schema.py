@@ -0,0 +1,54 @@
+"""
+Unit tests for feedback_schema.py
+Tests validation of the feedback model's structured reply and the usage counters
+"""
+import pytest
+from unittest.mock import MagicMock
+from feedback_schema import FeedbackResult, FeedbackParseError, FeedbackUsage, GENERIC_TIPS, label_for_score
+
+class TestFeedbackResult:
+    """Test parsing and validating the feedback reply"""
+
+    def test_valid_reply(self):
+        result = FeedbackResult.from_json('{"score": 7.46, "quality_label": "Good", "improvement_tips": ["a", "b", "c"], "example_improved_prompt": "x"}')
+        assert result.score == 7.5
+        assert result.to_feedback() == {'quality_label': 'Good', 'improvement_tips': ['a', 'b', 'c'], 'example_improved_prompt': 'x'}
+
+    # the old dict repair (pad/trim tips, cap the score) now lives in the validation
+    def test_repairs_out_of_range_fields(self):
+        result = FeedbackResult.from_dict({"score": 14, "quality_label": "Amazing", "improvement_tips": ["a", "", 3, "b", "c", "d"]})
+        assert result.score == 10.0
+        assert result.quality_label == 'Excellent'
+        assert result.improvement_tips == ['a', 'b', 'c']
+        assert result.example_improved_prompt == 'No example available'
+
+        short = FeedbackResult.from_dict({"score": 3, "improvement_tips": "not a list"})
+        assert short.improvement_tips == GENERIC_TIPS
+        assert short.quality_label == 'Poor'
+
+    @pytest.mark.parametrize("text", ["", "Invalid JSON response", "[1, 2]", '{"quality_label": "Good"}', '{"score": "high"}'])
+    def test_rejects_unusable_replies(self, text):
+        with pytest.raises(FeedbackParseError):
+            FeedbackResult.from_json(text)
+
+    def test_label_bands(self):
+        assert [label_for_score(s) for s in (1, 4.1, 6.5, 9)] == ['Poor', 'Fair', 'Good', 'Excellent']
+
+class TestFeedbackUsage:
+    """Test the per call token and parse failure counters"""
+
+    def test_records_usage(self):
+        usage = FeedbackUsage()
+        response = MagicMock()
+        response.usage.prompt_tokens = 1000
+        response.usage.completion_tokens = 100
+        usage.record(response, 1.5, parsed=True)
+        # no usage block (or a mocked one) counts as zero tokens
+        usage.record(MagicMock(), 0.5, parsed=False)
+
+        stats = usage.stats()
+        assert stats['calls'] == 2
+        assert stats['avg_prompt_tokens'] == 500.0
+        assert stats['parse_failure_rate'] == 0.5
+        assert stats['avg_seconds'] == 1.0
+        assert stats['last_call']['parsed'] is False
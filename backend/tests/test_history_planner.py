@@ -0,0 +1,72 @@
+"""
+Unit tests for history_planner.py
+Tests the token estimate, the budget split and the rolling summary
+"""
+from history_planner import HistoryPlanner, estimate_tokens, estimate_message_tokens, IMAGE_TOKENS
+
+def make_conversation(turns, words=50):
+    """Alternating user/assistant messages with some bulk to them"""
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i} about sorting. " + "detail " * words})
+        messages.append({"role": "assistant", "content": f"Answer {i} explains merge sort. " + "more " * words})
+    return messages
+
+class TestEstimateTokens:
+    """Test the offline token estimate"""
+
+    def test_text(self):
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("abcd") == 1
+        assert estimate_tokens("abcde") == 2
+
+    def test_vision_content(self):
+        content = [{"type": "text", "text": "abcd" * 10}, {"type": "image_url", "image_url": {"url": "data:..."}}]
+        assert estimate_tokens(content) == 10 + IMAGE_TOKENS
+
+class TestHistoryPlanner:
+    """Test windowing and summaries"""
+
+    def test_under_budget_is_untouched(self):
+        planner = HistoryPlanner(summary_budget_tokens=100)
+        messages = make_conversation(2, words=5)
+        summary, recent = planner.plan(messages, budget_tokens=10_000)
+        assert summary is None
+        assert recent == messages
+
+    def test_over_budget_keeps_latest_turns(self):
+        planner = HistoryPlanner(summary_budget_tokens=200)
+        messages = make_conversation(20)
+        budget = 1000
+        summary, recent = planner.plan(messages, budget_tokens=budget)
+        
+        assert recent[-1] is messages[-1]
+        assert recent == messages[-len(recent):]
+        assert sum(estimate_message_tokens(msg) for msg in recent) <= budget - 200
+        # the summary starts where the verbatim messages stop
+        assert "Question 0 about sorting." in summary or "not shown" in summary
+        assert estimate_tokens(summary) <= 200 + 10
+        assert planner.stats()['trimmed_calls'] == 1
+
+    # the latest message goes in even if it's over the budget on its own
+    def test_latest_message_always_kept(self):
+        planner = HistoryPlanner(summary_budget_tokens=50)
+        messages = make_conversation(3) + [{"role": "user", "content": "x" * 10_000}]
+        summary, recent = planner.plan(messages, budget_tokens=100)
+        assert recent == [messages[-1]]
+        assert summary
+
+    # the summary for turn N reuses the lines computed for turn N-1
+    def test_summary_lines_are_cached(self):
+        planner = HistoryPlanner(summary_budget_tokens=2000)
+        messages = make_conversation(20)
+        planner.plan(messages, budget_tokens=2500)
+        misses = planner.line_misses
+        planner.plan(messages + make_conversation(1), budget_tokens=2500)
+        assert planner.line_misses - misses <= 2
+        assert planner.stats()['summary_line_hit_rate'] > 0
+
+    def test_summary_line_is_first_sentence(self):
+        planner = HistoryPlanner(summary_budget_tokens=100)
+        line = planner._summary_line({"role": "assistant", "content": "Merge sort is stable. It also runs in n log n."})
+        assert line == "- Assistant: Merge sort is stable."
@@ -0,0 +1,153 @@
+"""
+Unit tests for openai_transport.py
+Tests the retry policy, per call type timeouts and the circuit breaker with a mocked OpenAI client
+"""
+import asyncio
+import httpx
+import openai
+import pytest
+from unittest.mock import MagicMock, patch
+from openai_transport import OpenAITransport, CircuitBreaker, CircuitOpenError
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+def rate_limit_error(retry_after="0.25"):
+    response = httpx.Response(429, request=REQUEST, headers={"retry-after": retry_after})
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+def server_error():
+    return openai.InternalServerError("bad gateway", response=httpx.Response(502, request=REQUEST), body=None)
+
+def make_transport(**kwargs):
+    timeouts = {'feedback': 30, 'title': 5, 'chat': 90, 'stream': 20}
+    return OpenAITransport(timeouts, **kwargs)
+
+class TestOpenAITransport:
+    """Test retries and timeouts"""
+
+    @patch('openai_transport.time.sleep')
+    def test_retry_honors_retry_after(self, mock_sleep):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = [rate_limit_error("0.25"), "ok"]
+        transport = make_transport(max_retries=2)
+        
+        assert transport.create(client, 'feedback', model="gpt-4o") == "ok"
+        mock_sleep.assert_called_once_with(0.25)
+        stats = transport.stats()['calls']['feedback']
+        assert stats['calls'] == 1
+        assert stats['retries'] == 1
+        # 429 is a rate limit, not an outage
+        assert transport.breaker.consecutive_failures == 0
+
+    def test_timeout_per_call_type(self):
+        client = MagicMock()
+        transport = make_transport()
+        transport.create(client, 'title', model="gpt-4o")
+        assert client.chat.completions.create.call_args.kwargs['timeout'].read == 5
+        transport.create(client, 'stream', model="gpt-4o", stream=True)
+        assert client.chat.completions.create.call_args.kwargs['timeout'].read == 20
+
+    # with a deadline, a timed out first attempt still leaves room for a retry that finishes in time
+    def test_retry_fits_in_deadline(self):
+        import time
+        attempt_timeouts = []
+        def create(timeout, **kwargs):
+            attempt_timeouts.append(timeout.read)
+            if len(attempt_timeouts) == 1:
+                time.sleep(timeout.read)
+                raise openai.APITimeoutError(request=REQUEST)
+            return "ok"
+        client = MagicMock()
+        client.chat.completions.create.side_effect = create
+        transport = OpenAITransport({'feedback': 0.2}, max_retries=2, backoff_base=0.01, deadlines={'feedback': 0.6}, min_attempt_seconds=0.1)
+        
+        started = time.monotonic()
+        assert transport.create(client, 'feedback', model="gpt-4o") == "ok"
+        assert time.monotonic() - started < 0.6
+        assert attempt_timeouts[0] == 0.2
+        assert transport.stats()['calls']['feedback']['retries'] == 1
+
+    # the first attempt gets the whole budget (up to its own timeout), not a third of it saved for retries
+    def test_first_attempt_gets_whole_budget(self):
+        client = MagicMock()
+        transport = OpenAITransport({'title': 5}, max_retries=2, deadlines={'title': 5})
+        transport.create(client, 'title', model="gpt-4o")
+        assert client.chat.completions.create.call_args.kwargs['timeout'].read > 4.9
+
+    # a retry that would only have a sliver of the deadline left isn't made
+    def test_no_retry_without_time_left(self):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = openai.APITimeoutError(request=REQUEST)
+        transport = OpenAITransport({'title': 5}, max_retries=2, backoff_base=0.01, deadlines={'title': 0.5}, min_attempt_seconds=1.0)
+        
+        with pytest.raises(openai.APITimeoutError):
+            transport.create(client, 'title', model="gpt-4o")
+        assert client.chat.completions.create.call_count == 1
+        assert transport.stats()['calls']['title']['retries'] == 0
+
+    # a bad request won't get better by sending it again
+    def test_non_retryable_error_raised_immediately(self):
+        client = MagicMock()
+        error = openai.BadRequestError("bad", response=httpx.Response(400, request=REQUEST), body=None)
+        client.chat.completions.create.side_effect = error
+        transport = make_transport(max_retries=2)
+        
+        with pytest.raises(openai.BadRequestError):
+            transport.create(client, 'chat', model="gpt-4o")
+        assert client.chat.completions.create.call_count == 1
+        assert transport.stats()['calls']['chat']['failures'] == 1
+
+    @patch('openai_transport.time.sleep')
+    def test_gives_up_after_max_retries(self, mock_sleep):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = openai.APITimeoutError(request=REQUEST)
+        transport = make_transport(max_retries=2, breaker=CircuitBreaker(failure_threshold=10))
+        
+        with pytest.raises(openai.APITimeoutError):
+            transport.create(client, 'chat', model="gpt-4o")
+        assert client.chat.completions.create.call_count == 3
+        assert transport.stats()['calls']['chat']['timeouts'] == 3
+
+    def test_async_create_retries(self):
+        calls = []
+        async def create(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise server_error()
+            return "ok"
+        client = MagicMock()
+        client.chat.completions.create = create
+        transport = make_transport(max_retries=1, backoff_base=0.01)
+        
+        assert asyncio.run(transport.acreate(client, 'stream', model="gpt-4o", stream=True)) == "ok"
+        assert len(calls) == 2
+
+class TestCircuitBreaker:
+    """Test that a failing upstream trips the breaker"""
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = server_error()
+        transport = make_transport(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60))
+        
+        for _ in range(2):
+            with pytest.raises(openai.InternalServerError):
+                transport.create(client, 'chat', model="gpt-4o")
+        with pytest.raises(CircuitOpenError):
+            transport.create(client, 'chat', model="gpt-4o")
+        
+        assert client.chat.completions.create.call_count == 2
+        assert transport.breaker.stats()['state'] == 'open'
+        assert transport.breaker.stats()['rejected'] == 1
+
+    def test_half_open_trial_closes_on_success(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        assert breaker.state == 'open'
+        breaker.before_call()
+        assert breaker.state == 'half_open'
+        # only one trial call at a time
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == 'closed'
@@ -0,0 +1,128 @@
+"""
+Unit tests for pdf_extraction.py
+Tests the page/character/time limits and the process pool (with real, tiny generated PDFs)
+"""
+import base64
+import threading
+import time
+from concurrent.futures import Future
+import pytest
+import pdf_extraction
+from pdf_extraction import PDFExtractor, extract_pdf_pages, format_extraction, is_cacheable
+
+def make_pdf(pages):
+    """Build a minimal PDF with one line of text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + i * 2} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + len(pages) * 2
+    for i, text in enumerate(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + i * 2} 0 R /Resources << /Font << /F1 {font_id} 0 R >> >> >>")
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode()
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode()
+    return out
+
+class TestExtractPdfPages:
+    """Test the limits applied while walking the pages"""
+
+    def test_extracts_all_pages(self):
+        result = extract_pdf_pages(make_pdf(["Hello one", "Second page"]), max_pages=10, max_chars=10_000, time_budget=10)
+        assert "Hello one" in result['text']
+        assert "--- Page 2 ---" in result['text']
+        assert result['stopped'] is None
+        assert format_extraction(result) == result['text']
+
+    def test_page_limit_keeps_partial_text(self):
+        result = extract_pdf_pages(make_pdf(["One", "Two", "Three"]), max_pages=2, max_chars=10_000, time_budget=10)
+        assert result['pages_extracted'] == 2
+        assert "Three" not in result['text']
+        assert "Only pages 1-2 of 3 were extracted (page limit)" in format_extraction(result)
+
+    def test_character_budget(self):
+        result = extract_pdf_pages(make_pdf(["A" * 50, "B" * 50]), max_pages=10, max_chars=40, time_budget=10)
+        assert len(result['text']) == 40
+        assert result['stopped'] == 'character limit'
+
+    # a time-limited result could be longer next time, so it shouldn't be cached
+    def test_time_limit(self):
+        result = extract_pdf_pages(make_pdf(["One", "Two"]), max_pages=10, max_chars=10_000, time_budget=-1)
+        assert result['stopped'] == 'time limit'
+        assert not is_cacheable(format_extraction(result))
+
+class TestPDFExtractor:
+    """Test the process pool wrapper"""
+
+    def test_process_pool(self):
+        extractor = PDFExtractor(max_workers=1, timeout_seconds=30, max_pages=10, max_chars=10_000)
+        try:
+            result = extractor.extract(base64.b64encode(make_pdf(["From the pool"])).decode('utf-8'))
+            assert "From the pool" in result['text']
+            assert extractor.stats()['completed'] == 1
+        finally:
+            extractor._recycle_pool()
+
+    # the pool works through a document a batch of pages at a time
+    def test_batches(self, monkeypatch):
+        monkeypatch.setattr(pdf_extraction, 'PAGES_PER_TASK', 1)
+        extractor = PDFExtractor(max_workers=1, timeout_seconds=30, max_pages=2, max_chars=10_000)
+        try:
+            result = extractor.extract(base64.b64encode(make_pdf(["One", "Two", "Three"])).decode('utf-8'))
+            assert "--- Page 1 ---\nOne" in result['text'] and "--- Page 2 ---\nTwo" in result['text']
+            assert "Three" not in result['text']
+            assert (result['pages_extracted'], result['total_pages'], result['stopped']) == (2, 3, 'page limit')
+        finally:
+            extractor._recycle_pool()
+
+    # a worker stuck on a page past the hard timeout still leaves the earlier batches' text
+    def test_hard_timeout_keeps_partial_text(self, monkeypatch):
+        monkeypatch.setattr(pdf_extraction, 'HARD_TIMEOUT_GRACE_SECONDS', 0)
+        extractor = PDFExtractor(max_workers=1, timeout_seconds=0.2, max_pages=100, max_chars=10_000)
+        first = Future()
+        first.set_result({'text': "--- Page 1 ---\nOne", 'pages_extracted': 10, 'total_pages': 30, 'stopped': 'page limit'})
+        batches = iter([first, Future()])
+        monkeypatch.setattr(extractor, '_submit', lambda *args: next(batches))
+        
+        result = extractor.extract(base64.b64encode(b"%PDF").decode('utf-8'))
+        
+        assert result['text'] == "--- Page 1 ---\nOne"
+        assert "Only pages 1-10 of 30 were extracted (time limit)" in format_extraction(result)
+        assert extractor.stats()['timeouts'] == 1
+
+    # a client that went away stops the document at the next batch, without waiting out the time budget
+    def test_cancel_keeps_partial_text(self, monkeypatch):
+        extractor = PDFExtractor(max_workers=1, timeout_seconds=30, max_pages=100, max_chars=10_000)
+        first = Future()
+        first.set_result({'text': "--- Page 1 ---\nOne", 'pages_extracted': 10, 'total_pages': 30, 'stopped': 'page limit'})
+        stuck = Future()
+        batches = iter([first, stuck])
+        monkeypatch.setattr(extractor, '_submit', lambda *args: next(batches))
+        cancel_event = threading.Event()
+        threading.Timer(0.2, cancel_event.set).start()
+        
+        started = time.monotonic()
+        result = extractor.extract(base64.b64encode(b"%PDF").decode('utf-8'), cancel_event=cancel_event)
+        
+        assert time.monotonic() - started < 2
+        assert result['text'] == "--- Page 1 ---\nOne"
+        assert (result['pages_extracted'], result['stopped']) == (10, 'cancelled')
+        assert stuck.cancelled()
+        assert not is_cacheable(format_extraction(result))
+        assert extractor.stats()['cancelled'] == 1
+
+    def test_invalid_pdf_counts_failure(self):
+        extractor = PDFExtractor(max_workers=0, timeout_seconds=30, max_pages=10, max_chars=10_000)
+        with pytest.raises(Exception):
+            extractor.extract(base64.b64encode(b"not a pdf").decode('utf-8'))
+        assert extractor.stats()['failures'] == 1
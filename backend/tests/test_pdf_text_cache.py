@@ -0,0 +1,75 @@
+"""
+Unit tests for pdf_text_cache.py
+Tests content hashing and the memory, disk and store tiers of the extracted PDF text cache
+"""
+import base64
+import hashlib
+from pdf_text_cache import PDFTextCache, pdf_content_hash
+
+class TestPDFContentHash:
+    """Test the content hash used as the cache key"""
+
+    def test_hash_is_of_decoded_bytes(self):
+        encoded = base64.b64encode(b"%PDF-1.4 fake").decode('utf-8')
+        assert pdf_content_hash(encoded) == hashlib.sha256(b"%PDF-1.4 fake").hexdigest()
+
+    def test_invalid_base64_still_hashes(self):
+        assert pdf_content_hash("not base64!!!") == hashlib.sha256(b"not base64!!!").hexdigest()
+
+class TestPDFTextCache:
+    """Test the two cache tiers"""
+
+    def test_memory_tier(self):
+        cache = PDFTextCache(max_chars=1000)
+        assert cache.get("abc") is None
+        cache.put("abc", "Page 1 text")
+        assert cache.get("abc") == "Page 1 text"
+        stats = cache.stats()
+        assert stats['memory_hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['disk'] is False
+
+    # over the character budget the least recently used document goes
+    def test_memory_tier_evicts_lru(self):
+        cache = PDFTextCache(max_chars=10)
+        cache.put("a", "12345")
+        cache.put("b", "12345")
+        cache.get("a")
+        cache.put("c", "12345")
+        assert cache.get("b") is None
+        assert cache.get("a") == "12345"
+        assert cache.stats()['evictions'] == 1
+
+    # a second cache on the same directory stands in for another worker (or a restart)
+    def test_disk_tier_shared(self, tmp_path):
+        PDFTextCache(max_chars=1000, directory=str(tmp_path)).put("abc", "Shared text")
+        other = PDFTextCache(max_chars=1000, directory=str(tmp_path))
+        assert other.get("abc") == "Shared text"
+        assert other.get("abc") == "Shared text"
+        stats = other.stats()
+        assert stats['disk_hits'] == 1
+        assert stats['memory_hits'] == 1
+
+    def test_store_tier(self):
+        stored = {}
+        cache = PDFTextCache(max_chars=1000)
+        cache.set_store(stored.get, stored.__setitem__)
+        cache.put("abc", "Stored text")
+        assert stored == {"abc": "Stored text"}
+        
+        # another worker (empty memory) finds it in the store
+        other = PDFTextCache(max_chars=1000)
+        other.set_store(stored.get, stored.__setitem__)
+        assert other.get("abc") == "Stored text"
+        assert other.get("abc") == "Stored text"
+        assert other.stats()['store_hits'] == 1
+        assert other.get("missing") is None
+
+    def test_store_errors_are_misses(self):
+        def broken(*args):
+            raise RuntimeError("database is locked")
+        cache = PDFTextCache(max_chars=1000)
+        cache.set_store(broken, broken)
+        cache.put("abc", "Text")
+        assert cache.get("abc") == "Text"
+        assert cache.get("other") is None
@@ -0,0 +1,111 @@
+"""
+Unit tests for profile_sync.py
+Tests that the Auth0 profile is reconciled once per identity and that peek never writes
+"""
+from dataclasses import FrozenInstanceError
+from unittest.mock import Mock
+import pytest
+from profile_sync import ProfileSync, UserContext, split_auth0_name, extract_user_name
+
+def make_sync(user=None, **kwargs):
+    users = {"ada@example.com": user if user is not None else {"email": "ada@example.com", "first_name": "Ada"}}
+    load_user = Mock(side_effect=lambda email: dict(users[email]) if email in users else None)
+
+    def update_profile(email, first_name=None, **fields):
+        users[email]['first_name'] = first_name
+        return True
+
+    update = Mock(side_effect=update_profile)
+    invalidate = Mock()
+    options = {'ttl_seconds': 300}
+    options.update(kwargs)
+    return ProfileSync(load_user, update, invalidate, **options), load_user, update, invalidate
+
+TOKEN = {"email": "ada@example.com", "sub": "google-oauth2|1", "name": ["Ada", "Lovelace"], "nickname": "ada"}
+
+class TestAuth0Names:
+    """Test the Auth0 name parsing shared by the profile endpoint and the sync"""
+
+    def test_split_auth0_name(self):
+        assert split_auth0_name({"name": ["Ada", "Lovelace"]}) == ("Ada", "Lovelace")
+        assert split_auth0_name({"name": "Ada King Lovelace"}) == ("Ada", "King Lovelace")
+        assert split_auth0_name({"name": "  "}) == (None, None)
+        assert split_auth0_name({}) == (None, None)
+
+    def test_extract_user_name_fallbacks(self):
+        assert extract_user_name(TOKEN, {"first_name": "Augusta"}) == "Augusta"
+        assert extract_user_name(TOKEN) == "Ada"
+        assert extract_user_name({"nickname": "ada", "email": "x@example.com"}) == "ada"
+        assert extract_user_name({"email": "x@example.com"}) == "x"
+
+class TestProfileSync:
+    """Test the once-per-identity profile reconciliation"""
+
+    def test_resolve_syncs_once_per_identity(self):
+        sync, load_user, update, _ = make_sync()
+        context = sync.resolve(TOKEN)
+        assert context == UserContext(email="ada@example.com", first_name="Ada", sub="google-oauth2|1", synced=True)
+        assert sync.resolve(dict(TOKEN)) is context
+        assert load_user.call_count == 1
+        update.assert_not_called()
+
+    def test_context_is_immutable(self):
+        sync, _, _, _ = make_sync()
+        with pytest.raises(FrozenInstanceError):
+            sync.resolve(TOKEN).first_name = "Someone"
+
+    def test_sync_fixes_email_prefix_name(self):
+        sync, load_user, update, invalidate = make_sync({"email": "ada@example.com", "first_name": "ada"})
+        assert sync.resolve(TOKEN).first_name == "Ada"
+        assert update.call_args.kwargs['last_name'] == "Lovelace"
+        invalidate.assert_called_once_with("ada@example.com")
+        assert sync.stats()['profile_updates'] == 1
+
+    def test_changed_auth0_name_resyncs(self):
+        sync, load_user, _, _ = make_sync()
+        sync.resolve(TOKEN)
+        sync.resolve({**TOKEN, "name": ["Augusta", "King"]})
+        assert load_user.call_count == 2
+
+    def test_update_failure_still_gives_context(self):
+        sync, _, update, _ = make_sync({"email": "ada@example.com", "first_name": None})
+        update.side_effect = Exception("database is locked")
+        assert sync.resolve(TOKEN).first_name == "Ada"
+
+    # a worker that hasn't synced this identity reads the stored name instead of going by the token
+    def test_peek_reads_stored_name_without_writing(self):
+        sync, load_user, update, _ = make_sync({"email": "ada@example.com", "first_name": "Augusta"})
+        context = sync.peek(TOKEN)
+        assert context.first_name == "Augusta" and not context.synced
+        update.assert_not_called()
+        sync.resolve(TOKEN)
+        assert sync.peek(TOKEN).synced
+        assert load_user.call_count == 2
+        stats = sync.stats()
+        assert stats['stored_reads'] == 1 and stats['hits'] == 1 and stats['token_only'] == 0
+
+    def test_peek_falls_back_to_token(self):
+        sync, load_user, _, _ = make_sync()
+        load_user.side_effect = Exception("database is locked")
+        assert sync.peek(TOKEN).first_name == "Ada"
+        assert sync.peek({"email": "new@example.com", "name": ["New"]}).first_name == "New"
+        assert sync.stats()['token_only'] == 2
+
+    def test_remember_from_profile_endpoint(self):
+        sync, load_user, _, _ = make_sync()
+        sync.remember(TOKEN, {"first_name": "Augusta"})
+        assert sync.peek(TOKEN).first_name == "Augusta"
+        load_user.assert_not_called()
+
+    def test_ttl_zero_disables_memo(self):
+        sync, load_user, _, _ = make_sync(ttl_seconds=0)
+        sync.resolve(TOKEN)
+        sync.resolve(TOKEN)
+        assert load_user.call_count == 2
+        assert not sync.peek(TOKEN).synced
+
+    def test_max_entries(self):
+        sync, _, _, _ = make_sync(max_entries=1)
+        sync.remember({"email": "a@example.com"}, None)
+        sync.remember({"email": "b@example.com"}, None)
+        assert sync.stats()['identities'] == 1
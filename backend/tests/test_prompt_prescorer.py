@@ -0,0 +1,54 @@
+"""
+Unit tests for prompt_prescorer.py
+Tests which replies are scored locally and the bypass metrics
+"""
+from prompt_prescorer import PromptPrescorer, normalize_reply
+
+def user(content, **extra):
+    return {"role": "user", "content": content, **extra}
+
+class TestPromptPrescorer:
+    """Test the local scoring stage"""
+
+    def test_normalize_reply(self):
+        assert normalize_reply("  OK!! ") == "ok"
+        assert normalize_reply("I don’t know...") == "i dont know"
+        assert normalize_reply("Help me, please") == "help me please"
+
+    def test_degenerate_reply_is_scored_locally(self):
+        prescorer = PromptPrescorer()
+        result = prescorer.score([user("Explain recursion"), {"role": "assistant", "content": "..."}, user("idk")])
+        assert result is not None
+        quality_score, feedback, message_score = result
+        assert quality_score == message_score == 1.0
+        assert feedback['quality_label'] == 'Poor'
+        assert len(feedback['improvement_tips']) == 3
+
+    # anything with substance (or an attachment) still goes to the model
+    def test_real_prompts_go_to_the_model(self):
+        prescorer = PromptPrescorer()
+        assert prescorer.score([user("ok so how does the merge step work in merge sort?")]) is None
+        assert prescorer.score([user("help me", attachments=[{"filename": "essay.pdf"}])]) is None
+        assert prescorer.score([user("")]) is None
+        # plain answers aren't in the rubric's list
+        assert prescorer.score([user("yes")]) is None
+        assert prescorer.score([user("thanks")]) is None
+
+    # "ok" is a perfectly good answer when I just asked something
+    def test_reply_to_a_question_goes_to_the_model(self):
+        prescorer = PromptPrescorer()
+        assistant = {"role": "assistant", "content": "Recursion is a function calling itself. Want me to continue with an example? "}
+        assert prescorer.score([user("Explain recursion"), assistant, user("ok")]) is None
+        assert prescorer.score([user("Explain recursion"), assistant, user("continue")]) is None
+
+    def test_disabled(self):
+        assert PromptPrescorer(enabled=False).score([user("ok")]) is None
+
+    def test_stats(self):
+        prescorer = PromptPrescorer()
+        prescorer.record_model_call(2.0)
+        prescorer.score([user("ok")])
+        prescorer.score([user("What is a monad in Haskell?")])
+        stats = prescorer.stats()
+        assert stats['bypass_rate'] == 0.5
+        assert stats['estimated_seconds_saved'] == 2.0
@@ -0,0 +1,125 @@
+"""
+Unit tests for speculation.py
+Tests score buckets and the speculative response registry (hits, misses, abandoned and wasted work)
+"""
+import threading
+import time
+from speculation import score_bucket, SpeculativeResponse, SpeculationRegistry
+
+def make_stream(chunks, gate=None):
+    """Stream factory that yields chunks, optionally waiting on an event before each one"""
+    def factory(on_stream=None):
+        for chunk in chunks:
+            if gate is not None:
+                gate.wait(timeout=2)
+            yield chunk
+    return factory
+
+class TestScoreBucket:
+    """Test the score to system prompt mapping"""
+
+    def test_bucket_boundaries(self):
+        assert score_bucket(1.0) == 0
+        assert score_bucket(3.0) == 0
+        assert score_bucket(3.5) == 1
+        assert score_bucket(5.0) == 1
+        assert score_bucket(7.0) == 2
+        assert score_bucket(7.5) == 3
+        assert score_bucket(10.0) == 3
+
+class TestSpeculativeResponse:
+    """Test buffering and following a speculative stream"""
+
+    def test_iter_chunks_returns_whole_stream(self):
+        speculation = SpeculativeResponse("conv-1", 2, "Test", make_stream(["Hello", " ", "there"]))
+        assert "".join(speculation.iter_chunks()) == "Hello there"
+
+    # the consumer can start before the stream has finished
+    def test_iter_chunks_follows_live_stream(self):
+        gate = threading.Event()
+        speculation = SpeculativeResponse("conv-1", 2, "Test", make_stream(["a", "b", "c"], gate))
+        chunks = speculation.iter_chunks()
+        gate.set()
+        assert list(chunks) == ["a", "b", "c"]
+
+    def test_error_is_reraised(self):
+        def failing(on_stream=None):
+            yield "partial"
+            raise RuntimeError("stream broke")
+        speculation = SpeculativeResponse("conv-1", 2, "Test", failing)
+        received = []
+        try:
+            for chunk in speculation.iter_chunks():
+                received.append(chunk)
+            assert False, "expected the stream error"
+        except RuntimeError:
+            pass
+        assert received == ["partial"]
+
+    # cancelling has to close the OpenAI stream itself, a stalled read would never see the cancel flag
+    def test_cancel_closes_upstream(self):
+        upstream_closed = threading.Event()
+
+        class Upstream:
+            def close(self):
+                upstream_closed.set()
+
+        def stalled(on_stream):
+            on_stream(Upstream())
+            yield "a"
+            upstream_closed.wait(timeout=2)
+            raise ConnectionError("stream closed")
+
+        speculation = SpeculativeResponse("conv-1", 2, "Test", stalled)
+        chunks = speculation.iter_chunks()
+        assert next(chunks) == "a"
+        chunks.close()
+        assert upstream_closed.wait(timeout=2)
+        speculation._thread.join(timeout=2)
+        # the read failing because we closed it isn't reported as an error
+        assert speculation.error is None
+
+class TestSpeculationRegistry:
+    """Test claim/miss bookkeeping"""
+
+    def test_claim_hit(self):
+        registry = SpeculationRegistry()
+        registry.start("conv-1", 2, "Test", make_stream(["Hi"]))
+        speculation = registry.claim("conv-1", 2, "Test")
+        assert speculation is not None
+        assert list(speculation.iter_chunks()) == ["Hi"]
+        stats = registry.stats()
+        assert stats['hits'] == 1
+        assert stats['hit_rate'] == 1.0
+        assert stats['active'] == 0
+
+    # the new score landed in a different bucket, so the buffered reply used the wrong system prompt
+    def test_claim_miss_counts_wasted_tokens(self):
+        registry = SpeculationRegistry()
+        speculation = registry.start("conv-1", 2, "Test", make_stream(["one", "two", "three"]))
+        speculation._thread.join(timeout=2)
+        assert registry.claim("conv-1", 3, "Test") is None
+        assert speculation.cancelled
+        stats = registry.stats()
+        assert stats['misses'] == 1
+        assert stats['wasted_tokens'] == 3
+
+    def test_claim_without_speculation(self):
+        registry = SpeculationRegistry()
+        assert registry.claim("conv-1", 2, "Test") is None
+        assert registry.stats()['misses'] == 0
+
+    def test_max_active_skips(self):
+        gate = threading.Event()
+        registry = SpeculationRegistry(max_active=1)
+        assert registry.start("conv-1", 2, None, make_stream(["a"], gate)) is not None
+        assert registry.start("conv-2", 2, None, make_stream(["a"], gate)) is None
+        gate.set()
+        assert registry.stats()['skipped'] == 1
+
+    def test_unclaimed_speculations_expire(self):
+        registry = SpeculationRegistry(ttl_seconds=0.01)
+        registry.start("conv-1", 2, None, make_stream(["a"]))
+        time.sleep(0.02)
+        assert registry.claim("conv-1", 2, None) is None
+        assert registry.stats()['abandoned'] == 1
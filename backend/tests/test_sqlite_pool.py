@@ -0,0 +1,85 @@
+"""
+Unit tests for sqlite_pool.py
+Tests connection reuse, pragma setup and that connections / file descriptors don't leak
+"""
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_pool import SQLiteConnectionPool, count_open_fds
+
+class TestSQLiteConnectionPool:
+    """Test the thread-local SQLite pool"""
+
+    @pytest.fixture
+    def pool(self, tmp_path):
+        pool = SQLiteConnectionPool(str(tmp_path / "pool.db"), cache_size_kib=4096, mmap_size=1 << 20, busy_timeout_ms=1234)
+        yield pool
+        pool.close_all()
+
+    def test_reuses_connection_with_pragmas(self, pool):
+        conn = pool.acquire()
+        pool.release(conn)
+        again = pool.acquire()
+        assert again is conn
+        assert again.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert again.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert again.execute("PRAGMA cache_size").fetchone()[0] == -4096
+        assert again.execute("PRAGMA busy_timeout").fetchone()[0] == 1234
+        pool.release(again)
+        stats = pool.stats()
+        assert stats['opened'] == 1
+        assert stats['reused'] == 1
+        assert stats['checked_out'] == 0
+
+    # an uncommitted transaction must not leak into the next query on this thread
+    def test_release_rolls_back(self, pool):
+        conn = pool.acquire()
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")
+        pool.release(conn)
+        conn = pool.acquire()
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+        pool.release(conn)
+
+    def test_replaces_connection_closed_elsewhere(self, pool):
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        fresh = pool.acquire()
+        assert fresh is not conn
+        assert fresh.execute("SELECT 1").fetchone()[0] == 1
+        pool.release(fresh)
+
+    # lots of short-lived threads shouldn't leave their connections (and file descriptors) behind
+    def test_connections_and_fds_stay_flat_under_load(self, pool):
+        def query(_):
+            conn = pool.acquire()
+            try:
+                return conn.execute("SELECT 1").fetchone()[0]
+            finally:
+                pool.release(conn)
+
+        # warm up one round so the baseline includes the WAL/shm files
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(query, range(20)))
+        baseline_fds = count_open_fds()
+
+        for _ in range(10):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                assert sum(executor.map(query, range(50))) == 50
+        # the next checkout sweeps the connections of the threads that exited
+        pool.release(pool.acquire())
+
+        stats = pool.stats()
+        assert stats['checked_out'] == 0
+        assert stats['open_connections'] <= threading.active_count()
+        assert stats['opened'] - stats['closed'] == stats['open_connections']
+        if baseline_fds != -1:
+            assert count_open_fds() <= baseline_fds + 3
+
+    def test_close_all(self, pool):
+        pool.release(pool.acquire())
+        pool.close_all()
+        assert pool.stats()['open_connections'] == 0
+        assert pool.stats()['closed'] == pool.stats()['opened']
@@ -0,0 +1,126 @@
+"""
+Unit tests for sse.py
+Tests the SSE formatting and how already-available text is split into frames
+"""
+import asyncio
+import hashlib
+import json
+import time
+import pytest
+from sse import sse_event, text_frames, write_frames, awrite_frames, SSEWriter, SSEStats
+
+class TestTextFrames:
+    """Test framing of a non-streamed answer"""
+
+    def test_frames_rejoin_to_the_text(self):
+        text = " ".join(f"word{i}" for i in range(600))
+        frames = list(text_frames(text, 512))
+        assert "".join(frames) == text
+        assert all(len(frame) <= 512 for frame in frames)
+        # about 4.5KB of text is ~10 frames instead of 300 two-word chunks
+        assert len(frames) <= 10
+
+    def test_breaks_after_whitespace(self):
+        frames = list(text_frames("alpha beta\ngamma delta", 12))
+        assert frames == ["alpha beta\n", "gamma delta"]
+
+    def test_long_word_is_split(self):
+        assert list(text_frames("x" * 10, 4)) == ["xxxx", "xxxx", "xx"]
+
+    def test_empty_text(self):
+        assert list(text_frames("", 512)) == []
+
+    def test_sse_event(self):
+        event = sse_event({'chunk': 'hi'})
+        assert event.startswith("data: ") and event.endswith("\n\n")
+        assert json.loads(event[len("data: "):]) == {'chunk': 'hi'}
+        assert event == 'data: {"chunk":"hi"}\n\n'
+
+class TestSSEWriter:
+    """Test coalescing streamed deltas into frames"""
+
+    def payloads(self, frames):
+        return [json.loads(frame[len("data: "):]) for frame in frames if frame]
+
+    def test_coalesces_by_size(self):
+        stats = SSEStats()
+        writer = SSEWriter(max_bytes=64, flush_interval=60, stats=stats)
+        deltas = ["ab"] * 200
+        frames = [writer.add(delta) for delta in deltas] + [writer.flush()]
+        chunks = [p['chunk'] for p in self.payloads(frames)]
+
+        # the first delta goes out on its own right away, then 64 byte frames
+        assert chunks[0] == "ab"
+        assert "".join(chunks) == "ab" * 200
+        assert len(chunks) <= 8
+
+        done = json.loads(writer.done()[len("data: "):])
+        assert done == {'done': True, 'length': 400, 'sha256': hashlib.sha256(("ab" * 200).encode()).hexdigest()}
+        assert stats.stats()['responses'] == 1
+        assert stats.stats()['avg_deltas'] == 200
+
+    # with no interval every delta is its own frame, like before
+    def test_flush_interval(self):
+        writer = SSEWriter(max_bytes=1024, flush_interval=0)
+        frames = [writer.add(delta) for delta in ["a", "", "b", "c"]]
+        assert [p['chunk'] for p in self.payloads(frames)] == ["a", "b", "c"]
+        assert writer.flush() is None
+        assert writer.text == "abc"
+
+    def test_fewer_bytes_than_one_event_per_delta(self):
+        deltas = [f"tok{i} " for i in range(500)]
+        writer = SSEWriter(max_bytes=1024, flush_interval=60)
+        for delta in deltas:
+            writer.add(delta)
+        writer.flush()
+        writer.done()
+        text = "".join(deltas)
+        old_bytes = sum(len(sse_event({'chunk': d})) for d in deltas) + len(sse_event({'done': True, 'full_response': text}))
+        assert writer.bytes_sent < old_bytes / 2
+        assert writer.frames < 10
+
+class TestWriteFrames:
+    """Test that buffered text goes out on the interval even while the upstream stalls"""
+
+    def payload(self, frame):
+        return json.loads(frame[len("data: "):])
+
+    def stalling_deltas(self):
+        yield "a"
+        yield "b"
+        time.sleep(0.5)
+        yield "c"
+
+    def test_flushes_during_stall(self):
+        writer = SSEWriter(max_bytes=1024, flush_interval=0.05)
+        started = time.monotonic()
+        arrivals = [(self.payload(frame)['chunk'], time.monotonic() - started) for frame in write_frames(self.stalling_deltas(), writer)]
+        # "b" was buffered behind "a" and shouldn't have to wait for "c"
+        assert [chunk for chunk, _ in arrivals] == ["a", "b", "c"]
+        assert arrivals[1][1] < 0.3
+        assert writer.flush() is None
+
+    def test_stream_error_is_raised(self):
+        def failing():
+            yield "a"
+            raise ValueError("upstream broke")
+        writer = SSEWriter(max_bytes=1024, flush_interval=0.05)
+        with pytest.raises(ValueError):
+            list(write_frames(failing(), writer))
+        assert writer.text == "a"
+
+    def test_async_flushes_during_stall(self):
+        async def deltas():
+            yield "a"
+            yield "b"
+            await asyncio.sleep(0.5)
+            yield "c"
+
+        async def go():
+            writer = SSEWriter(max_bytes=1024, flush_interval=0.05)
+            started = time.monotonic()
+            return [(self.payload(frame)['chunk'], time.monotonic() - started) async for frame in awrite_frames(deltas(), writer)]
+
+        arrivals = asyncio.run(go())
+        assert [chunk for chunk, _ in arrivals] == ["a", "b", "c"]
+        assert arrivals[1][1] < 0.3
@@ -0,0 +1,114 @@
+"""
+Unit tests for user_cache.py
+Tests the read-through user cache, invalidation and the batched last_login writes
+"""
+import threading
+from unittest.mock import Mock
+from user_cache import UserCache
+
+def make_cache(**kwargs):
+    users = {"a@example.com": {"email": "a@example.com", "first_name": "Ada", "last_login": "2024-01-01 00:00:00"}}
+    load_user = Mock(side_effect=lambda email: dict(users[email]) if email in users else None)
+    write_logins = Mock(side_effect=lambda logins: len(logins))
+    options = {'ttl_seconds': 300, 'flush_interval': 3600}
+    options.update(kwargs)
+    return UserCache(load_user, write_logins, **options), users, load_user, write_logins
+
+class TestUserCache:
+    """Test the per-process user cache"""
+
+    def test_read_through(self):
+        cache, _, load_user, _ = make_cache()
+        assert cache.get("a@example.com")['first_name'] == "Ada"
+        assert cache.get("a@example.com")['first_name'] == "Ada"
+        assert load_user.call_count == 1
+        assert cache.stats()['hit_rate'] == 0.5
+        # misses aren't cached, the user may be created any moment
+        assert cache.get("nobody@example.com") is None
+        assert cache.get("nobody@example.com") is None
+        assert load_user.call_count == 3
+
+    def test_returns_copies(self):
+        cache, _, _, _ = make_cache()
+        cache.get("a@example.com")['first_name'] = "Changed"
+        assert cache.get("a@example.com")['first_name'] == "Ada"
+
+    def test_invalidate_reloads(self):
+        cache, users, load_user, _ = make_cache()
+        cache.get("a@example.com")
+        users["a@example.com"]['first_name'] = "Grace"
+        cache.invalidate("a@example.com")
+        assert cache.get("a@example.com")['first_name'] == "Grace"
+        assert load_user.call_count == 2
+
+    # a read that was in flight when the profile changed must not put the old row back in the cache
+    def test_invalidation_during_load_is_not_cached(self):
+        cache, users, load_user, _ = make_cache()
+        def racing_load(email):
+            row = dict(users[email])
+            cache.invalidate(email)
+            return row
+        load_user.side_effect = racing_load
+        cache.get("a@example.com")
+        assert cache.stats()['entries'] == 0
+
+    # versions only exist while a read is in flight, invalidating lots of users doesn't grow anything
+    def test_versions_dont_accumulate(self):
+        cache, _, load_user, _ = make_cache()
+        cache.get("a@example.com")
+        for i in range(100):
+            cache.invalidate(f"user{i}@example.com")
+        cache.invalidate("a@example.com")
+        assert cache._versions == {} and cache._loading == {}
+        load_user.side_effect = lambda email: cache.invalidate(email) or {"email": email}
+        cache.get("a@example.com")
+        assert cache._versions == {} and cache._loading == {}
+
+    def test_ttl_zero_disables_caching(self):
+        cache, _, load_user, _ = make_cache(ttl_seconds=0)
+        cache.get("a@example.com")
+        cache.get("a@example.com")
+        assert load_user.call_count == 2
+
+    def test_logins_are_batched(self):
+        cache, _, load_user, write_logins = make_cache()
+        cache.get("a@example.com")
+        for _ in range(5):
+            cache.record_login("a@example.com")
+        cache.record_login("b@example.com")
+
+        # the cached row shows the new last_login without a database round trip
+        assert cache.get("a@example.com")['last_login'] != "2024-01-01 00:00:00"
+        assert load_user.call_count == 1
+        write_logins.assert_not_called()
+
+        assert cache.flush_pending_logins() == 2
+        write_logins.assert_called_once()
+        assert set(write_logins.call_args[0][0]) == {"a@example.com", "b@example.com"}
+        assert cache.flush_pending_logins() == 0
+        stats = cache.stats()
+        assert stats['logins_recorded'] == 6
+        assert stats['logins_flushed'] == 2
+        assert stats['flushes'] == 1
+
+    def test_failed_flush_is_retried(self):
+        cache, _, _, write_logins = make_cache()
+        write_logins.side_effect = RuntimeError("database is locked")
+        cache.record_login("a@example.com")
+        assert cache.flush_pending_logins() == 0
+        assert cache.stats()['pending_logins'] == 1
+        write_logins.side_effect = None
+        assert cache.flush_pending_logins() == 1
+
+    def test_background_flush(self):
+        cache, _, _, write_logins = make_cache(flush_interval=0.01)
+        flushed = threading.Event()
+        write_logins.side_effect = lambda logins: flushed.set()
+        cache.record_login("a@example.com")
+        assert flushed.wait(2)
+        cache.stop()
+
+    def test_flush_interval_zero_writes_through(self):
+        cache, _, _, write_logins = make_cache(flush_interval=0)
+        cache.record_login("a@example.com")
+        write_logins.assert_called_once()
@@ -0,0 +1,157 @@
+# Per-process cache of user rows. /api/user/profile runs on every page load and /response needs the
+# user's name before every reply, and both used to read the users table each time (the profile endpoint
+# also wrote last_login and read the row back). Rows are cached with a TTL, profile changes invalidate them
+# (a version counter, kept only while a read is in flight, makes sure a read that raced an invalidation isn't
+# cached), and last_login stamps are
+# queued and written in one batched UPDATE every LAST_LOGIN_FLUSH_SECONDS.
+#
+# The TTL is what bounds staleness across gunicorn workers, since an invalidation only reaches this process.
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+
+class UserCache:
+    """Read-through user cache with coalesced last_login writes"""
+
+    def __init__(self, load_user: Callable[[str], Optional[Dict]], write_logins: Callable[[Dict[str, str]], int],
+                 ttl_seconds: float = 300, max_entries: int = 10000, flush_interval: float = 30):
+        self._load_user = load_user
+        self._write_logins = write_logins
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()  # email -> (user, expires_at)
+        self._versions = {}  # email -> bumped on every invalidation, only while a read for it is in flight
+        self._loading = {}  # email -> reads in flight, the version goes away with the last one
+        self._pending_logins = {}  # email -> last_login not written yet
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.logins_recorded = 0
+        self.logins_flushed = 0
+        self.flushes = 0
+        self.flush_failures = 0
+
+    def get(self, email: str) -> Optional[Dict]:
+        """The user's row (a copy), from the cache if it's fresh"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return dict(entry[0])
+            self.misses += 1
+            self._loading[email] = self._loading.get(email, 0) + 1
+            version = self._versions.get(email, 0)
+
+        user = None
+        try:
+            user = self._load_user(email)
+        finally:
+            with self._lock:
+                # if the user was invalidated while we were reading, what we read may already be stale
+                fresh = self._versions.get(email, 0) == version
+                self._loading[email] -= 1
+                if not self._loading[email]:
+                    del self._loading[email]
+                    self._versions.pop(email, None)
+                if user is not None:
+                    # a login that hasn't been flushed yet is newer than what the database has
+                    if email in self._pending_logins:
+                        user = {**user, 'last_login': self._pending_logins[email]}
+                    if self.ttl_seconds > 0 and fresh:
+                        self._entries[email] = (user, now + self.ttl_seconds)
+                        self._entries.move_to_end(email)
+                        while len(self._entries) > self.max_entries:
+                            self._entries.popitem(last=False)
+        return dict(user) if user is not None else None
+
+    def invalidate(self, email: str) -> None:
+        """Drop the cached row after the user's profile changed"""
+        with self._lock:
+            # nothing to bump when no read is in flight, the dropped entry is all there is
+            if email in self._loading:
+                self._versions[email] = self._versions.get(email, 0) + 1
+            self._entries.pop(email, None)
+            self.invalidations += 1
+
+    def record_login(self, email: str) -> None:
+        """Stamp last_login now, written to the database with the next batch"""
+        stamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._pending_logins[email] = stamp
+            self.logins_recorded += 1
+            entry = self._entries.get(email)
+            if entry is not None:
+                self._entries[email] = ({**entry[0], 'last_login': stamp}, entry[1])
+        if self.flush_interval <= 0:
+            self.flush_pending_logins()
+        else:
+            self._ensure_flusher()
+
+    def flush_pending_logins(self) -> int:
+        """Write every queued last_login in one statement, returns how many were written"""
+        with self._lock:
+            batch = self._pending_logins
+            self._pending_logins = {}
+        if not batch:
+            return 0
+        try:
+            self._write_logins(batch)
+        except Exception as e:
+            print(f"WARNING: Failed to flush {len(batch)} last_login update(s): {e}")
+            with self._lock:
+                self.flush_failures += 1
+                # try again next time, unless a newer login was recorded in the meantime
+                for email, stamp in batch.items():
+                    self._pending_logins.setdefault(email, stamp)
+            return 0
+        with self._lock:
+            self.flushes += 1
+            self.logins_flushed += len(batch)
+        return len(batch)
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="last-login-flusher", daemon=True)
+            self._flusher.start()
+        # don't lose the queued logins when the worker shuts down
+        atexit.register(self.flush_pending_logins)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush_pending_logins()
+
+    def stop(self) -> None:
+        """Stop the background flusher and write what's queued"""
+        self._stop.set()
+        self.flush_pending_logins()
+
+    def stats(self) -> Dict:
+        """Hit rate and how well the last_login writes are being coalesced"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'logins_recorded': self.logins_recorded,
+                'logins_flushed': self.logins_flushed,
+                'pending_logins': len(self._pending_logins),
+                'flushes': self.flushes,
+                'flush_failures': self.flush_failures,
+            }
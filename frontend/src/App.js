@@ -29,6 +29,9 @@ function App() {
   // state management
   const [conversations, setConversations] = useState([]);
   const [conversationsLoading, setConversationsLoading] = useState(false);
+  const [conversationsCursor, setConversationsCursor] = useState(null); // next_cursor from the last page, null when there's nothing older
+  const [loadingMoreConversations, setLoadingMoreConversations] =
+    useState(false);
   const [currentConversationId, setCurrentConversationId] = useState(null);
   const [messages, setMessages] = useState([]);
   const [qualityScore, setQualityScore] = useState(null);
@@ -42,6 +45,8 @@ function App() {
 
   // Use refs to store latest callbacks without triggering re-renders
   const loadConversationsRef = useRef();
+  const syncConversationsRef = useRef();
+  const conversationsVersionRef = useRef(null); // server's conversation list version as of our last load/sync
   const loadConversationRef = useRef();
   const isSendingMessageRef = useRef(false); // Track if we're currently sending a message
   const abortControllerRef = useRef(null); // Track active streaming request for abort capability
@@ -57,14 +62,16 @@ function App() {
     return () => window.removeEventListener("resize", handleResize);
   }, []);
 
-  // gets all the convos
+  // gets the first page of convos (newest first), older ones come in with loadMoreConversations
   const loadConversations = useCallback(async () => {
     if (!isAuthenticated) return;
     // displays the loading state
     setConversationsLoading(true);
     try {
       const data = await apiService.getConversations();
-      setConversations(data || []);
+      setConversations(data?.conversations || []);
+      setConversationsCursor(data?.next_cursor || null);
+      conversationsVersionRef.current = data?.version ?? null;
     } catch (error) {
       console.error("Error loading conversations:", error);
       // Don't clear conversations on error - keep existing ones
@@ -76,6 +83,65 @@ function App() {
 
   loadConversationsRef.current = loadConversations;
 
+  // gets the next page when the user asks for older conversations
+  const loadMoreConversations = useCallback(async () => {
+    if (!conversationsCursor || loadingMoreConversations) return;
+    setLoadingMoreConversations(true);
+    try {
+      const data = await apiService.getConversations(conversationsCursor);
+      const page = data?.conversations || [];
+      setConversations((prevConvs) => {
+        // a conversation can already be in the list if it was updated (and moved to the top) since the last page
+        const known = new Set(prevConvs.map((conv) => conv.conversation_id));
+        return [
+          ...prevConvs,
+          ...page.filter((conv) => !known.has(conv.conversation_id)),
+        ];
+      });
+      setConversationsCursor(data?.next_cursor || null);
+    } catch (error) {
+      console.error("Error loading more conversations:", error);
+    } finally {
+      setLoadingMoreConversations(false);
+    }
+  }, [conversationsCursor, loadingMoreConversations, apiService]);
+
+  // pulls only the conversations that changed since the last load/sync instead of the whole list
+  // (falls back to a full reload if we have no version yet or the server says there's too much to catch up on)
+  const syncConversations = useCallback(async () => {
+    if (!isAuthenticated) return;
+    if (conversationsVersionRef.current === null) {
+      await loadConversations();
+      return;
+    }
+    try {
+      const data = await apiService.getConversationChanges(
+        conversationsVersionRef.current
+      );
+      if (data.reset) {
+        await loadConversations();
+        return;
+      }
+      conversationsVersionRef.current = data.version;
+      const changedIds = new Set([
+        ...data.deleted,
+        ...data.upserted.map((conv) => conv.conversation_id),
+      ]);
+      // anything that changed was just updated, so it goes to the top (newest first)
+      const upserted = [...data.upserted].sort((a, b) =>
+        (b.updated_at || "").localeCompare(a.updated_at || "")
+      );
+      setConversations((prevConvs) => [
+        ...upserted,
+        ...prevConvs.filter((conv) => !changedIds.has(conv.conversation_id)),
+      ]);
+    } catch (error) {
+      console.error("Error syncing conversations:", error);
+    }
+  }, [isAuthenticated, apiService, loadConversations]);
+
+  syncConversationsRef.current = syncConversations;
+
   // gets the specific convos when user clicks on a conversation
   const loadConversation = useCallback(
     async (conversationId) => {
@@ -382,6 +448,9 @@ function App() {
           // Message sending is complete, allow loadConversation to run again
           isSendingMessageRef.current = false;
           setLoading(false);
+
+          // swap the optimistic sidebar entry for what the server saved (only the changed rows come back)
+          syncConversationsRef.current?.();
         },
         // onError callback
         (errorData) => {
@@ -582,8 +651,8 @@ function App() {
         setIsTerse(false);
       }
 
-      // Reload conversations list after we delete to reflect the deletion
-      await loadConversations();
+      // Sync the conversations list after we delete to reflect the deletion (just the tombstone comes back)
+      await syncConversations();
     } catch (error) {
       console.error("Error deleting conversation:", error);
       let errorMessage = "Failed to delete conversation. ";
@@ -649,6 +718,9 @@ function App() {
           onCreateNew={createNewConversation}
           onDeleteConversation={handleDeleteClick}
           loading={conversationsLoading}
+          hasMore={conversationsCursor !== null}
+          loadingMore={loadingMoreConversations}
+          onLoadMore={loadMoreConversations}
           isNewConversation={messages.length === 0}
           isStreaming={isStreaming}
         />
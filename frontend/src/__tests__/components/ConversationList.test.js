@@ -215,4 +215,28 @@ describe("ConversationList", () => {
     render(<ConversationList {...defaultProps} conversations={noTitleConv} />);
     expect(screen.getByText("New Conversation")).toBeInTheDocument();
   });
+
+  // older conversations are paged in from the server
+  it("should call onLoadMore when there are older conversations", () => {
+    const onLoadMore = jest.fn();
+    render(
+      <ConversationList
+        {...defaultProps}
+        conversations={mockConversations}
+        hasMore={true}
+        onLoadMore={onLoadMore}
+      />
+    );
+    fireEvent.click(screen.getByText("Load older conversations"));
+    expect(onLoadMore).toHaveBeenCalled();
+  });
+
+  it("should not show load more on the last page", () => {
+    render(
+      <ConversationList {...defaultProps} conversations={mockConversations} />
+    );
+    expect(
+      screen.queryByText("Load older conversations")
+    ).not.toBeInTheDocument();
+  });
 });
@@ -95,7 +95,10 @@ describe("createApiService", () => {
 
   describe("getConversations", () => {
     it("should make GET request to /conversations", async () => {
-      const mockData = [{ conversation_id: "1", title: "Test" }];
+      const mockData = {
+        conversations: [{ conversation_id: "1", title: "Test" }],
+        next_cursor: null,
+      };
       mockAxiosInstance.get.mockResolvedValue({ data: mockData });
 
       const result = await apiService.getConversations();
@@ -106,17 +109,39 @@ describe("createApiService", () => {
       expect(result).toEqual(mockData);
     });
 
-    it("should include limit and offset in params", async () => {
-      mockAxiosInstance.get.mockResolvedValue({ data: [] });
+    it("should include cursor and limit in params", async () => {
+      mockAxiosInstance.get.mockResolvedValue({
+        data: { conversations: [], next_cursor: null },
+      });
 
-      await apiService.getConversations(10, 5);
+      await apiService.getConversations("abc", 10);
 
       expect(mockAxiosInstance.get).toHaveBeenCalledWith("/conversations", {
-        params: { limit: 10, offset: 5 },
+        params: { cursor: "abc", limit: 10 },
       });
     });
   });
 
+  describe("getConversationChanges", () => {
+    it("should pass the version as since", async () => {
+      const mockData = {
+        version: 9,
+        upserted: [{ conversation_id: "1", title: "Test" }],
+        deleted: ["2"],
+        reset: false,
+      };
+      mockAxiosInstance.get.mockResolvedValue({ data: mockData });
+
+      const result = await apiService.getConversationChanges(5);
+
+      expect(mockAxiosInstance.get).toHaveBeenCalledWith(
+        "/conversations/changes",
+        { params: { since: 5 } }
+      );
+      expect(result).toEqual(mockData);
+    });
+  });
+
   describe("getConversation", () => {
     it("should make GET request to /conversations/:id", async () => {
       const mockData = { conversation_id: "1", messages: [] };
@@ -200,7 +225,7 @@ describe("createApiService", () => {
       const mockChunks = [
         'data: {"chunk":"Hello"}\n\n',
         'data: {"chunk":" world"}\n\n',
-        'data: {"done":true,"full_response":"Hello world"}\n\n',
+        'data: {"done":true,"length":11,"sha256":"64ec88ca00b268e5ba1a35678a1b5316d212f4f366b2477232534a8aeca37f3c"}\n\n',
       ];
 
       global.fetch = jest.fn().mockResolvedValue({
@@ -236,6 +261,8 @@ describe("createApiService", () => {
       );
 
       expect(chunks.length).toBeGreaterThan(0);
+      // the full answer is rebuilt from the chunks
+      expect(onComplete).toHaveBeenCalledWith("Hello world");
     });
 
     it("should pass AbortController signal to fetch", async () => {
@@ -13,6 +13,9 @@ const ConversationList = ({
   onCreateNew,
   onDeleteConversation,
   loading = false,
+  hasMore = false,
+  loadingMore = false,
+  onLoadMore,
   isNewConversation = false,
   isStreaming = false,
 }) => {
@@ -197,6 +200,16 @@ const ConversationList = ({
             </div>
           ))
         )}
+        {/* Older conversations are fetched a page at a time */}
+        {!loading && hasMore && (
+          <button
+            className="load-more-conversations"
+            onClick={() => onLoadMore && onLoadMore()}
+            disabled={loadingMore}
+          >
+            {loadingMore ? "Loading..." : "Load older conversations"}
+          </button>
+        )}
       </div>
       {showTooltip &&
         createPortal(
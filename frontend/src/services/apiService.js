@@ -66,17 +66,29 @@ export const createApiService = (getAccessTokenSilently) => {
   );
 
   return {
-    // Get all conversations (with optional pagination that i didnt end up implementing)
-    getConversations: async (limit = null, offset = 0) => {
+    // Get one page of conversations, newest first - returns { conversations, next_cursor }
+    // pass next_cursor back in to get the next page (it's null on the last one), the server picks the page size by default
+    getConversations: async (cursor = null, limit = null) => {
       const params = {};
+      if (cursor !== null) {
+        params.cursor = cursor;
+      }
       if (limit !== null) {
         params.limit = limit;
-        params.offset = offset;
       }
       const response = await api.get("/conversations", { params });
       return response.data;
     },
 
+    // Get what changed in the conversation list since a version (from getConversations or the last call)
+    // returns { version, upserted, deleted, reset } - reset means reload the list with getConversations instead
+    getConversationChanges: async (since) => {
+      const response = await api.get("/conversations/changes", {
+        params: { since },
+      });
+      return response.data;
+    },
+
     // Get a specific conversation (with optional message limit for faster loading)
     // By default, loads all messages since conversations are capped at 20 user messages
     getConversation: async (conversationId, limitMessages = null) => {
@@ -158,6 +170,8 @@ export const createApiService = (getAccessTokenSilently) => {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = "";
+        // the done event only has the length/hash, so the answer is put together from the chunks
+        const received = [];
 
         // reads the chunks of the response - the streaming that I wanted to implement
         while (true) {
@@ -178,13 +192,19 @@ export const createApiService = (getAccessTokenSilently) => {
                   return;
                 }
 
-                if (data.chunk && onChunk) {
+                if (data.chunk) {
+                  received.push(data.chunk);
                   // Call onChunk immediately for each chunk
-                  onChunk(data.chunk);
+                  if (onChunk) onChunk(data.chunk);
                 }
 
                 if (data.done && onComplete) {
-                  onComplete(data.full_response);
+                  const fullResponse = data.full_response ?? received.join("");
+                  // length is in characters (code points) like the backend counts them
+                  if (data.length !== undefined && [...fullResponse].length !== data.length) {
+                    console.warn("Streamed response is incomplete", data.length, [...fullResponse].length);
+                  }
+                  onComplete(fullResponse);
                   return;
                 }
               } catch (e) {
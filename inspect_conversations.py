@@ -23,6 +23,9 @@ def inspect_conversations(db_path="backend/promptly.db"):
         cursor.execute("PRAGMA table_info(conversations)")
         conv_columns = [col[1] for col in cursor.fetchall()]
         print(f"Columns: {', '.join(conv_columns)}")
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = [row[0] for row in cursor.fetchall()]
         print()
         
         # Inspect conversations table and print out all data about it
@@ -43,6 +46,16 @@ def inspect_conversations(db_path="backend/promptly.db"):
                         # Parse and display messages in detail
                         try:
                             messages = json.loads(value) if value else []
+                            # messages live in their own table now, the blob is only filled for old rows
+                            if not messages and "messages" in tables:
+                                cursor.execute(
+                                    "SELECT role, content, timestamp FROM messages WHERE conversation_id = ? ORDER BY seq",
+                                    (conv[conv_columns.index("conversation_id")],)
+                                )
+                                messages = [
+                                    {"role": row[0], "content": row[1] or "", "timestamp": row[2] or "no timestamp"}
+                                    for row in cursor.fetchall()
+                                ]
                             print(f"  {col_name}: {len(messages)} message(s)")
                             for j, msg in enumerate(messages):
                                 role = msg.get('role', 'unknown')